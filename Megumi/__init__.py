@@ -91,6 +91,13 @@ if ENV:
     SUPPORT_CHAT = os.environ.get('SUPPORT_CHAT', None)
     SPAMWATCH_SUPPORT_CHAT = os.environ.get('SPAMWATCH_SUPPORT_CHAT', None)
     SPAMWATCH_API = os.environ.get('SPAMWATCH_API', None)
+    # updates per second (and burst) handled for any one chat / user
+    UPDATE_CHAT_RATE = float(os.environ.get('UPDATE_CHAT_RATE', 10))
+    UPDATE_CHAT_BURST = int(os.environ.get('UPDATE_CHAT_BURST', 20))
+    UPDATE_USER_RATE = float(os.environ.get('UPDATE_USER_RATE', 5))
+    UPDATE_USER_BURST = int(os.environ.get('UPDATE_USER_BURST', 10))
+    # joins per minute above which a chat is treated as raided
+    RAID_JOIN_RATE = int(os.environ.get('RAID_JOIN_RATE', 30))
 
     try:
         BL_CHATS = set(int(x) for x in os.environ.get('BL_CHATS', "").split())
@@ -158,6 +165,11 @@ else:
     SUPPORT_CHAT = Config.SUPPORT_CHAT
     SPAMWATCH_SUPPORT_CHAT = Config.SPAMWATCH_SUPPORT_CHAT
     SPAMWATCH_API = Config.SPAMWATCH_API
+    UPDATE_CHAT_RATE = getattr(Config, 'UPDATE_CHAT_RATE', 10)
+    UPDATE_CHAT_BURST = getattr(Config, 'UPDATE_CHAT_BURST', 20)
+    UPDATE_USER_RATE = getattr(Config, 'UPDATE_USER_RATE', 5)
+    UPDATE_USER_BURST = getattr(Config, 'UPDATE_USER_BURST', 10)
+    RAID_JOIN_RATE = getattr(Config, 'RAID_JOIN_RATE', 30)
 
     try:
         BL_CHATS = set(int(x) for x in Config.BL_CHATS or [])
@@ -178,18 +190,35 @@ updater = tg.Updater(TOKEN, workers=WORKERS, use_context=True)
 telethn = TelegramClient("megumi", API_ID, API_HASH)
 dispatcher = updater.dispatcher
 
-SUDO_USERS = list(SUDO_USERS) + list(DEV_USERS)
-DEV_USERS = list(DEV_USERS)
-WHITELIST_USERS = list(WHITELIST_USERS)
-SUPPORT_USERS = list(SUPPORT_USERS)
-TIGER_USERS = list(TIGER_USERS)
+# one user_id -> rank registry behind live views; disasters.py changes it and
+# every module importing these sees the change at once
+from Megumi.modules.helper_funcs import privileges
+
+privileges.load_ranks({
+    privileges.WHITELIST: WHITELIST_USERS,
+    privileges.TIGER: TIGER_USERS,
+    privileges.SUPPORT: SUPPORT_USERS,
+    privileges.SUDO: SUDO_USERS,
+    privileges.DEV: DEV_USERS
+})
+
+SUDO_USERS = privileges.RankView(privileges.SUDO, privileges.DEV)
+DEV_USERS = privileges.RankView(privileges.DEV)
+WHITELIST_USERS = privileges.RankView(privileges.WHITELIST)
+SUPPORT_USERS = privileges.RankView(privileges.SUPPORT)
+TIGER_USERS = privileges.RankView(privileges.TIGER)
 
 # Load at end to ensure all prev variables have been set
 from Megumi.modules.helper_funcs.handlers import (CustomCommandHandler,
                                                         CustomMessageHandler,
-                                                        CustomRegexHandler)
+                                                        CustomRegexHandler,
+                                                        add_handler,
+                                                        remove_handler)
 
 # make sure the regex handler can take extra kwargs
 tg.RegexHandler = CustomRegexHandler
 tg.CommandHandler = CustomCommandHandler
 tg.MessageHandler = CustomMessageHandler
+# keep the command routing index in step with the registered handlers
+tg.Dispatcher.add_handler = add_handler
+tg.Dispatcher.remove_handler = remove_handler
@@ -1,5 +1,6 @@
 import importlib
 import re
+import time
 from sys import argv
 from typing import Optional
 
@@ -9,14 +10,19 @@ from Megumi import (ALLOW_EXCL, CERT_PATH, DONATION_LINK, LOGGER,
 # needed to dynamically load modules
 # NOTE: Module order is not guaranteed, specify that in the config file!
 from Megumi.modules import ALL_MODULES
-from Megumi.modules.helper_funcs.chat_status import is_user_admin
+from Megumi.modules.helper_funcs.chat_status import (is_known_admin,
+                                                     is_user_admin)
+from Megumi.modules.helper_funcs.handlers import extract_command, route
+from Megumi.modules.helper_funcs.update_limiter import (allow_update,
+                                                        record_latency)
 from Megumi.modules.helper_funcs.misc import paginate_modules
+from Megumi.modules.sql import users_sql
 from telegram import (InlineKeyboardButton, InlineKeyboardMarkup, ParseMode,
                       Update)
 from telegram.error import (BadRequest, ChatMigrated, NetworkError,
                             TelegramError, TimedOut, Unauthorized)
 from telegram.ext import (CallbackContext, CallbackQueryHandler, CommandHandler,
-                          Filters, MessageHandler)
+                          Dispatcher, Filters, MessageHandler)
 from telegram.ext.dispatcher import DispatcherHandlerStop, run_async
 from telegram.utils.helpers import escape_markdown
 
@@ -494,19 +500,29 @@ def main():
 
     dispatcher.add_error_handler(error_callback)
 
+    # chat_member updates are only sent when asked for, the admin caches need them
+    allowed_updates = Update.ALL_TYPES
+
     if WEBHOOK:
         LOGGER.info("Using webhooks.")
         updater.start_webhook(listen="127.0.0.1", port=PORT, url_path=TOKEN)
 
         if CERT_PATH:
             updater.bot.set_webhook(
-                url=URL + TOKEN, certificate=open(CERT_PATH, 'rb'))
+                url=URL + TOKEN,
+                certificate=open(CERT_PATH, 'rb'),
+                allowed_updates=allowed_updates)
         else:
-            updater.bot.set_webhook(url=URL + TOKEN)
+            updater.bot.set_webhook(
+                url=URL + TOKEN, allowed_updates=allowed_updates)
 
     else:
         LOGGER.info("Using long polling.")
-        updater.start_polling(timeout=15, read_latency=4, clean=True)
+        updater.start_polling(
+            timeout=15,
+            read_latency=4,
+            clean=True,
+            allowed_updates=allowed_updates)
 
     if len(argv) not in (1, 3, 4):
         telethn.disconnect()
@@ -515,9 +531,8 @@ def main():
 
     updater.idle()
 
-
-CHATS_CNT = {}
-CHATS_TIME = {}
+    # anything log_user buffered since the last flush job would be lost
+    users_sql.flush_users()
 
 
 def process_update(self, update):
@@ -529,25 +544,24 @@ def process_update(self, update):
             self.logger.exception('An uncaught error was raised while handling the error')
         return
 
-    now = datetime.datetime.utcnow()
-    cnt = CHATS_CNT.get(update.effective_chat.id, 0)
-
-    t = CHATS_TIME.get(update.effective_chat.id, datetime.datetime(1970, 1, 1))
-    if t and now > t + datetime.timedelta(0, 1):
-        CHATS_TIME[update.effective_chat.id] = now
-        cnt = 0
-    else:
-        cnt += 1
-
-    if cnt > 10:
-        return
+    # parse the command once; only handlers registered for it get to look at the update
+    command = extract_command(update, self.bot.username)
+    # over the rate limit only moderation handlers run, floods still get cleaned up
+    over_rate = not allow_update(update, command, is_known_admin)
 
-    CHATS_CNT[update.effective_chat.id] = cnt
+    start = time.monotonic()
+    context = None
+    handled = False
     for group in self.groups:
         try:
-            for handler in (x for x in self.handlers[group] if x.check_update(update)):
-                handler.handle_update(update, self)
-                break
+            for handler in route(self, group, command, over_rate):
+                check = handler.check_update(update)
+                if check is not None and check is not False:
+                    if not context and self.use_context:
+                        context = CallbackContext.from_update(update, self)
+                    handled = True
+                    handler.handle_update(update, self, check, context)
+                    break
 
         # Stop processing with any other handler.
         except DispatcherHandlerStop:
@@ -555,20 +569,22 @@ def process_update(self, update):
             break
 
         # Dispatch any error.
-        except TelegramError as te:
-            self.logger.warning('A TelegramError was raised while processing the Update')
-
+        except Exception as excp:
             try:
-                self.dispatch_error(update, te)
+                self.dispatch_error(update, excp)
             except DispatcherHandlerStop:
                 self.logger.debug('Error handler stopped further handlers')
                 break
+            # Errors should not stop the thread.
             except Exception:
                 self.logger.exception('An uncaught error was raised while handling the error')
 
-        # Errors should not stop the thread.
-        except Exception:
-            self.logger.exception('An uncaught error was raised while processing the update')
+    if handled:
+        self.update_persistence(update=update)
+    record_latency(time.monotonic() - start)
+
+
+Dispatcher.process_update = process_update
 
 if __name__ == '__main__':
     LOGGER.info("Successfully loaded modules: " + str(ALL_MODULES))
@@ -5,15 +5,25 @@ from Megumi.modules.disable import DisableAbleCommandHandler
 from Megumi.modules.helper_funcs.chat_status import (bot_admin, can_pin,
                                                            can_promote,
                                                            connection_status,
+                                                           invalidate_admins,
+                                                           invalidate_member,
+                                                           member_cache_stats,
+                                                           set_bot_member,
                                                            user_admin)
 from Megumi.modules.helper_funcs.extraction import (extract_user,
                                                           extract_user_and_text)
+from Megumi.modules.helper_funcs.telethn.chatstatus import \
+    invalidate_admin_roster
 from Megumi.modules.log_channel import loggable
 from telegram import ParseMode, Update
 from telegram.error import BadRequest
-from telegram.ext import CallbackContext, CommandHandler, Filters, run_async
+from telegram.ext import (CallbackContext, ChatMemberHandler, CommandHandler,
+                          Filters, MessageHandler, run_async)
 from telegram.utils.helpers import mention_html
 
+# runs before every other group so later handlers never see a stale member
+MEMBER_UPDATE_GROUP = -1
+
 
 @run_async
 @connection_status
@@ -84,6 +94,9 @@ def promote(update: Update, context: CallbackContext) -> str:
             message.reply_text("An error occured while promoting.")
             return log_message
 
+    invalidate_admins(chat.id)
+    invalidate_admin_roster(chat.id)
+
     bot.sendMessage(
         chat.id,
         f"Sucessfully promoted <b>{user_member.user.first_name or user_id}</b>!",
@@ -152,6 +165,8 @@ def demote(update: Update, context: CallbackContext) -> str:
             can_restrict_members=False,
             can_pin_messages=False,
             can_promote_members=False)
+        invalidate_admins(chat.id)
+        invalidate_admin_roster(chat.id)
 
         bot.sendMessage(
             chat.id,
@@ -231,6 +246,8 @@ def set_title(update: Update, context: CallbackContext):
             "I can't set custom title for admins that I didn't promote!")
         return
 
+    invalidate_admins(chat.id)
+
     bot.sendMessage(
         chat.id,
         f"Sucessfully set title for <code>{user_member.user.first_name or user_id}</code> "
@@ -354,6 +371,43 @@ def adminlist(update: Update, context: CallbackContext):
     update.effective_message.reply_text(text, parse_mode=ParseMode.MARKDOWN)
 
 
+def member_update(update: Update, context: CallbackContext):
+    chat = update.effective_chat
+    message = update.effective_message
+
+    if message.left_chat_member:
+        invalidate_member(chat.id, message.left_chat_member.id)
+    for new_mem in message.new_chat_members:
+        invalidate_member(chat.id, new_mem.id)
+
+
+def bot_member_update(update: Update, context: CallbackContext):
+    # telegram pushes the bot's new rights whenever it is promoted, restricted or removed
+    member_update = update.my_chat_member
+    chat_id = member_update.chat.id
+    set_bot_member(chat_id, member_update.new_chat_member)
+    # the bot itself is on the admin list, which is stale now too
+    invalidate_admins(chat_id)
+    invalidate_admin_roster(chat_id)
+
+
+def chat_member_update(update: Update, context: CallbackContext):
+    # sent for promotions, demotions and restrictions, including ones made in the telegram UI
+    member_update = update.chat_member
+    chat_id = member_update.chat.id
+    invalidate_member(chat_id, member_update.new_chat_member.user.id)
+    if ({member_update.old_chat_member.status,
+         member_update.new_chat_member.status} & {"administrator", "creator"}):
+        invalidate_admins(chat_id)
+        invalidate_admin_roster(chat_id)
+
+
+def __stats__():
+    stats = member_cache_stats()
+    return "• {} admin checks answered from cache, {} fetched from telegram ({} chats cached).".format(
+        stats["hits"], stats["misses"], stats["admin_chats"])
+
+
 def __chat_settings__(chat_id, user_id):
     return "You are *admin*: `{}`".format(
         dispatcher.bot.get_chat_member(chat_id, user_id).status in (
@@ -386,6 +440,14 @@ DEMOTE_HANDLER = DisableAbleCommandHandler("demote", demote)
 
 SET_TITLE_HANDLER = CommandHandler("settitle", set_title)
 
+MEMBER_UPDATE_HANDLER = MessageHandler(
+    Filters.status_update.new_chat_members |
+    Filters.status_update.left_chat_member, member_update)
+BOT_MEMBER_UPDATE_HANDLER = ChatMemberHandler(
+    bot_member_update, ChatMemberHandler.MY_CHAT_MEMBER)
+CHAT_MEMBER_UPDATE_HANDLER = ChatMemberHandler(
+    chat_member_update, ChatMemberHandler.CHAT_MEMBER)
+
 dispatcher.add_handler(ADMINLIST_HANDLER)
 dispatcher.add_handler(PIN_HANDLER)
 dispatcher.add_handler(UNPIN_HANDLER)
@@ -393,10 +455,16 @@ dispatcher.add_handler(INVITE_HANDLER)
 dispatcher.add_handler(PROMOTE_HANDLER)
 dispatcher.add_handler(DEMOTE_HANDLER)
 dispatcher.add_handler(SET_TITLE_HANDLER)
+dispatcher.add_handler(MEMBER_UPDATE_HANDLER, MEMBER_UPDATE_GROUP)
+dispatcher.add_handler(BOT_MEMBER_UPDATE_HANDLER, MEMBER_UPDATE_GROUP)
+dispatcher.add_handler(CHAT_MEMBER_UPDATE_HANDLER, MEMBER_UPDATE_GROUP)
 
 __mod_name__ = "Admin"
 __command_list__ = ["adminlist", "admins", "invitelink", "promote", "demote"]
 __handlers__ = [
     ADMINLIST_HANDLER, PIN_HANDLER, UNPIN_HANDLER, INVITE_HANDLER,
-    PROMOTE_HANDLER, DEMOTE_HANDLER, SET_TITLE_HANDLER
+    PROMOTE_HANDLER, DEMOTE_HANDLER, SET_TITLE_HANDLER,
+    (MEMBER_UPDATE_HANDLER, MEMBER_UPDATE_GROUP),
+    (BOT_MEMBER_UPDATE_HANDLER, MEMBER_UPDATE_GROUP),
+    (CHAT_MEMBER_UPDATE_HANDLER, MEMBER_UPDATE_GROUP)
 ]
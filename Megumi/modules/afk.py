@@ -5,7 +5,7 @@ import time
 from Megumi import dispatcher
 from Megumi.modules.disable import (DisableAbleCommandHandler)
 from Megumi.modules.sql import afk_sql as sql
-from Megumi.modules.users import get_user_id
+from Megumi.modules.users import get_first_name, get_user_id
 from telegram import MessageEntity, Update
 from telegram.error import BadRequest
 from telegram.ext import CallbackContext, Filters, MessageHandler, run_async
@@ -67,7 +67,6 @@ def no_longer_afk(update: Update, context: CallbackContext):
 
 @run_async
 def reply_afk(update: Update, context: CallbackContext):
-    bot = context.bot
     message = update.effective_message
     userc = update.effective_user
     userc_id = userc.id
@@ -98,12 +97,11 @@ def reply_afk(update: Update, context: CallbackContext):
                 chk_users.append(user_id)
 
                 try:
-                    chat = bot.get_chat(user_id)
+                    fst_name = get_first_name(user_id)
                 except BadRequest:
                     print("Error: Could not fetch userid {} for AFK module"
                           .format(user_id))
                     return
-                fst_name = chat.first_name
 
             else:
                 return
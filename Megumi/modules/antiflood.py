@@ -19,6 +19,7 @@ from Megumi.modules.log_channel import loggable
 from Megumi.modules.sql import antiflood_sql as sql
 from Megumi.modules.connection import connected
 from Megumi.modules.helper_funcs.alternate import send_message
+from Megumi.modules.helper_funcs.handlers import moderation_handler
 FLOOD_GROUP = 3
 
 
@@ -371,7 +372,7 @@ FLOOD_QUERY_HANDLER = CallbackQueryHandler(
     flood_button, pattern=r"unmute_flooder")
 FLOOD_HANDLER = CommandHandler("flood", flood, filters=Filters.group)
 
-dispatcher.add_handler(FLOOD_BAN_HANDLER, FLOOD_GROUP)
+dispatcher.add_handler(moderation_handler(FLOOD_BAN_HANDLER), FLOOD_GROUP)
 dispatcher.add_handler(FLOOD_QUERY_HANDLER)
 dispatcher.add_handler(SET_FLOOD_HANDLER)
 dispatcher.add_handler(SET_FLOOD_MODE_HANDLER)
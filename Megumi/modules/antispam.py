@@ -1,480 +1,18 @@
-import html
-import time
-from datetime import datetime
-from io import BytesIO
-from typing import Optional, List
+from telegram.ext import CommandHandler, Filters
 
-from telegram import Message, Update, User, Chat, ParseMode
-from telegram.error import BadRequest, TelegramError
-from telegram.ext import run_async, CallbackContext, CommandHandler, MessageHandler, Filters
-from telegram.utils.helpers import mention_html
+from Megumi import dispatcher, SUPPORT_CHAT
+from Megumi.modules.helper_funcs.gban_engine import (gban_chat_settings,
+                                                     gban_migrate, gban_stats,
+                                                     gban_user_info, gbanstat,
+                                                     start_gban_engine)
 
-import Megumi.modules.sql.global_bans_sql as sql
-from Megumi import dispatcher, OWNER_ID, GBAN_LOGS, SUPPORT_CHAT, DEV_USERS, SUDO_USERS, TIGER_USERS, WHITELIST_USERS, SUPPORT_USERS, STRICT_GBAN
-from Megumi.modules.helper_funcs.chat_status import user_admin, is_user_admin
-from Megumi.modules.helper_funcs.extraction import extract_user, extract_user_and_text
-from Megumi.modules.helper_funcs.filters import CustomFilters
-from Megumi.modules.helper_funcs.misc import send_to_list
-from Megumi.modules.sql.users_sql import get_all_chats, get_user_com_chats
-
-GBAN_ENFORCE_GROUP = 6
-
-GBAN_ERRORS = {
-    "User is an administrator of the chat",
-    "Chat not found",
-    "Not enough rights to restrict/unrestrict chat member",
-    "User_not_participant",
-    "Peer_id_invalid",
-    "Group chat was deactivated",
-    "Need to be inviter of a user to kick it from a basic group",
-    "Chat_admin_required",
-    "Only the creator of a basic group can kick group administrators",
-    "Channel_private",
-    "Not in the chat"
-}
-
-UNGBAN_ERRORS = {
-    "User is an administrator of the chat",
-    "Chat not found",
-    "Not enough rights to restrict/unrestrict chat member",
-    "User_not_participant",
-    "Method is available for supergroup and channel chats only",
-    "Not in the chat",
-    "Channel_private",
-    "Chat_admin_required",
-    "Peer_id_invalid",
-}
-
-
-@run_async
-def gban(update: Update, context:CallbackContext):
-    bot, args = context.bot, context.args
-    message = update.effective_message  # type: Optional[Message]
-    chat = update.effective_chat
-    user = update.effective_user
-    user_id, reason = extract_user_and_text(message, args)
-
-    if not user_id:
-        message.reply_text("You don't seem to be referring to a user.")
-        return
-
-    if int(user_id) in DEV_USERS:
-        message.reply_text("I spy, with my little eye... a sudo user war! Why are you guys turning on each other?")
-        return
-
-    if int(user_id) in SUDO_USERS:
-        message.reply_text("I spy, with my little eye... a sudo user war! Why are you guys turning on each other?")
-        return
-
-    if int(user_id) in SUPPORT_USERS:
-        message.reply_text("OOOH someone's trying to gban a support user! *grabs popcorn*")
-        return
-
-    if int(user_id) in TIGER_USERS:
-        message.reply_text("OOOH someone's trying to gban a support user! *grabs popcorn*")
-        return
-
-    if int(user_id) in WHITELIST_USERS:
-        message.reply_text("OOOH someone's trying to gban a support user! *grabs popcorn*")
-        return
-
-
-    if user_id == bot.id:
-        message.reply_text("Nice try but I ain't gonna gban myself!")
-        return
-
-    try:
-        user_chat = bot.get_chat(user_id)
-    except BadRequest as excp:
-        message.reply_text(excp.message)
-        return
-
-    if user_chat.type != 'private':
-        message.reply_text("That's not a user!")
-        return
-
-    if user_chat.first_name == '':
-        message.reply_text("That's a deleted account, no need to gban them!")
-        return
-
-    if sql.is_user_gbanned(user_id):
-        if not reason:
-            message.reply_text("This user is already gbanned; I'd change the reason, but you haven't given me one...")
-            return
-
-        old_reason = sql.update_gban_reason(user_id, user_chat.username or user_chat.first_name, reason)
-        if old_reason:
-            if old_reason == reason:
-                message.reply_text("This user is already gbanned for the exact same reason!")
-            else:
-                message.reply_text("This user is already gbanned, for the following reason:\n"
-                                   "<code>{}</code>\n"
-                                   "I've gone and updated it with your new reason!".format(html.escape(old_reason)),
-                                   parse_mode=ParseMode.HTML)
-        else:
-            message.reply_text("This user is already gbanned, but had no reason set; I've gone and updated it!")
-
-        return
-
-    message.reply_text("Starting a global ban for {}".format(mention_html(user_chat.id, user_chat.first_name)),
-                       parse_mode=ParseMode.HTML)
-
-    start_time = time.time()
-    datetime_fmt = "%Y-%m-%dT%H:%M"
-    current_time = datetime.utcnow().strftime(datetime_fmt)
-
-    if chat.type != 'private':
-        chat_origin = "<b>{} ({})</b>\n".format(
-            html.escape(chat.title), chat.id)
-    else:
-        chat_origin = "<b>{}</b>\n".format(chat.id)
-
-    log_message = (
-        f"#GBANNED\n"
-        f"<b>Originated from:</b> <code>{chat_origin}</code>\n"
-        f"<b>Admin:</b> {mention_html(user.id, user.first_name)}\n"
-        f"<b>Banned User:</b> {mention_html(user_chat.id, user_chat.first_name)}\n"
-        f"<b>Banned User ID:</b> <code>{user_chat.id}</code>\n"
-        f"<b>Event Stamp:</b> <code>{current_time}</code>")
-
-    if reason:
-        if chat.type == chat.SUPERGROUP and chat.username:
-            log_message += f"\n<b>Reason:</b> <a href=\"https://telegram.me/{chat.username}/{message.message_id}\">{reason}</a>"
-        else:
-            log_message += f"\n<b>Reason:</b> <code>{reason}</code>"
-
-    if GBAN_LOGS:
-        try:
-            log = bot.send_message(
-                GBAN_LOGS, log_message, parse_mode=ParseMode.HTML)
-        except BadRequest as excp:
-            log = bot.send_message(
-                GBAN_LOGS, log_message +
-                "\n\nFormatting has been disabled due to an unexpected error.")
-
-    else:
-        send_to_list(bot, SUDO_USERS + SUPPORT_USERS, log_message, html=True)
-
-    sql.gban_user(user_id, user_chat.username or user_chat.first_name, reason)
-
-    chats = get_user_com_chats(user_id)
-    gbanned_chats = 0
-
-    for chat in chats:
-        chat_id = int(chat)
-
-        # Check if this group has disabled gbans
-        if not sql.does_chat_gban(chat_id):
-            continue
-
-        try:
-            bot.kick_chat_member(chat_id, user_id)
-            gbanned_chats += 1
-
-        except BadRequest as excp:
-            if GBAN_LOGS:
-                    bot.send_message(
-                        GBAN_LOGS,
-                        f"Could not gban due to {excp.message}",
-                        parse_mode=ParseMode.HTML)
-            else:
-                send_to_list(bot, SUDO_USERS + SUPPORT_USERS,
-                                 f"Could not gban due to: {excp.message}")
-                sql.ungban_user(user_id)
-                return
-        except TelegramError:
-            pass
-
-    if GBAN_LOGS:
-        log.edit_text(
-            log_message +
-            f"\n<b>Chats affected:</b> <code>{gbanned_chats}</code>",
-            parse_mode=ParseMode.HTML)
-    else:
-        send_to_list(
-            bot,
-            SUDO_USERS + SUPPORT_USERS,
-            f"Gban complete! (User banned in <code>{gbanned_chats}</code> chats)",
-            html=True)
-
-    end_time = time.time()
-    gban_time = round((end_time - start_time), 2)
-
-    if gban_time > 60:
-        gban_time = round((gban_time / 60), 2)
-        message.reply_text("Done! Gbanned.", parse_mode=ParseMode.HTML)
-    else:
-        message.reply_text("Done! Gbanned.", parse_mode=ParseMode.HTML)
-
-    try:
-        bot.send_message(
-            user_id,
-            "You have been globally banned from all groups where I have administrative permissions."
-            "To see the reason click on /info."
-            f" If you think that this was a mistake, you may appeal your ban here: {SUPPORT_CHAT}",
-            parse_mode=ParseMode.HTML)
-    except:
-        pass  # bot probably blocked by user
-
-@run_async
-def ungban(update: Update, context:CallbackContext):
-    bot, args = context.bot, context.args
-    message = update.effective_message  # type: Optional[Message]
-    chat = update.effective_chat
-    user = update.effective_user
-    user_id = extract_user(message, args)
-
-    if not user_id:
-        message.reply_text("You don't seem to be referring to a user.")
-        return
-
-    user_chat = bot.get_chat(user_id)
-    if user_chat.type != 'private':
-        message.reply_text("That's not a user!")
-        return
-
-    if not sql.is_user_gbanned(user_id):
-        message.reply_text("This user is not gbanned!")
-        return
-
-    banner = update.effective_user  # type: Optional[User]
-
-    message.reply_text("I'll give {} a second chance, globally.".format(mention_html(user_chat.id, user_chat.first_name)),
-                       parse_mode=ParseMode.HTML)
-
-    if chat.type != 'private':
-        chat_origin = f"<b>{html.escape(chat.title)} ({chat.id})</b>\n"
-    else:
-        chat_origin = f"<b>{chat.id}</b>\n"
-    
-    start_time = time.time()
-    datetime_fmt = "%Y-%m-%dT%H:%M"
-    current_time = datetime.utcnow().strftime(datetime_fmt)
-
-    log_message = (
-        f"#UNGBANNED\n"
-        f"<b>Originated from:</b> <code>{chat_origin}</code>\n"
-        f"<b>Admin:</b> {mention_html(user.id, user.first_name)}\n"
-        f"<b>Unbanned User:</b> {mention_html(user_chat.id, user_chat.first_name)}\n"
-        f"<b>Unbanned User ID:</b> <code>{user_chat.id}</code>\n"
-        f"<b>Event Stamp:</b> <code>{current_time}</code>")
-
-    if GBAN_LOGS:
-        try:
-            log = bot.send_message(
-                GBAN_LOGS, log_message, parse_mode=ParseMode.HTML)
-        except BadRequest as excp:
-            log = bot.send_message(
-                GBAN_LOGS, log_message +
-                "\n\nFormatting has been disabled due to an unexpected error.")
-    else:
-        send_to_list(bot, SUDO_USERS + SUPPORT_USERS, log_message, html=True)
-
-    chats = get_all_chats()
-    ungbanned_chats = 0
-
-    for chat in chats:
-        chat_id = chat.chat_id
-
-        # Check if this group has disabled gbans
-        if not sql.does_chat_gban(chat_id):
-            continue
-
-        try:
-            member = bot.get_chat_member(chat_id, user_id)
-            if member.status == 'kicked':
-                bot.unban_chat_member(chat_id, user_id)
-                ungbanned_chats += 1
-
-        except BadRequest as excp:
-            if excp.message in UNGBAN_ERRORS:
-                pass
-            else:
-                message.reply_text(f"Could not un-gban due to: {excp.message}")
-                if GBAN_LOGS:
-                    bot.send_message(
-                        GBAN_LOGS,
-                        f"Could not un-gban due to: {excp.message}",
-                        parse_mode=ParseMode.HTML)
-                else:
-                    bot.send_message(
-                        OWNER_ID, f"Could not un-gban due to: {excp.message}")
-                return
-        except TelegramError:
-            pass
-
-    sql.ungban_user(user_id)
-
-    if GBAN_LOGS:
-        log.edit_text(
-            log_message + f"\n<b>Chats affected:</b> {ungbanned_chats}",
-            parse_mode=ParseMode.HTML)
-    else:
-        send_to_list(bot, SUDO_USERS + SUPPORT_USERS, "un-gban complete!")
-
-    end_time = time.time()
-    ungban_time = round((end_time - start_time), 2)
-
-    if ungban_time > 60:
-        ungban_time = round((ungban_time / 60), 2)
-        message.reply_text(
-            f"Person has been un-gbanned. Took {ungban_time} min")
-    else:
-        message.reply_text(
-            f"Person has been un-gbanned. Took {ungban_time} sec")
-
-
-@run_async
-def gbanlist(update: Update, context:CallbackContext):
-    banned_users = sql.get_gban_list()
-
-    if not banned_users:
-        update.effective_message.reply_text("There aren't any gbanned users! You're kinder than I expected...")
-        return
-
-    banfile = 'Screw these guys.\n'
-    for user in banned_users:
-        banfile += "[x] {} - {}\n".format(user["name"], user["user_id"])
-        if user["reason"]:
-            banfile += "Reason: {}\n".format(user["reason"])
-
-    with BytesIO(str.encode(banfile)) as output:
-        output.name = "gbanlist.txt"
-        update.effective_message.reply_document(document=output, filename="gbanlist.txt",
-                                                caption="Here is the list of currently gbanned users.")
-
-def check_and_ban(update, user_id, should_message=True):
-    chat = update.effective_chat
-    if sql.is_user_gbanned(user_id):
-        update.effective_chat.kick_member(user_id)
-        if should_message:
-            text = f"<b>Alert</b>: this user is globally banned.\n" \
-                   f"<code>*bans them from here*</code>.\n" \
-                   f"<b>Appeal chat</b>: {SUPPORT_CHAT}\n" \
-                   f"<b>User ID</b>: <code>{user_id}</code>"
-            user = sql.get_gbanned_user(user_id)
-            if user.reason:
-                text += f"\n<b>Ban Reason:</b> <code>{html.escape(user.reason)}</code>"
-            update.effective_message.reply_text(text, parse_mode=ParseMode.HTML)
-
-@run_async
-def enforce_gban(update: Update, context:CallbackContext):
-    # Not using @restrict handler to avoid spamming - just ignore if cant gban.
-    bot, args = context.bot, context.args
-    if sql.does_chat_gban(update.effective_chat.id) and update.effective_chat.get_member(bot.id).can_restrict_members:
-        user = update.effective_user  # type: Optional[User]
-        chat = update.effective_chat  # type: Optional[Chat]
-        msg = update.effective_message  # type: Optional[Message]
-
-        if user and not is_user_admin(chat, user.id):
-            check_and_ban(update, user.id)
-
-        if msg.new_chat_members:
-            new_members = update.effective_message.new_chat_members
-            for mem in new_members:
-                check_and_ban(update, mem.id)
-
-        if msg.reply_to_message:
-            user = msg.reply_to_message.from_user  # type: Optional[User]
-            if user and not is_user_admin(chat, user.id):
-                check_and_ban(update, user.id, should_message=False)
-
-
-@run_async
-@user_admin
-def gbanstat(update: Update, context:CallbackContext):
-    bot, args = context.bot, context.args
-    if len(args) > 0:
-        if args[0].lower() in ["on", "yes"]:
-            sql.enable_gbans(update.effective_chat.id)
-            update.effective_message.reply_text("I've enabled gbans in this group. This will help protect you "
-                                                "from spammers, unsavoury characters, and the biggest trolls.")
-        elif args[0].lower() in ["off", "no"]:
-            sql.disable_gbans(update.effective_chat.id)
-            update.effective_message.reply_text("I've disabled gbans in this group. GBans wont affect your users "
-                                                "anymore. You'll be less protected from any trolls and spammers "
-                                                "though!")
-    else:
-        update.effective_message.reply_text("Give me some arguments to choose a setting! on/off, yes/no!\n\n"
-                                            "Your current setting is: {}\n"
-                                            "When True, any gbans that happen will also happen in your group. "
-                                            "When False, they won't, leaving you at the possible mercy of "
-                                            "spammers.".format(sql.does_chat_gban(update.effective_chat.id)))
-
-
-@run_async
-def clear_gbans(update: Update, context:CallbackContext):
-    '''Check and remove deleted accounts from gbanlist.
-    By @TheRealPhoenix'''
-    bot, args = context.bot, context.args
-    banned = sql.get_gban_list()
-    deleted = 0
-    for user in banned:
-        id = user["user_id"]
-        time.sleep(0.1) # Reduce floodwait
-        try:
-            acc = bot.get_chat(id)
-            if not acc.first_name:
-                deleted += 1
-                sql.ungban_user(id)
-        except BadRequest:
-            deleted += 1
-            sql.ungban_user(id)
-    update.message.reply_text("Done! `{}` deleted accounts were removed " \
-    "from the gbanlist.".format(deleted), parse_mode=ParseMode.MARKDOWN)
-    
-
-@run_async
-def check_gbans(update: Update, context:CallbackContext):
-    '''By @TheRealPhoenix'''
-    bot, args = context.bot, context.args
-    banned = sql.get_gban_list()
-    deleted = 0
-    for user in banned:
-        id = user["user_id"]
-        time.sleep(0.1) # Reduce floodwait
-        try:
-            acc = bot.get_chat(id)
-            if not acc.first_name:
-                deleted += 1
-        except BadRequest:
-            deleted += 1
-    if deleted:
-        update.message.reply_text("`{}` deleted accounts found in the gbanlist! " \
-        "Run /cleangb to remove them from the database!".format(deleted),
-        parse_mode=ParseMode.MARKDOWN)
-    else:
-        update.message.reply_text("No deleted accounts in the gbanlist!")
-
-def __user_info__(user_id):
-    
-    is_gbanned = sql.is_user_gbanned(user_id)
-
-    text = "Globally banned: <b>{}</b>"
-    if user_id == dispatcher.bot.id:
-        return ""
-    if int(user_id) in SUDO_USERS + TIGER_USERS + WHITELIST_USERS:
-        return ""
-    if is_gbanned:
-        text = text.format("Yes")
-        user = sql.get_gbanned_user(user_id)
-        if user.reason:
-            text += f"\n<b>Reason:</b> <code>{html.escape(user.reason)}</code>"
-        text += f"\n<b>Appeal Chat:</b> {SUPPORT_CHAT}"
-    else:
-        text = text.format("No")
-    return text
-
-def __stats__():
-    return "{} gbanned users.".format(sql.num_gbanned_users())
-
-
-def __migrate__(old_chat_id, new_chat_id):
-    sql.migrate_chat(old_chat_id, new_chat_id)
-
-
-def __chat_settings__(chat_id, user_id):
-    return "This chat is enforcing *gbans*: `{}`.".format(sql.does_chat_gban(chat_id))
+# the gban commands and enforcer live in gban_engine, shared with the
+# global_bans module; only the module registering them exports the hooks
+if start_gban_engine(__name__):
+    __stats__ = gban_stats
+    __user_info__ = gban_user_info
+    __migrate__ = gban_migrate
+    __chat_settings__ = gban_chat_settings
 
 
 __help__ = f"""
@@ -488,25 +26,6 @@ you and your groups by removing spam flooders as quickly as possible. They can b
 
 __mod_name__ = "Antispam"
 
-GBAN_HANDLER = CommandHandler("gban", gban, pass_args=True,
-                              filters=CustomFilters.sudo_filter | CustomFilters.support_filter)
-UNGBAN_HANDLER = CommandHandler("ungban", ungban, pass_args=True,
-                                filters=CustomFilters.sudo_filter | CustomFilters.support_filter)
-GBAN_LIST = CommandHandler("gbanlist", gbanlist,
-                           filters=CustomFilters.sudo_filter | CustomFilters.support_filter)
-CHECK_GBAN_HANDLER = CommandHandler("checkgb", check_gbans, filters=Filters.user(OWNER_ID))
-CLEAN_GBAN_HANDLER = CommandHandler("cleangb", clear_gbans, filters=Filters.user(OWNER_ID))
-
 GBAN_STATUS = CommandHandler("antispam", gbanstat, pass_args=True, filters=Filters.group)
 
-GBAN_ENFORCER = MessageHandler(Filters.all & Filters.group, enforce_gban)
-
-dispatcher.add_handler(GBAN_HANDLER)
-dispatcher.add_handler(UNGBAN_HANDLER)
-dispatcher.add_handler(GBAN_LIST)
 dispatcher.add_handler(GBAN_STATUS)
-dispatcher.add_handler(CHECK_GBAN_HANDLER)
-dispatcher.add_handler(CLEAN_GBAN_HANDLER)
-
-if STRICT_GBAN:  # enforce GBANS if this is set
-    dispatcher.add_handler(GBAN_ENFORCER, GBAN_ENFORCE_GROUP)
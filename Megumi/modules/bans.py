@@ -5,8 +5,9 @@ from Megumi import (DEV_USERS, LOGGER, OWNER_ID, SUDO_USERS,
                           dispatcher)
 from Megumi.modules.disable import DisableAbleCommandHandler
 from Megumi.modules.helper_funcs.chat_status import (
-    bot_admin, can_restrict, connection_status, is_user_admin,
-    is_user_ban_protected, is_user_in_chat, user_admin, user_can_ban)
+    bot_admin, can_restrict, connection_status, invalidate_member,
+    is_user_admin, is_user_ban_protected, is_user_in_chat, user_admin,
+    user_can_ban)
 from Megumi.modules.helper_funcs.extraction import extract_user_and_text
 from Megumi.modules.helper_funcs.string_handling import extract_time
 from Megumi.modules.log_channel import gloggable, loggable
@@ -91,6 +92,7 @@ def ban(update: Update, context: CallbackContext) -> str:
 
     try:
         chat.kick_member(user_id)
+        invalidate_member(chat.id, user_id)
         bot.send_sticker(chat.id, BAN_STICKER)  # banhammer Megumi sticker
         bot.sendMessage(
             chat.id,
@@ -177,6 +179,7 @@ def temp_ban(update: Update, context: CallbackContext) -> str:
 
     try:
         chat.kick_member(user_id, until_date=bantime)
+        invalidate_member(chat.id, user_id)
         #bot.send_sticker(chat.id, BAN_STICKER)  # banhammer Megumi sticker
         bot.sendMessage(
             chat.id,
@@ -237,6 +240,7 @@ def kick(update: Update, context: CallbackContext) -> str:
         return log_message
 
     res = chat.unban_member(user_id)  # unban on current user = kick
+    invalidate_member(chat.id, user_id)
     if res:
         #bot.send_sticker(chat.id, BAN_STICKER)  # banhammer Megumi sticker
         bot.sendMessage(
@@ -272,6 +276,7 @@ def kickme(update: Update, context: CallbackContext):
 
     res = update.effective_chat.unban_member(
         user_id)  # unban on current user = kick
+    invalidate_member(update.effective_chat.id, user_id)
     if res:
         update.effective_message.reply_text("*kicks you out of the group*")
     else:
@@ -315,6 +320,7 @@ def unban(update: Update, context: CallbackContext) -> str:
         return log_message
 
     chat.unban_member(user_id)
+    invalidate_member(chat.id, user_id)
     message.reply_text("Yep, this user can join!")
 
     log = (
@@ -362,6 +368,7 @@ def selfunban(context: CallbackContext, update: Update) -> str:
         return
 
     chat.unban_member(user.id)
+    invalidate_member(chat.id, user.id)
     message.reply_text("Yep, I have unbanned you.")
 
     log = (
@@ -8,15 +8,18 @@ from Megumi.modules.helper_funcs.chat_status import (connection_status,
                                                            user_admin,
                                                            user_not_admin)
 from Megumi.modules.helper_funcs.extraction import extract_text
+from Megumi.modules.helper_funcs.handlers import moderation_handler
 from Megumi.modules.helper_funcs.misc import split_message
 from Megumi.modules.helper_funcs.regex_helper import (infinite_loop_check,
-                                                            regex_searcher)
+                                                            search_patterns)
 from telegram import ParseMode, Update
 from telegram.error import BadRequest
 from telegram.ext import (CallbackContext, CommandHandler, Filters,
                           MessageHandler, run_async)
 
 BLACKLIST_GROUP = 11
+# seconds of regex time a single message may cost across all of a chat's triggers
+BLACKLIST_BUDGET = 2
 
 
 @run_async
@@ -161,22 +164,16 @@ def del_blacklist(update: Update, context: CallbackContext):
     if not to_match:
         return
 
-    chat_filters = sql.get_chat_blacklist(chat.id)
-    for trigger in chat_filters:
-        pattern = r"( |^|[^\w])" + trigger + r"( |$|[^\w])"
-        match = regex_searcher(pattern, to_match)
-        if not match:
-            #Skip to next item in blacklist
-            continue
-        if match:
-            try:
-                message.delete()
-            except BadRequest as excp:
-                if excp.message == "Message to delete not found":
-                    pass
-                else:
-                    LOGGER.exception("Error while deleting blacklist message.")
-            break
+    patterns = sql.get_chat_blacklist_patterns(chat.id)
+    if search_patterns(
+            patterns, to_match, budget=BLACKLIST_BUDGET, chat_id=chat.id):
+        try:
+            message.delete()
+        except BadRequest as excp:
+            if excp.message == "Message to delete not found":
+                pass
+            else:
+                LOGGER.exception("Error while deleting blacklist message.")
 
 
 def __migrate__(old_chat_id, new_chat_id):
@@ -221,7 +218,7 @@ BLACKLIST_DEL_HANDLER = MessageHandler(
 dispatcher.add_handler(BLACKLIST_HANDLER)
 dispatcher.add_handler(ADD_BLACKLIST_HANDLER)
 dispatcher.add_handler(UNBLACKLIST_HANDLER)
-dispatcher.add_handler(BLACKLIST_DEL_HANDLER, group=BLACKLIST_GROUP)
+dispatcher.add_handler(moderation_handler(BLACKLIST_DEL_HANDLER), group=BLACKLIST_GROUP)
 
 __mod_name__ = "Blacklist Word"
 __handlers__ = [
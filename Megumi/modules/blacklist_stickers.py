@@ -8,6 +8,7 @@ from Megumi.modules.disable import DisableAbleCommandHandler
 from Megumi.modules.helper_funcs.alternate import send_message
 from Megumi.modules.helper_funcs.chat_status import (user_admin,
                                                            user_not_admin)
+from Megumi.modules.helper_funcs.handlers import moderation_handler
 from Megumi.modules.helper_funcs.misc import split_message
 from Megumi.modules.helper_funcs.string_handling import extract_time
 
@@ -492,4 +493,4 @@ dispatcher.add_handler(BLACKLIST_STICKER_HANDLER)
 dispatcher.add_handler(ADDBLACKLIST_STICKER_HANDLER)
 dispatcher.add_handler(UNBLACKLIST_STICKER_HANDLER)
 dispatcher.add_handler(BLACKLISTMODE_HANDLER)
-dispatcher.add_handler(BLACKLIST_STICKER_DEL_HANDLER)
+dispatcher.add_handler(moderation_handler(BLACKLIST_STICKER_DEL_HANDLER))
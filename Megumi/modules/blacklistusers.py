@@ -1,21 +1,21 @@
 # Module to blacklist users and prevent them from using commands by @TheRealPhoenix
 
 import Megumi.modules.sql.blacklistusers_sql as sql
-from Megumi import (DEV_USERS, OWNER_ID, SUDO_USERS, SUPPORT_USERS, TIGER_USERS,
-                          WHITELIST_USERS, dispatcher)
+from Megumi import (DEV_USERS, SUDO_USERS, TIGER_USERS, WHITELIST_USERS,
+                          dispatcher)
 from Megumi.modules.helper_funcs.chat_status import dev_plus
 from Megumi.modules.helper_funcs.extraction import (extract_user,
                                                           extract_user_and_text)
+from Megumi.modules.helper_funcs.privileges import (DEV, SUDO, SUPPORT,
+                                                    WHITELIST, RankView)
 from Megumi.modules.log_channel import gloggable
 from telegram import ParseMode, Update
 from telegram.error import BadRequest
 from telegram.ext import CallbackContext, CommandHandler, run_async
 from telegram.utils.helpers import mention_html
 
-BLACKLISTWHITELIST = [
-    OWNER_ID
-] + DEV_USERS + SUDO_USERS + WHITELIST_USERS + SUPPORT_USERS
-BLABLEUSERS = [OWNER_ID] + DEV_USERS
+BLACKLISTWHITELIST = RankView(WHITELIST, SUPPORT, SUDO, DEV)
+BLABLEUSERS = DEV_USERS
 
 
 @run_async
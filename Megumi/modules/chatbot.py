@@ -10,10 +10,10 @@ from Megumi import AI_API_KEY, OWNER_ID, SUPPORT_CHAT, dispatcher
 from Megumi.modules.helper_funcs.chat_status import user_admin
 from Megumi.modules.helper_funcs.filters import CustomFilters
 from Megumi.modules.log_channel import gloggable
-from telegram import Update
+from telegram import Message, Update
 from telegram.error import BadRequest, RetryAfter, Unauthorized
-from telegram.ext import (CallbackContext, CommandHandler, Filters,
-                          MessageHandler, run_async)
+from telegram.ext import (BaseFilter, CallbackContext, CommandHandler,
+                          Filters, MessageHandler, run_async)
 from telegram.utils.helpers import mention_html
 
 CoffeeHouseAPI = API(AI_API_KEY)
@@ -64,30 +64,38 @@ def remove_chat(update: Update, context: CallbackContext):
         return message
 
 
-def check_message(context: CallbackContext, message):
+def check_message(bot, message):
     reply_msg = message.reply_to_message
     if message.text.lower() == "megumi":
         return True
-    if reply_msg:
-        if reply_msg.from_user.id == context.bot.get_me().id:
-            return True
-    else:
-        return False
+    # bot.id comes from the identity fetched once at startup
+    return bool(reply_msg and reply_msg.from_user and
+                reply_msg.from_user.id == bot.id)
+
+
+class _ForChatbot(BaseFilter):
+    # runs before the handler gets a worker thread, so it must stay cheap:
+    # both checks are answered from memory
+    def filter(self, message: Message):
+        if not (message.text and not message.document):
+            return False
+        if not sql.is_chat(message.chat.id):
+            return False
+        return check_message(dispatcher.bot, message)
+
+
+def send_reply(context: CallbackContext):
+    msg, rep = context.job.context
+    msg.reply_text(rep, timeout=60)
 
 
 @run_async
 def chatbot(update: Update, context: CallbackContext):
     global api_client
     msg = update.effective_message
-    chat = update.effective_chat
     chat_id = update.effective_chat.id
-    is_chat = sql.is_chat(chat_id)
     bot = context.bot
-    if not is_chat:
-        return
     if msg.text and not msg.document:
-        if not check_message(context, msg):
-            return
         sesh, exp = sql.get_ses(chat_id)
         query = msg.text
         try:
@@ -102,8 +110,8 @@ def chatbot(update: Update, context: CallbackContext):
         try:
             bot.send_chat_action(chat_id, action='typing')
             rep = api_client.think_thought(sesh, query)
-            sleep(0.3)
-            msg.reply_text(rep, timeout=60)
+            # leave the typing action up a moment without holding the worker
+            context.job_queue.run_once(send_reply, 0.3, context=(msg, rep))
         except CFError as e:
             bot.send_message(OWNER_ID,
                              f"Chatbot error: {e} occurred in {chat_id}!")
@@ -133,7 +141,7 @@ ADD_CHAT_HANDLER = CommandHandler("addchat", add_chat, filters=CustomFilters.dev
 REMOVE_CHAT_HANDLER = CommandHandler("rmchat", remove_chat, filters=CustomFilters.dev_filter)
 CHATBOT_HANDLER = MessageHandler(
     Filters.text & (~Filters.regex(r"^#[^\s]+") & ~Filters.regex(r"^!")
-                    & ~Filters.regex(r"^\/")), chatbot)
+                    & ~Filters.regex(r"^\/")) & _ForChatbot(), chatbot)
 LIST_CB_CHATS_HANDLER = CommandHandler(
     "listaichats", list_chatbot_chats, filters=CustomFilters.sudo_filter)
 # Filters for ignoring #note messages, !commands and sed.
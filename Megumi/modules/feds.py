@@ -15,6 +15,7 @@ from Megumi.modules.helper_funcs.chat_status import is_user_admin
 from Megumi.modules.helper_funcs.extraction import (extract_unt_fedban,
                                                           extract_user,
                                                           extract_user_fban)
+from Megumi.modules.helper_funcs.fanout import LimitedBot, fan_out_background
 from Megumi.modules.helper_funcs.string_handling import markdown_parser
 from telegram import (InlineKeyboardButton, InlineKeyboardMarkup, MessageEntity,
                       ParseMode, Update)
@@ -43,6 +44,10 @@ FBAN_ERRORS = {
     "Channel_private", "Not in the chat", "Have no rights to send a message"
 }
 
+# rows written per transaction and seconds between progress edits on /importfbans
+FBAN_IMPORT_CHUNK = 1000
+FBAN_IMPORT_PROGRESS = 3
+
 UNFBAN_ERRORS = {
     "User is an administrator of the chat", "Chat not found",
     "Not enough rights to restrict/unrestrict chat member",
@@ -474,6 +479,53 @@ def fed_admin(update: Update, context: CallbackContext):
     update.effective_message.reply_text(text, parse_mode=ParseMode.HTML)
 
 
+def fed_kick(chat_id, user_id):
+    LimitedBot(dispatcher.bot).kick_chat_member(chat_id, user_id)
+
+
+def fed_unban(chat_id, user_id):
+    bot = LimitedBot(dispatcher.bot)
+    member = bot.get_chat_member(chat_id, user_id)
+    if member.status != 'kicked':
+        return False
+    bot.unban_chat_member(chat_id, user_id)
+
+
+def fed_enforce(fed_id, user_id, action, skip_errors, chat_id, summary):
+    """Run action in every chat of the federation and of its subscribers,
+    then post one summary to chat_id."""
+    own_chats = set(int(x) for x in sql.all_fed_chats(fed_id))
+    chat_ids = set(own_chats)
+    for fedsid in list(sql.get_subscriber(fed_id)):
+        chat_ids.update(int(x) for x in sql.all_fed_chats(fedsid))
+
+    def run(target):
+        try:
+            return action(target, user_id)
+        except BadRequest as excp:
+            if excp.message not in skip_errors:
+                raise
+            try:
+                LimitedBot(dispatcher.bot).getChat(target)
+            except Unauthorized:
+                if target in own_chats:
+                    sql.chat_leave_fed(target)
+                else:
+                    sql.unsubs_fed(fed_id, sql.get_fed_id(target))
+                LOGGER.info("Chat {} has left fed {} because I was kicked"
+                            .format(target, fed_id))
+            return False
+
+    def report(result):
+        for error, count in result.errors.items():
+            LOGGER.warning("Could not enforce fed {} in {} chats because: {}"
+                           .format(fed_id, count, error))
+        dispatcher.bot.send_message(chat_id,
+                                    summary.format(result.succeeded))
+
+    fan_out_background(chat_ids, run, report)
+
+
 @run_async
 def fed_ban(update: Update, context: CallbackContext):
     bot, args = context.bot, context.args
@@ -589,7 +641,6 @@ def fed_ban(update: Update, context: CallbackContext):
             )
             return
 
-        fed_chats = sql.all_fed_chats(fed_id)
         # Will send to current chat
         bot.send_message(chat.id, "<b>FedBan reason updated</b>" \
               "\n<b>Federation:</b> {}" \
@@ -615,74 +666,9 @@ def fed_ban(update: Update, context: CallbackContext):
                     "\n<b>User:</b> {}" \
                     "\n<b>User ID:</b> <code>{}</code>" \
                     "\n<b>Reason:</b> {}".format(fed_name, mention_html(user.id, user.first_name), user_target, fban_user_id, reason), parse_mode="HTML")
-        for fedschat in fed_chats:
-            try:
-                # Do not spam all fed chats
-                """
-				bot.send_message(chat, "<b>FedBan reason updated</b>" \
-							 "\n<b>Federation:</b> {}" \
-							 "\n<b>Federation Admin:</b> {}" \
-							 "\n<b>User:</b> {}" \
-							 "\n<b>User ID:</b> <code>{}</code>" \
-							 "\n<b>Reason:</b> {}".format(fed_name, mention_html(user.id, user.first_name), user_target, fban_user_id, reason), parse_mode="HTML")
-				"""
-                bot.kick_chat_member(fedschat, fban_user_id)
-            except BadRequest as excp:
-                if excp.message in FBAN_ERRORS:
-                    try:
-                        dispatcher.bot.getChat(fedschat)
-                    except Unauthorized:
-                        sql.chat_leave_fed(fedschat)
-                        LOGGER.info(
-                            "Chat {} has leave fed {} because I was kicked"
-                            .format(fedschat, info['fname']))
-                        continue
-                elif excp.message == "User_id_invalid":
-                    break
-                else:
-                    LOGGER.warning("Could not fban on {} because: {}".format(
-                        chat, excp.message))
-            except TelegramError:
-                pass
-        # Also do not spam all fed admins
-        """
-		send_to_list(bot, FEDADMIN,
-				 "<b>FedBan reason updated</b>" \
-							 "\n<b>Federation:</b> {}" \
-							 "\n<b>Federation Admin:</b> {}" \
-							 "\n<b>User:</b> {}" \
-							 "\n<b>User ID:</b> <code>{}</code>" \
-							 "\n<b>Reason:</b> {}".format(fed_name, mention_html(user.id, user.first_name), user_target, fban_user_id, reason), 
-							html=True)
-		"""
-
-        # Fban for fed subscriber
-        subscriber = list(sql.get_subscriber(fed_id))
-        if len(subscriber) != 0:
-            for fedsid in subscriber:
-                all_fedschat = sql.all_fed_chats(fedsid)
-                for fedschat in all_fedschat:
-                    try:
-                        bot.kick_chat_member(fedschat, fban_user_id)
-                    except BadRequest as excp:
-                        if excp.message in FBAN_ERRORS:
-                            try:
-                                dispatcher.bot.getChat(fedschat)
-                            except Unauthorized:
-                                targetfed_id = sql.get_fed_id(fedschat)
-                                sql.unsubs_fed(fed_id, targetfed_id)
-                                LOGGER.info(
-                                    "Chat {} has unsub fed {} because I was kicked"
-                                    .format(fedschat, info['fname']))
-                                continue
-                        elif excp.message == "User_id_invalid":
-                            break
-                        else:
-                            LOGGER.warning(
-                                "Unable to fban on {} because: {}".format(
-                                    fedschat, excp.message))
-                    except TelegramError:
-                        pass
+        fed_enforce(fed_id, fban_user_id, fed_kick, FBAN_ERRORS,
+                    chat.id,
+                    "Fedban reason updated in {} chats.")
         #send_message(update.effective_message, "Fedban Reason has been updated.")
         return
 
@@ -703,7 +689,6 @@ def fed_ban(update: Update, context: CallbackContext):
         )
         return
 
-    fed_chats = sql.all_fed_chats(fed_id)
     # Will send to current chat
     bot.send_message(chat.id, "<b>FedBan reason updated</b>" \
           "\n<b>Federation:</b> {}" \
@@ -729,75 +714,8 @@ def fed_ban(update: Update, context: CallbackContext):
                 "\n<b>User:</b> {}" \
                 "\n<b>User ID:</b> <code>{}</code>" \
                 "\n<b>Reason:</b> {}".format(fed_name, mention_html(user.id, user.first_name), user_target, fban_user_id, reason), parse_mode="HTML")
-    chats_in_fed = 0
-    for fedschat in fed_chats:
-        chats_in_fed += 1
-        try:
-            # Do not spamming all fed chats
-            """
-			bot.send_message(chat, "<b>FedBan reason updated</b>" \
-							"\n<b>Federation:</b> {}" \
-							"\n<b>Federation Admin:</b> {}" \
-							"\n<b>User:</b> {}" \
-							"\n<b>User ID:</b> <code>{}</code>" \
-							"\n<b>Reason:</b> {}".format(fed_name, mention_html(user.id, user.first_name), user_target, fban_user_id, reason), parse_mode="HTML")
-			"""
-            bot.kick_chat_member(fedschat, fban_user_id)
-        except BadRequest as excp:
-            if excp.message in FBAN_ERRORS:
-                pass
-            elif excp.message == "User_id_invalid":
-                break
-            else:
-                LOGGER.warning("Could not fban on {} because: {}".format(
-                    chat, excp.message))
-        except TelegramError:
-            pass
-
-    # Also do not spamming all fed admins
-        """
-		send_to_list(bot, FEDADMIN,
-				 "<b>FedBan reason updated</b>" \
-							 "\n<b>Federation:</b> {}" \
-							 "\n<b>Federation Admin:</b> {}" \
-							 "\n<b>User:</b> {}" \
-							 "\n<b>User ID:</b> <code>{}</code>" \
-							 "\n<b>Reason:</b> {}".format(fed_name, mention_html(user.id, user.first_name), user_target, fban_user_id, reason), 
-							html=True)
-		"""
-
-        # Fban for fed subscriber
-        subscriber = list(sql.get_subscriber(fed_id))
-        if len(subscriber) != 0:
-            for fedsid in subscriber:
-                all_fedschat = sql.all_fed_chats(fedsid)
-                for fedschat in all_fedschat:
-                    try:
-                        bot.kick_chat_member(fedschat, fban_user_id)
-                    except BadRequest as excp:
-                        if excp.message in FBAN_ERRORS:
-                            try:
-                                dispatcher.bot.getChat(fedschat)
-                            except Unauthorized:
-                                targetfed_id = sql.get_fed_id(fedschat)
-                                sql.unsubs_fed(fed_id, targetfed_id)
-                                LOGGER.info(
-                                    "Chat {} has unsub fed {} because I was kicked"
-                                    .format(fedschat, info['fname']))
-                                continue
-                        elif excp.message == "User_id_invalid":
-                            break
-                        else:
-                            LOGGER.warning(
-                                "Unable to fban on {} because: {}".format(
-                                    fedschat, excp.message))
-                    except TelegramError:
-                        pass
-    #if chats_in_fed == 0:
-    #    send_message(update.effective_message, "Fedban affected 0 chats. ")
-    #elif chats_in_fed > 0:
-    #    send_message(update.effective_message,
-    #                 "Fedban affected {} chats. ".format(chats_in_fed))
+    fed_enforce(fed_id, fban_user_id, fed_kick, FBAN_ERRORS, chat.id,
+                "Fedban affected {} chats.")
 
 
 @run_async
@@ -871,7 +789,6 @@ def unfban(update: Update, context: CallbackContext):
     message.reply_text("I'll give {} another chance in this federation".format(
         user_chat.first_name))
 
-    chat_list = sql.all_fed_chats(fed_id)
     # Will send to current chat
     bot.send_message(chat.id, "<b>Un-FedBan</b>" \
           "\n<b>Federation:</b> {}" \
@@ -894,32 +811,6 @@ def unfban(update: Update, context: CallbackContext):
                 "\n<b>Federation Admin:</b> {}" \
                 "\n<b>User:</b> {}" \
                 "\n<b>User ID:</b> <code>{}</code>".format(info['fname'], mention_html(user.id, user.first_name), user_target, fban_user_id), parse_mode="HTML")
-    unfbanned_in_chats = 0
-    for fedchats in chat_list:
-        unfbanned_in_chats += 1
-        try:
-            member = bot.get_chat_member(fedchats, user_id)
-            if member.status == 'kicked':
-                bot.unban_chat_member(fedchats, user_id)
-            # Do not spamming all fed chats
-            """
-			bot.send_message(chat, "<b>Un-FedBan</b>" \
-						 "\n<b>Federation:</b> {}" \
-						 "\n<b>Federation Admin:</b> {}" \
-						 "\n<b>User:</b> {}" \
-						 "\n<b>User ID:</b> <code>{}</code>".format(info['fname'], mention_html(user.id, user.first_name), user_target, fban_user_id), parse_mode="HTML")
-			"""
-        except BadRequest as excp:
-            if excp.message in UNFBAN_ERRORS:
-                pass
-            elif excp.message == "User_id_invalid":
-                break
-            else:
-                LOGGER.warning("Could not fban on {} because: {}".format(
-                    chat, excp.message))
-        except TelegramError:
-            pass
-
     try:
         x = sql.un_fban_user(fed_id, user_id)
         if not x:
@@ -930,42 +821,9 @@ def unfban(update: Update, context: CallbackContext):
     except:
         pass
 
-    # UnFban for fed subscriber
-    subscriber = list(sql.get_subscriber(fed_id))
-    if len(subscriber) != 0:
-        for fedsid in subscriber:
-            all_fedschat = sql.all_fed_chats(fedsid)
-            for fedschat in all_fedschat:
-                try:
-                    bot.unban_chat_member(fedchats, user_id)
-                except BadRequest as excp:
-                    if excp.message in FBAN_ERRORS:
-                        try:
-                            dispatcher.bot.getChat(fedschat)
-                        except Unauthorized:
-                            targetfed_id = sql.get_fed_id(fedschat)
-                            sql.unsubs_fed(fed_id, targetfed_id)
-                            LOGGER.info(
-                                "Chat {} has unsub fed {} because I was kicked"
-                                .format(fedschat, info['fname']))
-                            continue
-                    elif excp.message == "User_id_invalid":
-                        break
-                    else:
-                        LOGGER.warning(
-                            "Unable to fban on {} because: {}".format(
-                                fedschat, excp.message))
-                except TelegramError:
-                    pass
-
-    if unfbanned_in_chats == 0:
-        send_message(update.effective_message,
-                     "This person has been un-fbanned in 0 chats.")
-    if unfbanned_in_chats > 0:
-        send_message(
-            update.effective_message,
-            "This person has been un-fbanned in {} chats.".format(
-                unfbanned_in_chats))
+    fed_enforce(fed_id, fban_user_id, fed_unban, UNFBAN_ERRORS,
+                chat.id,
+                "This person has been un-fbanned in {} chats.")
     # Also do not spamming all fed admins
     """
 	FEDADMIN = sql.all_fed_users(fed_id)
@@ -1421,8 +1279,6 @@ def fed_import_bans(update: Update, context: CallbackContext):
         #if int(int(msg.reply_to_message.document.file_size)/1024) >= 200:
         #	msg.reply_text("This file is too big!")
         #	return
-        success = 0
-        failed = 0
         try:
             file_info = bot.get_file(msg.reply_to_message.document.file_id)
         except BadRequest:
@@ -1431,159 +1287,95 @@ def fed_import_bans(update: Update, context: CallbackContext):
             )
             return
         fileformat = msg.reply_to_message.document.file_name.split('.')[-1]
-        if fileformat == 'json':
-            multi_fed_id = []
-            multi_import_userid = []
-            multi_import_firstname = []
-            multi_import_lastname = []
-            multi_import_username = []
-            multi_import_reason = []
-            with BytesIO() as file:
-                file_info.download(out=file)
-                file.seek(0)
-                reading = file.read().decode('UTF-8')
-                splitting = reading.split('\n')
-                for x in splitting:
-                    if x == '':
-                        continue
-                    try:
-                        data = json.loads(x)
-                    except json.decoder.JSONDecodeError as err:
-                        failed += 1
-                        continue
-                    try:
-                        import_userid = int(data['user_id'])  # Make sure it int
-                        import_firstname = str(data['first_name'])
-                        import_lastname = str(data['last_name'])
-                        import_username = str(data['user_name'])
-                        import_reason = str(data['reason'])
-                    except ValueError:
-                        failed += 1
-                        continue
-                    # Checking user
-                    if int(import_userid) == bot.id:
-                        failed += 1
-                        continue
-                    if is_user_fed_owner(fed_id, import_userid) is True:
-                        failed += 1
-                        continue
-                    if is_user_fed_admin(fed_id, import_userid) is True:
-                        failed += 1
-                        continue
-                    if str(import_userid) == str(OWNER_ID):
-                        failed += 1
-                        continue
-                    if int(import_userid) in SUDO_USERS:
-                        failed += 1
-                        continue
-                    if int(import_userid) in TIGER_USERS:
-                        failed += 1
-                        continue
-                    if int(import_userid) in WHITELIST_USERS:
-                        failed += 1
-                        continue
-                    multi_fed_id.append(fed_id)
-                    multi_import_userid.append(str(import_userid))
-                    multi_import_firstname.append(import_firstname)
-                    multi_import_lastname.append(import_lastname)
-                    multi_import_username.append(import_username)
-                    multi_import_reason.append(import_reason)
-                    success += 1
-                sql.multi_fban_user(multi_fed_id, multi_import_userid,
-                                    multi_import_firstname,
-                                    multi_import_lastname,
-                                    multi_import_username, multi_import_reason)
-            text = "Blocks were successfully imported. {} people are blocked.".format(
-                success)
-            if failed >= 1:
-                text += " {} Failed to import.".format(failed)
-            get_fedlog = sql.get_fed_log(fed_id)
-            if get_fedlog:
-                if eval(get_fedlog):
-                    teks = "Fed *{}* has successfully imported data. {} banned.".format(
-                        getfed['fname'], success)
-                    if failed >= 1:
-                        teks += " {} Failed to import.".format(failed)
-                    bot.send_message(get_fedlog, teks, parse_mode="markdown")
-        elif fileformat == 'csv':
-            multi_fed_id = []
-            multi_import_userid = []
-            multi_import_firstname = []
-            multi_import_lastname = []
-            multi_import_username = []
-            multi_import_reason = []
-            file_info.download("fban_{}.csv".format(
-                msg.reply_to_message.document.file_id))
-            with open(
-                    "fban_{}.csv".format(msg.reply_to_message.document.file_id),
-                    'r',
-                    encoding="utf8") as csvFile:
-                reader = csv.reader(csvFile)
-                for data in reader:
-                    try:
-                        import_userid = int(data[0])  # Make sure it int
-                        import_firstname = str(data[1])
-                        import_lastname = str(data[2])
-                        import_username = str(data[3])
-                        import_reason = str(data[4])
-                    except ValueError:
-                        failed += 1
-                        continue
-                    # Checking user
-                    if int(import_userid) == bot.id:
-                        failed += 1
-                        continue
-                    if is_user_fed_owner(fed_id, import_userid) is True:
-                        failed += 1
-                        continue
-                    if is_user_fed_admin(fed_id, import_userid) is True:
-                        failed += 1
-                        continue
-                    if str(import_userid) == str(OWNER_ID):
-                        failed += 1
-                        continue
-                    if int(import_userid) in SUDO_USERS:
-                        failed += 1
-                        continue
-                    if int(import_userid) in TIGER_USERS:
-                        failed += 1
-                        continue
-                    if int(import_userid) in WHITELIST_USERS:
-                        failed += 1
-                        continue
-                    multi_fed_id.append(fed_id)
-                    multi_import_userid.append(str(import_userid))
-                    multi_import_firstname.append(import_firstname)
-                    multi_import_lastname.append(import_lastname)
-                    multi_import_username.append(import_username)
-                    multi_import_reason.append(import_reason)
-                    success += 1
-                    # t = ThreadWithReturnValue(target=sql.fban_user, args=(fed_id, str(import_userid), import_firstname, import_lastname, import_username, import_reason,))
-                    # t.start()
-                sql.multi_fban_user(multi_fed_id, multi_import_userid,
-                                    multi_import_firstname,
-                                    multi_import_lastname,
-                                    multi_import_username, multi_import_reason)
-            csvFile.close()
-            os.remove("fban_{}.csv".format(
-                msg.reply_to_message.document.file_id))
-            text = "Files were imported successfully. {} people banned.".format(
-                success)
-            if failed >= 1:
-                text += " {} Failed to import.".format(failed)
-            get_fedlog = sql.get_fed_log(fed_id)
-            if get_fedlog:
-                if eval(get_fedlog):
-                    teks = "Fed *{}* has successfully imported data. {} banned.".format(
-                        getfed['fname'], success)
-                    if failed >= 1:
-                        teks += " {} Failed to import.".format(failed)
-                    bot.send_message(get_fedlog, teks, parse_mode="markdown")
-        else:
+        if fileformat not in ('json', 'csv'):
             send_message(update.effective_message,
                          "This file is not supported.")
             return
-        send_message(update.effective_message, text)
+
+        # users the federation can never ban, checked once instead of per row
+        protected = set(int(x) for x in sql.all_fed_users(fed_id) or [])
+        protected.update(SUDO_USERS, TIGER_USERS, WHITELIST_USERS)
+        protected.update((bot.id, int(OWNER_ID)))
+
+        path = "fban_{}.{}".format(msg.reply_to_message.document.file_id,
+                                   fileformat)
+        status = msg.reply_text("Importing federation bans...")
+        success = 0
+        failed = 0
+        seen = set()
+        chunk = []
+        last_edit = time.monotonic()
+        try:
+            file_info.download(path)
+            for row in import_fban_rows(path, fileformat):
+                if row is None or row[0] in protected:
+                    failed += 1
+                    continue
+                if row[0] in seen:
+                    continue
+                seen.add(row[0])
+                success += 1
+                # already banned with the same details, nothing to write
+                current = sql.get_fban_info(fed_id, row[0])
+                if current and (current['first_name'], current['last_name'],
+                                current['user_name'],
+                                current['reason']) == row[1:]:
+                    continue
+                chunk.append(row)
+                if len(chunk) >= FBAN_IMPORT_CHUNK:
+                    if sql.bulk_fban_users(fed_id, chunk) is False:
+                        failed += len(chunk)
+                        success -= len(chunk)
+                    chunk = []
+                    if time.monotonic() - last_edit >= FBAN_IMPORT_PROGRESS:
+                        last_edit = time.monotonic()
+                        status.edit_text(
+                            "Importing federation bans... {} imported, {} failed so far."
+                            .format(success, failed))
+            if chunk and sql.bulk_fban_users(fed_id, chunk) is False:
+                failed += len(chunk)
+                success -= len(chunk)
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+
+        text = "Blocks were successfully imported. {} people are blocked.".format(
+            success)
+        if failed >= 1:
+            text += " {} Failed to import.".format(failed)
+        get_fedlog = sql.get_fed_log(fed_id)
+        if get_fedlog:
+            if eval(get_fedlog):
+                teks = "Fed *{}* has successfully imported data. {} banned.".format(
+                    getfed['fname'], success)
+                if failed >= 1:
+                    teks += " {} Failed to import.".format(failed)
+                bot.send_message(get_fedlog, teks, parse_mode="markdown")
+        status.edit_text(text)
+
+
+def import_fban_rows(path, fileformat):
+    """Yield (user_id, first_name, last_name, user_name, reason) per line of
+    an fban backup, or None for a line that can't be read."""
+    with open(path, 'r', encoding="utf8") as file:
+        if fileformat == 'json':
+            for line in file:
+                if not line.strip():
+                    continue
+                try:
+                    data = json.loads(line)
+                    yield (int(data['user_id']), str(data['first_name']),
+                           str(data['last_name']), str(data['user_name']),
+                           str(data['reason']))
+                except (ValueError, KeyError, TypeError):
+                    yield None
+        else:
+            for data in csv.reader(file):
+                try:
+                    yield (int(data[0]), str(data[1]), str(data[2]),
+                           str(data[3]), str(data[4]))
+                except (ValueError, IndexError):
+                    yield None
 
 
 @run_async
@@ -0,0 +1,144 @@
+import queue
+import threading
+
+from Megumi import LOGGER
+from Megumi.modules.helper_funcs.fanout import LimitedBot, fan_out
+from Megumi.modules.sql import broadcast_sql as sql
+from Megumi.modules.sql import users_sql
+from telegram import ParseMode
+from telegram.error import TelegramError
+
+# recipients read from the database, sent to and checkpointed at a time
+BROADCAST_BATCH = 200
+
+# errors meaning the recipient is gone for good; they are pruned from the db
+PRUNE_ERRORS = {
+    "Forbidden: bot was blocked by the user",
+    "Forbidden: user is deactivated",
+    "Forbidden: bot was kicked from the group chat",
+    "Forbidden: bot was kicked from the supergroup chat",
+    "Forbidden: bot is not a member of the supergroup chat",
+    "Chat not found",
+}
+
+# broadcast ids waiting for the sender, which runs them one after the other
+BROADCAST_QUEUE = queue.Queue()
+# ids queued or being sent, so that none is picked up twice
+BROADCAST_IDS = set()
+BROADCAST_SENDER = []
+BROADCAST_SENDER_LOCK = threading.Lock()
+
+STAGES = {
+    "chats": (users_sql.get_chat_ids_after, users_sql.rem_chats),
+    "users": (users_sql.get_user_ids_after, users_sql.del_users),
+}
+
+
+def __next_stage(broadcast, stage):
+    if stage == "chats" and broadcast.to_users:
+        return "users"
+    return "done"
+
+
+def __send_batch(bot, text, recipients):
+    gone = []
+    bot = LimitedBot(bot)
+
+    def send(chat_id):
+        try:
+            bot.send_message(
+                chat_id,
+                text,
+                parse_mode=ParseMode.MARKDOWN,
+                disable_web_page_preview=True)
+        except TelegramError as excp:
+            if excp.message not in PRUNE_ERRORS:
+                raise
+            gone.append(chat_id)
+            return False
+
+    result = fan_out(recipients, send)
+    return result.succeeded, result.failed, gone
+
+
+def run_broadcast(bot, broadcast_id):
+    """Send a broadcast from its saved cursor on; progress is stored after
+    every batch, so a restart repeats at most one batch."""
+    broadcast = sql.get_broadcast(broadcast_id)
+    # already reported by the run that finished it
+    if not broadcast or broadcast.stage == "done":
+        return
+    stage, cursor = broadcast.stage, broadcast.cursor
+
+    while stage != "done":
+        fetch, prune = STAGES[stage]
+        recipients = fetch(cursor, BROADCAST_BATCH)
+        if not recipients:
+            stage, cursor = __next_stage(broadcast, stage), None
+            sql.save_progress(broadcast_id, stage, cursor, 0, 0, 0)
+            continue
+
+        sent, failed, gone = __send_batch(bot, broadcast.text, recipients)
+        if gone:
+            prune(gone)
+        cursor = str(recipients[-1])
+        sql.save_progress(broadcast_id, stage, cursor, sent, failed, len(gone))
+
+    broadcast = sql.get_broadcast(broadcast_id)
+    try:
+        bot.send_message(
+            int(broadcast.origin_chat_id),
+            f"Broadcast {broadcast_id} complete.\n"
+            f"Sent: {broadcast.sent}.\nFailed: {broadcast.failed}.\n"
+            f"Pruned: {broadcast.pruned} chats and users which blocked or removed me.")
+    except TelegramError:
+        LOGGER.warning("Could not report broadcast %s", broadcast_id)
+
+
+def __sender(bot):
+    while True:
+        broadcast_id = BROADCAST_QUEUE.get()
+        try:
+            run_broadcast(bot, broadcast_id)
+        except Exception:
+            LOGGER.exception("Broadcast %s stopped, it resumes on restart",
+                             broadcast_id)
+        finally:
+            with BROADCAST_SENDER_LOCK:
+                BROADCAST_IDS.discard(broadcast_id)
+
+
+def __start_sender(bot):
+    with BROADCAST_SENDER_LOCK:
+        if BROADCAST_SENDER:
+            return
+        sender = threading.Thread(target=__sender, args=(bot,), daemon=True)
+        sender.start()
+        BROADCAST_SENDER.append(sender)
+
+
+def __enqueue(broadcast_id) -> bool:
+    with BROADCAST_SENDER_LOCK:
+        if broadcast_id in BROADCAST_IDS:
+            return False
+        BROADCAST_IDS.add(broadcast_id)
+    BROADCAST_QUEUE.put(broadcast_id)
+    return True
+
+
+def queue_broadcast(bot, text, to_groups, to_users, origin_chat_id) -> int:
+    broadcast_id = sql.new_broadcast(text, to_groups, to_users, origin_chat_id)
+    __start_sender(bot)
+    __enqueue(broadcast_id)
+    return broadcast_id
+
+
+def resume_broadcasts(bot):
+    """Pick up the broadcasts a previous run didn't finish, skipping any
+    queued since startup."""
+    unfinished = sql.get_unfinished_broadcasts()
+    if unfinished:
+        __start_sender(bot)
+    return [
+        broadcast_id for broadcast_id in unfinished if __enqueue(broadcast_id)
+    ]
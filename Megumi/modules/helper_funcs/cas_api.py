@@ -1,7 +1,7 @@
 import urllib.request as url
 import json
 import datetime
-import requests
+from Megumi.modules.helper_funcs.reputation import HTTP_SESSION, REQUEST_TIMEOUT
 
 
 VERSION = "1.3.3"
@@ -9,7 +9,7 @@ CAS_QUERY_URL = "https://api.cas.chat/check?user_id="
 DL_DIR = "./csvExports"
 
 def get_user_data(user_id):
-    with requests.request('GET', CAS_QUERY_URL + str(user_id)) as userdata_raw:
+    with HTTP_SESSION.get(CAS_QUERY_URL + str(user_id), timeout=REQUEST_TIMEOUT) as userdata_raw:
         userdata = json.loads(userdata_raw.text)
         return userdata
 
@@ -1,8 +1,12 @@
+import threading
+import time
+from collections import OrderedDict
 from functools import wraps
 
 from Megumi import (DEL_CMDS, DEV_USERS, SUDO_USERS, SUPPORT_CHAT,
-                          SUPPORT_USERS, TIGER_USERS, WHITELIST_USERS,
-                          dispatcher)
+                          TIGER_USERS, WHITELIST_USERS, dispatcher)
+from Megumi.modules.helper_funcs.privileges import (SUDO, SUPPORT, WHITELIST,
+                                                    get_rank)
 from telegram import Chat, ChatMember, ParseMode, Update
 from telegram.ext import CallbackContext
 
@@ -10,19 +14,130 @@ from telegram.ext import CallbackContext
 def is_whitelist_plus(chat: Chat,
                       user_id: int,
                       member: ChatMember = None) -> bool:
-    return any(
-        user_id in user for user in
-        [WHITELIST_USERS, TIGER_USERS, SUPPORT_USERS, SUDO_USERS, DEV_USERS])
+    return get_rank(user_id) >= WHITELIST
 
 
 def is_support_plus(chat: Chat,
                     user_id: int,
                     member: ChatMember = None) -> bool:
-    return user_id in SUPPORT_USERS or user_id in SUDO_USERS or user_id in DEV_USERS
+    return get_rank(user_id) >= SUPPORT
 
 
 def is_sudo_plus(chat: Chat, user_id: int, member: ChatMember = None) -> bool:
-    return user_id in SUDO_USERS or user_id in DEV_USERS
+    return get_rank(user_id) >= SUDO
+
+
+ADMIN_CACHE_TTL = 5 * 60
+MEMBER_CACHE_TTL = 60
+MEMBER_CACHE_SIZE = 10000
+BOT_MEMBER_CACHE_TTL = 10 * 60
+
+# chat_id -> (expires_at, {user_id: ChatMember}) for every admin in the chat
+ADMIN_CACHE = OrderedDict()
+# (chat_id, user_id) -> (expires_at, ChatMember) for non-admin lookups
+MEMBER_CACHE = OrderedDict()
+# chat_id -> (expires_at, ChatMember) for the bot itself
+BOT_MEMBER_CACHE = OrderedDict()
+MEMBER_CACHE_LOCK = threading.RLock()
+MEMBER_CACHE_STATS = {"hits": 0, "misses": 0}
+
+
+def __cache_get(cache, key):
+    with MEMBER_CACHE_LOCK:
+        entry = cache.get(key)
+        if entry and entry[0] > time.monotonic():
+            cache.move_to_end(key)
+            return entry[1]
+        return None
+
+
+def __count(hit):
+    # one count per lookup, however many caches it went through
+    with MEMBER_CACHE_LOCK:
+        MEMBER_CACHE_STATS["hits" if hit else "misses"] += 1
+
+
+def __cache_put(cache, key, value, ttl):
+    with MEMBER_CACHE_LOCK:
+        cache[key] = (time.monotonic() + ttl, value)
+        cache.move_to_end(key)
+        while len(cache) > MEMBER_CACHE_SIZE:
+            cache.popitem(last=False)
+
+
+def __chat_admins(chat: Chat):
+    # (admins, whether they came from the cache)
+    admins = __cache_get(ADMIN_CACHE, chat.id)
+    if admins is not None:
+        return admins, True
+    admins = {admin.user.id: admin for admin in chat.get_administrators()}
+    __cache_put(ADMIN_CACHE, chat.id, admins, ADMIN_CACHE_TTL)
+    return admins, False
+
+
+def get_chat_admins(chat: Chat) -> dict:
+    admins, hit = __chat_admins(chat)
+    __count(hit)
+    return admins
+
+
+def get_chat_member(chat: Chat, user_id: int) -> ChatMember:
+    admins, hit = __chat_admins(chat)
+    if user_id in admins:
+        __count(hit)
+        return admins[user_id]
+
+    member = __cache_get(MEMBER_CACHE, (chat.id, user_id))
+    if member is None:
+        hit = False
+        member = chat.get_member(user_id)
+        __cache_put(MEMBER_CACHE, (chat.id, user_id), member,
+                    MEMBER_CACHE_TTL)
+    __count(hit)
+    return member
+
+
+def get_bot_member(chat: Chat) -> ChatMember:
+    member = __cache_get(BOT_MEMBER_CACHE, chat.id)
+    __count(member is not None)
+    if member is None:
+        member = chat.get_member(dispatcher.bot.id)
+        __cache_put(BOT_MEMBER_CACHE, chat.id, member, BOT_MEMBER_CACHE_TTL)
+    return member
+
+
+def set_bot_member(chat_id: int, member: ChatMember):
+    __cache_put(BOT_MEMBER_CACHE, chat_id, member, BOT_MEMBER_CACHE_TTL)
+
+
+def invalidate_member(chat_id: int, user_id: int = None):
+    with MEMBER_CACHE_LOCK:
+        if user_id is None or user_id == dispatcher.bot.id:
+            BOT_MEMBER_CACHE.pop(chat_id, None)
+        if user_id is None:
+            ADMIN_CACHE.pop(chat_id, None)
+            for key in [key for key in MEMBER_CACHE if key[0] == chat_id]:
+                del MEMBER_CACHE[key]
+            return
+
+        MEMBER_CACHE.pop((chat_id, user_id), None)
+        entry = ADMIN_CACHE.get(chat_id)
+        if entry and user_id in entry[1]:
+            del ADMIN_CACHE[chat_id]
+
+
+def invalidate_admins(chat_id: int):
+    with MEMBER_CACHE_LOCK:
+        ADMIN_CACHE.pop(chat_id, None)
+
+
+def member_cache_stats() -> dict:
+    with MEMBER_CACHE_LOCK:
+        return dict(
+            MEMBER_CACHE_STATS,
+            admin_chats=len(ADMIN_CACHE),
+            members=len(MEMBER_CACHE),
+            bot_chats=len(BOT_MEMBER_CACHE))
 
 
 def is_user_admin(chat: Chat, user_id: int, member: ChatMember = None) -> bool:
@@ -32,11 +147,22 @@ def is_user_admin(chat: Chat, user_id: int, member: ChatMember = None) -> bool:
         return True
 
     if not member:
-        member = chat.get_member(user_id)
+        return user_id in get_chat_admins(chat)
 
     return member.status in ('administrator', 'creator')
 
 
+def is_known_admin(chat: Chat, user_id: int) -> bool:
+    """is_user_admin for hot paths: never calls telegram, so admins of chats
+    whose admin list isn't cached yet count as regular users."""
+    if chat.type == 'private' or get_rank(user_id) >= SUDO:
+        return True
+    with MEMBER_CACHE_LOCK:
+        entry = ADMIN_CACHE.get(chat.id)
+        return bool(entry and entry[0] > time.monotonic() and
+                    user_id in entry[1])
+
+
 def is_bot_admin(chat: Chat,
                  bot_id: int,
                  bot_member: ChatMember = None) -> bool:
@@ -44,13 +170,19 @@ def is_bot_admin(chat: Chat,
         return True
 
     if not bot_member:
-        bot_member = chat.get_member(bot_id)
+        return bot_id in get_chat_admins(chat)
 
     return bot_member.status in ('administrator', 'creator')
 
 
 def can_delete(chat: Chat, bot_id: int) -> bool:
-    return chat.get_member(bot_id).can_delete_messages
+    if chat.type == 'private':
+        return False
+
+    bot_member = get_chat_admins(chat).get(bot_id)
+    if not bot_member:
+        return False
+    return bot_member.can_delete_messages
 
 
 def is_user_ban_protected(chat: Chat,
@@ -62,13 +194,13 @@ def is_user_ban_protected(chat: Chat,
         return True
 
     if not member:
-        member = chat.get_member(user_id)
+        return user_id in get_chat_admins(chat)
 
     return member.status in ('administrator', 'creator')
 
 
 def is_user_in_chat(chat: Chat, user_id: int) -> bool:
-    member = chat.get_member(user_id)
+    member = get_chat_member(chat, user_id)
     return member.status not in ('left', 'kicked')
 
 
@@ -0,0 +1,148 @@
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from Megumi import LOGGER
+from telegram.error import RetryAfter, TelegramError
+
+FANOUT_WORKERS = 8
+# Telegram allows roughly 30 calls a second per bot; leave room for handlers
+GLOBAL_RATE = 25
+# minimum spacing, in seconds, between two fan-out calls into the same chat
+PER_CHAT_INTERVAL = 1
+MAX_RETRIES = 3
+
+FanoutResult = namedtuple("FanoutResult", "succeeded failed skipped errors")
+
+
+class TokenBucket:
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def __refill(self, now):
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self) -> bool:
+        with self.lock:
+            self.__refill(time.monotonic())
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                self.__refill(time.monotonic())
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class LimitedBot:
+    """Wraps a Bot so that every API call made through it first takes a
+    token from FANOUT_LIMITER; fan-out actions make their calls with one."""
+
+    def __init__(self, bot):
+        self.bot = bot
+
+    def __getattr__(self, name):
+        attr = getattr(self.bot, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            FANOUT_LIMITER.acquire()
+            return attr(*args, **kwargs)
+
+        return call
+
+
+FANOUT_LIMITER = TokenBucket(GLOBAL_RATE, GLOBAL_RATE)
+FANOUT_EXECUTOR = ThreadPoolExecutor(max_workers=FANOUT_WORKERS)
+
+CHAT_NEXT_CALL = {}
+CHAT_NEXT_CALL_LOCK = threading.Lock()
+
+
+def __wait_for_chat(chat_id):
+    with CHAT_NEXT_CALL_LOCK:
+        now = time.monotonic()
+        due = max(now, CHAT_NEXT_CALL.get(chat_id, 0))
+        CHAT_NEXT_CALL[chat_id] = due + PER_CHAT_INTERVAL
+        if len(CHAT_NEXT_CALL) > 10000:
+            for key in [k for k, v in CHAT_NEXT_CALL.items() if v < now]:
+                del CHAT_NEXT_CALL[key]
+    if due > now:
+        time.sleep(due - now)
+
+
+def __call(chat_id, action):
+    for attempt in range(MAX_RETRIES + 1):
+        __wait_for_chat(chat_id)
+        try:
+            return action(chat_id)
+        except RetryAfter as excp:
+            if attempt == MAX_RETRIES:
+                raise
+            time.sleep(excp.retry_after * (attempt + 1))
+
+
+def fan_out(chat_ids, action, skip_errors=()) -> FanoutResult:
+    """Run action(chat_id) once for every distinct chat, concurrently and
+    rate limited. action makes its API calls through a LimitedBot, so each
+    call counts against the global rate. action returns False to mark a chat
+    as skipped; telegram errors listed in skip_errors count as skipped, any
+    other as failed."""
+    chat_ids = list(dict.fromkeys(int(chat_id) for chat_id in chat_ids))
+    futures = [
+        FANOUT_EXECUTOR.submit(__call, chat_id, action) for chat_id in chat_ids
+    ]
+
+    succeeded = failed = skipped = 0
+    errors = {}
+    for future in futures:
+        try:
+            done = future.result()
+        except TelegramError as excp:
+            if excp.message in skip_errors:
+                skipped += 1
+            else:
+                failed += 1
+                errors[excp.message] = errors.get(excp.message, 0) + 1
+            continue
+        except Exception:
+            LOGGER.exception("Unexpected error during fan-out")
+            failed += 1
+            continue
+
+        if done is False:
+            skipped += 1
+        else:
+            succeeded += 1
+
+    return FanoutResult(succeeded, failed, skipped, errors)
+
+
+def fan_out_background(chat_ids, action, callback, skip_errors=()):
+    """Like fan_out, but returns at once and hands the result to callback
+    from a separate thread, so the calling handler's worker is released."""
+
+    def run():
+        try:
+            result = fan_out(chat_ids, action, skip_errors)
+            callback(result)
+        except Exception:
+            LOGGER.exception("Fan-out failed")
+
+    threading.Thread(target=run, daemon=True).start()
@@ -1,7 +1,9 @@
 import Megumi.modules.sql.blacklistusers_sql as sql
 from Megumi import ALLOW_EXCL
 from telegram import MessageEntity, Update
-from telegram.ext import CommandHandler, MessageHandler, RegexHandler, Filters
+from telegram.ext import (CommandHandler, Dispatcher, MessageHandler,
+                          RegexHandler, Filters)
+from telegram.ext.dispatcher import DEFAULT_GROUP
 from time import sleep
 
 if ALLOW_EXCL:
@@ -92,3 +94,74 @@ class CustomMessageHandler(MessageHandler):
         def check_update(self, update):
             if isinstance(update, Update) and update.effective_message:
                 return self.filters(update)
+
+
+# command -> groups holding a command handler for it, filled by add_handler
+COMMAND_ROUTES = {}
+# (group, command, over_rate) -> the handlers of that group an update carrying
+# the command has to be checked against; command None is the route of every
+# other update
+ROUTE_CACHE = {}
+# handlers which still see updates from chats and users over their rate
+MODERATION_HANDLERS = set()
+
+dispatcher_add_handler = Dispatcher.add_handler
+dispatcher_remove_handler = Dispatcher.remove_handler
+
+
+def add_handler(self, handler, group=DEFAULT_GROUP):
+    dispatcher_add_handler(self, handler, group)
+    if isinstance(handler, CustomCommandHandler):
+        for command in handler.command:
+            COMMAND_ROUTES.setdefault(command, set()).add(group)
+    ROUTE_CACHE.clear()
+
+
+def remove_handler(self, handler, group=DEFAULT_GROUP):
+    dispatcher_remove_handler(self, handler, group)
+    ROUTE_CACHE.clear()
+
+
+def moderation_handler(handler):
+    """Mark handler as moderation (locks, blacklists, antiflood, ...), so it
+    keeps running for updates the rate limiter holds back."""
+    MODERATION_HANDLERS.add(handler)
+    ROUTE_CACHE.clear()
+    return handler
+
+
+def extract_command(update, bot_username):
+    """The lowercase command an update carries, if it is meant for us."""
+    if not isinstance(update, Update) or not update.effective_message:
+        return None
+    message = update.effective_message
+    if not message.text or not message.text.startswith(CMD_STARTERS):
+        return None
+
+    entity = message.entities[0] if message.entities else None
+    if (entity and entity.type == MessageEntity.BOT_COMMAND and
+            entity.offset == 0):
+        command = message.text[1:entity.length]
+    else:
+        command = message.text.split(None, 1)[0][1:]
+
+    command, _, target = command.lower().partition('@')
+    if target and target != bot_username.lower():
+        return None
+    return command
+
+
+def route(dispatcher, group, command, over_rate=False):
+    if group not in COMMAND_ROUTES.get(command, ()):
+        command = None
+
+    handlers = ROUTE_CACHE.get((group, command, over_rate))
+    if handlers is None:
+        handlers = [
+            handler for handler in dispatcher.handlers[group]
+            if (not isinstance(handler, CustomCommandHandler) or
+                command in handler.command) and
+            (not over_rate or handler in MODERATION_HANDLERS)
+        ]
+        ROUTE_CACHE[(group, command, over_rate)] = handlers
+    return handlers
@@ -0,0 +1,132 @@
+import json
+import os
+import tempfile
+import threading
+
+# disaster levels, lowest first; a user holds at most one of them
+WHITELIST, TIGER, SUPPORT, SUDO, DEV = range(1, 6)
+
+ELEVATED_USERS_FILE = os.path.join(os.getcwd(), 'Megumi/elevated_users.json')
+# elevated_users.json key of every rank
+RANK_KEYS = {
+    WHITELIST: "whitelists",
+    TIGER: "tigers",
+    SUPPORT: "supports",
+    SUDO: "sudos",
+    DEV: "devs"
+}
+
+# user_id -> rank, for everyone with one
+RANKS = {}
+# ranks given by the config; elevated_users.json overrides all but DEV
+CONFIG_RANKS = {}
+RANKS_LOCK = threading.RLock()
+
+
+class RankView:
+    """Live, read-only collection of the users holding one of ranks."""
+
+    def __init__(self, *ranks):
+        self.ranks = frozenset(ranks)
+
+    def __contains__(self, user_id):
+        return RANKS.get(user_id) in self.ranks
+
+    def __iter__(self):
+        return iter([
+            user_id for user_id, rank in list(RANKS.items())
+            if rank in self.ranks
+        ])
+
+    def __len__(self):
+        return sum(1 for rank in list(RANKS.values()) if rank in self.ranks)
+
+    def __add__(self, other):
+        return list(self) + list(other)
+
+    def __radd__(self, other):
+        return list(other) + list(self)
+
+    def __repr__(self):
+        return "RankView({})".format(list(self))
+
+
+def get_rank(user_id) -> int:
+    return RANKS.get(user_id, 0)
+
+
+def __read_file():
+    try:
+        with open(ELEVATED_USERS_FILE, 'r') as infile:
+            return json.load(infile)
+    except FileNotFoundError:
+        return {}
+
+
+def __write_file():
+    data = __read_file()
+    for rank, key in RANK_KEYS.items():
+        data[key] = sorted(
+            user_id for user_id, user_rank in RANKS.items()
+            if user_rank == rank and CONFIG_RANKS.get(user_id) != rank)
+
+    # write a sibling file and swap it in, so readers never see half of it
+    fd, path = tempfile.mkstemp(
+        dir=os.path.dirname(ELEVATED_USERS_FILE), suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w') as outfile:
+            json.dump(data, outfile, indent=4)
+        os.replace(path, ELEVATED_USERS_FILE)
+    except BaseException:
+        os.unlink(path)
+        raise
+
+
+def load_ranks(config_ranks):
+    """Set the ranks from the config, given as {rank: user ids}, then
+    apply elevated_users.json on top of them."""
+    with RANKS_LOCK:
+        CONFIG_RANKS.clear()
+        for rank in sorted(config_ranks):
+            for user_id in config_ranks[rank]:
+                CONFIG_RANKS[int(user_id)] = rank
+        reload_ranks()
+
+
+def reload_ranks():
+    """Re-read elevated_users.json; every module sees the result at once."""
+    with RANKS_LOCK:
+        ranks = dict(CONFIG_RANKS)
+        data = __read_file()
+        for rank, key in sorted(RANK_KEYS.items()):
+            for user_id in data.get(key, []):
+                if CONFIG_RANKS.get(int(user_id)) != DEV:
+                    ranks[int(user_id)] = rank
+        # update in place, checks running meanwhile never see an empty registry
+        RANKS.update(ranks)
+        for user_id in set(RANKS) - set(ranks):
+            del RANKS[user_id]
+
+
+def set_rank(user_id, rank):
+    with RANKS_LOCK:
+        # devs from the config can't be demoted at runtime
+        if CONFIG_RANKS.get(user_id) == DEV:
+            return
+        RANKS[user_id] = rank
+        __write_file()
+
+
+def remove_rank(user_id) -> bool:
+    """Drop a rank given at runtime, falling back to the config rank if there
+    is one. Ranks set in the config can't be removed; returns False for them."""
+    with RANKS_LOCK:
+        config_rank = CONFIG_RANKS.get(user_id)
+        if config_rank is not None and RANKS.get(user_id) == config_rank:
+            return False
+        if config_rank is not None:
+            RANKS[user_id] = config_rank
+        else:
+            RANKS.pop(user_id, None)
+        __write_file()
+        return True
@@ -1,4 +1,21 @@
+import re
+import threading
+import time
+
 import regex
+from Megumi import LOGGER
+
+# Triggers using these can't share a pattern: group numbers and inline flags
+# would change meaning once the trigger is merged with others.
+UNMERGEABLE = regex.compile(r'\\(?:\d|g)|\(\?(?:[a-zA-Z]|P[<=>]|<)')
+
+# seconds of regex time a chat may use per window, whatever its message rate
+REGEX_CHAT_BUDGET = 10
+REGEX_WINDOW = 60
+REGEX_USAGE_SIZE = 10000
+# chat_id -> (window start, seconds used)
+REGEX_USAGE = {}
+REGEX_USAGE_LOCK = threading.Lock()
 
 
 def regex_searcher(regex_string, string):
@@ -11,6 +28,88 @@ def regex_searcher(regex_string, string):
     return search
 
 
+def compile_triggers(triggers, prefix="", suffix=""):
+    """Compile triggers into as few patterns as possible.
+
+    Plain triggers are merged into one alternation; anything that can't be
+    merged safely, or fails to compile merged, gets a pattern of its own.
+    Triggers that don't compile at all are dropped.
+    """
+    merge, alone = [], []
+    for trigger in triggers:
+        (alone if UNMERGEABLE.search(trigger) else merge).append(trigger)
+
+    patterns = []
+    if merge:
+        try:
+            patterns.append(
+                regex.compile(prefix + "(?:" + "|".join(
+                    "(?:" + trigger + ")" for trigger in merge) + ")" + suffix))
+        except Exception:
+            alone = merge + alone
+
+    for trigger in alone:
+        try:
+            patterns.append(regex.compile(prefix + trigger + suffix))
+        except Exception:
+            continue
+    return patterns
+
+
+def __chat_allowance(chat_id, now):
+    with REGEX_USAGE_LOCK:
+        if len(REGEX_USAGE) > REGEX_USAGE_SIZE:
+            for key in [key for key, (start, _) in REGEX_USAGE.items()
+                        if now - start >= REGEX_WINDOW]:
+                del REGEX_USAGE[key]
+        start, used = REGEX_USAGE.get(chat_id, (now, 0.0))
+        if now - start >= REGEX_WINDOW:
+            start, used = now, 0.0
+            REGEX_USAGE[chat_id] = (start, used)
+        return REGEX_CHAT_BUDGET - used
+
+
+def __charge_chat(chat_id, seconds):
+    with REGEX_USAGE_LOCK:
+        start, used = REGEX_USAGE.get(chat_id, (time.monotonic(), 0.0))
+        REGEX_USAGE[chat_id] = (start, used + seconds)
+
+
+def search_patterns(patterns, string, budget=2, chat_id=None):
+    """First match of any pattern in string, or None.
+
+    budget is shared by every pattern so a message costs at most that long;
+    with a chat_id it is also capped by what is left of the chat's
+    REGEX_CHAT_BUDGET for the current REGEX_WINDOW. A pattern that runs out
+    of time is logged and skipped, the ones after it still get their turn.
+    """
+    now = time.monotonic()
+    if chat_id is not None:
+        budget = min(budget, __chat_allowance(chat_id, now))
+    deadline = now + budget
+    started = time.thread_time()
+    try:
+        for index, pattern in enumerate(patterns):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                LOGGER.debug("Regex budget used up in %s, %d patterns left",
+                             chat_id, len(patterns) - index)
+                return None
+            try:
+                match = pattern.search(
+                    string, timeout=remaining, concurrent=True)
+            except TimeoutError:
+                LOGGER.warning("Regex %r timed out in %s", pattern.pattern,
+                               chat_id)
+                continue
+            if match:
+                return match
+        return None
+    finally:
+        if chat_id is not None:
+            __charge_chat(chat_id, time.thread_time() - started)
+
+
 def infinite_loop_check(regex_string):
     loop_matches = [
         r'\((.{1,}[\+\*]){1,}\)[\+\*].',
@@ -22,3 +121,28 @@ def infinite_loop_check(regex_string):
         if match_1:
             return True
     return False
+
+
+def compile_keywords(keywords):
+    # One capture group per keyword, tried in priority order at every
+    # word boundary; the lookahead lets a single scan see overlapping hits.
+    if not keywords:
+        return None
+    alternatives = "|".join(
+        r"({})(?!\w)".format(re.escape(keyword)) for keyword in keywords)
+    return re.compile(r"(?<!\w)(?=(?:{}))".format(alternatives), re.IGNORECASE)
+
+
+def match_keyword(pattern, keywords, text):
+    # Same result as testing ( |^|[^\w])keyword( |$|[^\w]) for each keyword
+    # in order and returning the first hit.
+    if pattern is None:
+        return None
+    best = None
+    for match in pattern.finditer(text):
+        index = match.lastindex - 1
+        if best is None or index < best:
+            best = index
+            if best == 0:
+                break
+    return keywords[best] if best is not None else None
@@ -0,0 +1,209 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import requests
+from Megumi import LOGGER, SPAMWATCH_API
+from requests.adapters import HTTPAdapter
+
+SPAMWATCH_URL = "https://api.spamwat.ch/banlist/"
+CAS_URL = "https://api.cas.chat/check"
+
+# verdicts; UNKNOWN means no answer in time and is never cached
+BANNED, CLEAN, UNKNOWN = "banned", "clean", "unknown"
+
+# seconds a single request, and a whole batch, may take before giving up
+REQUEST_TIMEOUT = 3
+LOOKUP_TIMEOUT = 2
+BANNED_TTL = 6 * 60 * 60
+CLEAN_TTL = 30 * 60
+VERDICT_CACHE_SIZE = 50000
+LOOKUP_WORKERS = 16
+# lookups queued or running at once; past this, users come back UNKNOWN
+# instead of waiting behind a backlog
+MAX_PENDING_LOOKUPS = LOOKUP_WORKERS * 2
+# a service failing this many times in a row is skipped for BREAKER_COOLDOWN
+BREAKER_THRESHOLD = 5
+BREAKER_COOLDOWN = 60
+
+HTTP_SESSION = requests.Session()
+HTTP_SESSION.mount(
+    "https://",
+    HTTPAdapter(pool_connections=4, pool_maxsize=LOOKUP_WORKERS))
+LOOKUP_EXECUTOR = ThreadPoolExecutor(max_workers=LOOKUP_WORKERS)
+
+# (service, user_id) -> (expires_at, verdict)
+VERDICTS = OrderedDict()
+VERDICTS_LOCK = threading.Lock()
+REPUTATION_STATS = {"hits": 0, "lookups": 0, "unknown": 0}
+PENDING_LOOKUPS = [0]
+PENDING_LOOKUPS_LOCK = threading.Lock()
+
+
+class CircuitBreaker:
+
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.open_until = 0
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def allow(self) -> bool:
+        # once the cooldown is over a single request goes through as a probe,
+        # the rest stay blocked until it has succeeded
+        with self.lock:
+            if not self.open_until:
+                return True
+            if self.probing or time.monotonic() < self.open_until:
+                return False
+            self.probing = True
+            return True
+
+    def succeeded(self):
+        with self.lock:
+            self.failures = 0
+            self.open_until = 0
+            self.probing = False
+
+    def failed(self):
+        with self.lock:
+            self.failures += 1
+            if self.probing or self.failures >= self.threshold:
+                self.open_until = time.monotonic() + self.cooldown
+                self.failures = 0
+                self.probing = False
+
+    def dropped(self):
+        # a lookup was cancelled before it ran, it can't have been the probe's answer
+        with self.lock:
+            self.probing = False
+
+
+def __spamwatch(user_id):
+    response = HTTP_SESSION.get(
+        SPAMWATCH_URL + str(user_id),
+        headers={"Authorization": f"Bearer {SPAMWATCH_API}"},
+        timeout=REQUEST_TIMEOUT)
+    if response.status_code == 404:
+        return CLEAN
+    response.raise_for_status()
+    return BANNED
+
+
+def __cas(user_id):
+    response = HTTP_SESSION.get(
+        CAS_URL, params={"user_id": user_id}, timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
+    return BANNED if response.json().get("ok") else CLEAN
+
+
+# service name -> (lookup, breaker); SpamWatch only with an API key
+SERVICES = {"cas": (__cas, CircuitBreaker(BREAKER_THRESHOLD, BREAKER_COOLDOWN))}
+if SPAMWATCH_API:
+    SERVICES["spamwatch"] = (__spamwatch,
+                             CircuitBreaker(BREAKER_THRESHOLD,
+                                            BREAKER_COOLDOWN))
+
+
+def __cached(service, user_id):
+    with VERDICTS_LOCK:
+        entry = VERDICTS.get((service, user_id))
+        if entry and entry[0] > time.monotonic():
+            VERDICTS.move_to_end((service, user_id))
+            return entry[1]
+        return None
+
+
+def __remember(service, user_id, verdict):
+    ttl = BANNED_TTL if verdict == BANNED else CLEAN_TTL
+    with VERDICTS_LOCK:
+        VERDICTS[(service, user_id)] = (time.monotonic() + ttl, verdict)
+        VERDICTS.move_to_end((service, user_id))
+        while len(VERDICTS) > VERDICT_CACHE_SIZE:
+            VERDICTS.popitem(last=False)
+
+
+def __lookup(service, user_id):
+    lookup, breaker = SERVICES[service]
+    try:
+        verdict = lookup(user_id)
+    except Exception as excp:
+        breaker.failed()
+        LOGGER.debug("%s lookup for %s failed: %s", service, user_id, excp)
+        return UNKNOWN
+    breaker.succeeded()
+    __remember(service, user_id, verdict)
+    return verdict
+
+
+def __submit(service, user_id):
+    # None while the service is tripped or too many lookups are waiting
+    breaker = SERVICES[service][1]
+    with PENDING_LOOKUPS_LOCK:
+        if PENDING_LOOKUPS[0] >= MAX_PENDING_LOOKUPS or not breaker.allow():
+            return None
+        PENDING_LOOKUPS[0] += 1
+    future = LOOKUP_EXECUTOR.submit(__lookup, service, user_id)
+    future.add_done_callback(lambda done: __lookup_done(breaker, done))
+    return future
+
+
+def __lookup_done(breaker, future):
+    with PENDING_LOOKUPS_LOCK:
+        PENDING_LOOKUPS[0] -= 1
+    if future.cancelled():
+        breaker.dropped()
+
+
+def __combine(verdicts):
+    if BANNED in verdicts:
+        return BANNED
+    if UNKNOWN in verdicts:
+        return UNKNOWN
+    return CLEAN
+
+
+def check_users(user_ids, timeout=LOOKUP_TIMEOUT) -> dict:
+    """Verdict for every user, BANNED if any service lists them. All the
+    lookups run concurrently; whatever isn't answered within timeout
+    seconds, belongs to a tripped service or finds MAX_PENDING_LOOKUPS
+    already waiting comes back UNKNOWN."""
+    results = {user_id: [] for user_id in user_ids}
+    pending = {}
+    for service in SERVICES:
+        for user_id in results:
+            verdict = __cached(service, user_id)
+            if verdict is not None:
+                REPUTATION_STATS["hits"] += 1
+                results[user_id].append(verdict)
+                continue
+            future = __submit(service, user_id)
+            if future is None:
+                results[user_id].append(UNKNOWN)
+                continue
+            REPUTATION_STATS["lookups"] += 1
+            pending[future] = user_id
+
+    if pending:
+        done, not_done = wait(pending, timeout=timeout)
+        for future in done:
+            results[pending[future]].append(future.result())
+        for future in not_done:
+            # queued lookups are dropped; running ones still finish and fill
+            # the cache for next time
+            future.cancel()
+            results[pending[future]].append(UNKNOWN)
+
+    verdicts = {
+        user_id: __combine(found) for user_id, found in results.items()
+    }
+    REPUTATION_STATS["unknown"] += sum(
+        1 for verdict in verdicts.values() if verdict == UNKNOWN)
+    return verdicts
+
+
+def is_flagged(user_id, timeout=LOOKUP_TIMEOUT) -> bool:
+    return check_users([user_id], timeout)[user_id] == BANNED
@@ -0,0 +1,205 @@
+import heapq
+import html
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from feedparser import parse
+from Megumi import LOGGER
+from Megumi.modules.helper_funcs.fanout import LimitedBot, fan_out
+from Megumi.modules.sql import rss_sql as sql
+from telegram import ParseMode, constants
+from telegram.ext import CallbackContext
+
+FETCH_WORKERS = 8
+# seconds between two polls of the same feed; doubled while it stays quiet
+MIN_INTERVAL = 60
+MAX_INTERVAL = 60 * 60
+# the engine wakes up every TICK_INTERVAL seconds and fetches at most
+# FEEDS_PER_TICK of the feeds that are due, the rest wait for the next tick
+TICK_INTERVAL = 10
+FEEDS_PER_TICK = 50
+
+FETCH_EXECUTOR = ThreadPoolExecutor(max_workers=FETCH_WORKERS)
+
+# feed_link -> (interval, next poll as a monotonic timestamp)
+FEED_SCHEDULE = {}
+# (next poll, feed_link); entries no longer matching FEED_SCHEDULE are stale
+FEED_QUEUE = []
+# feeds loaded on startup, caught up with without posting to the chats
+SILENT_FEEDS = set()
+FEED_SCHEDULE_LOCK = threading.Lock()
+
+ENGINE_STATS = {"ticks": 0, "fetches": 0, "fetch_time": 0.0, "backlog": 0}
+ENGINE_JOB = None
+
+
+def fetch_feed(link):
+    """Download a feed with the etag/last-modified of the previous fetch.
+    Returns None when the server reports it unchanged."""
+    etag, modified = sql.get_feed_headers(link)
+    feed = parse(link, etag=etag, modified=modified)
+    if feed.get("status") == 304:
+        return None
+    if feed.get("etag") or feed.get("modified"):
+        sql.set_feed_headers(link, feed.get("etag"), feed.get("modified"))
+    return feed
+
+
+def new_entries(feed, old_entry_link):
+    """Entries newer than old_entry_link, newest first."""
+    entries = []
+    for entry in feed.entries:
+        if entry.link == old_entry_link:
+            break
+        entries.append(entry)
+    return entries
+
+
+def send_entries(bot, tg_chat_id, entries):
+    # this loop sends every new update to the group, oldest first
+    for entry in reversed(entries[-5:]):
+        final_message = "<b>{}</b>\n\n{}".format(
+            html.escape(entry.title), html.escape(entry.link))
+
+        if len(final_message) <= constants.MAX_MESSAGE_LENGTH:
+            bot.send_message(
+                chat_id=tg_chat_id,
+                text=final_message,
+                parse_mode=ParseMode.HTML)
+        else:
+            bot.send_message(
+                chat_id=tg_chat_id,
+                text="<b>Warning:</b> The message is too long to be sent",
+                parse_mode=ParseMode.HTML)
+
+    if len(entries) > 5:
+        bot.send_message(
+            chat_id=tg_chat_id,
+            parse_mode=ParseMode.HTML,
+            text="<b>Warning: </b>{} occurrences have been left out to prevent spam"
+            .format(len(entries) - 5))
+
+
+def __schedule(link, interval, due):
+    FEED_SCHEDULE[link] = (interval, due)
+    heapq.heappush(FEED_QUEUE, (due, link))
+
+
+def register_feed(link):
+    """Poll link on the next tick; called when a chat subscribes to it."""
+    with FEED_SCHEDULE_LOCK:
+        SILENT_FEEDS.discard(link)
+        __schedule(link, MIN_INTERVAL, time.monotonic())
+
+
+def unregister_feed(link):
+    """Stop polling link once no chat is subscribed to it anymore."""
+    if sql.get_feed_subscribers(link):
+        return
+    with FEED_SCHEDULE_LOCK:
+        # its heap entry is stale now and gets skipped
+        FEED_SCHEDULE.pop(link, None)
+        SILENT_FEEDS.discard(link)
+
+
+def __pop_due(limit):
+    now = time.monotonic()
+    due = []
+    with FEED_SCHEDULE_LOCK:
+        while FEED_QUEUE and FEED_QUEUE[0][0] <= now:
+            when, link = heapq.heappop(FEED_QUEUE)
+            if FEED_SCHEDULE.get(link, (0, None))[1] != when:
+                continue
+            if len(due) == limit:
+                heapq.heappush(FEED_QUEUE, (when, link))
+                break
+            due.append(link)
+        backlog = sum(1 for when, link in FEED_QUEUE
+                      if when <= now and FEED_SCHEDULE.get(link,
+                                                           (0, None))[1] == when)
+    return due, backlog
+
+
+def __reschedule(link, changed):
+    with FEED_SCHEDULE_LOCK:
+        if link not in FEED_SCHEDULE:
+            return
+        interval = FEED_SCHEDULE[link][0]
+        interval = MIN_INTERVAL if changed else min(interval * 2, MAX_INTERVAL)
+        __schedule(link, interval, time.monotonic() + interval)
+
+
+def __fetch(link):
+    start = time.monotonic()
+    try:
+        return fetch_feed(link), time.monotonic() - start
+    except Exception:
+        LOGGER.exception("Could not fetch feed %s", link)
+        return None, time.monotonic() - start
+
+
+def __deliver(bot, feed, rows, silent):
+    # subscribers are grouped by the last entry they saw
+    by_old_entry = {}
+    for row in rows:
+        by_old_entry.setdefault(row.old_entry_link, []).append(row)
+
+    changed = False
+    for tg_old_entry_link, subscribers in by_old_entry.items():
+        entries = new_entries(feed, tg_old_entry_link)
+        if not entries:
+            continue
+
+        changed = True
+        sql.update_urls([row.id for row in subscribers], entries[0].link)
+        if not silent:
+            fan_out((row.chat_id for row in subscribers),
+                    lambda chat_id: send_entries(
+                        LimitedBot(bot), chat_id, entries))
+    return changed
+
+
+def rss_tick(context: CallbackContext):
+    due, backlog = __pop_due(FEEDS_PER_TICK)
+    for link, (feed, elapsed) in zip(due, FETCH_EXECUTOR.map(__fetch, due)):
+        ENGINE_STATS["fetches"] += 1
+        ENGINE_STATS["fetch_time"] += elapsed
+        silent = link in SILENT_FEEDS
+        SILENT_FEEDS.discard(link)
+
+        changed = False
+        if feed is not None:
+            try:
+                changed = __deliver(context.bot, feed,
+                                    sql.get_feed_subscribers(link), silent)
+            except Exception:
+                LOGGER.exception("Could not deliver feed %s", link)
+        __reschedule(link, changed)
+
+    ENGINE_STATS["ticks"] += 1
+    ENGINE_STATS["backlog"] = backlog
+
+
+def start_rss_engine(job_queue):
+    """Start the single job polling every subscribed feed; safe to call from
+    every module offering RSS commands. The subscriptions are read once here,
+    after that the commands keep the schedule up to date."""
+    global ENGINE_JOB
+    with FEED_SCHEDULE_LOCK:
+        if ENGINE_JOB is not None:
+            return
+        now = time.monotonic()
+        for link in sql.get_feed_links():
+            SILENT_FEEDS.add(link)
+            __schedule(link, MIN_INTERVAL, now)
+        ENGINE_JOB = job_queue.run_repeating(
+            rss_tick, interval=TICK_INTERVAL, first=5)
+
+
+def rss_stats() -> dict:
+    fetches = ENGINE_STATS["fetches"]
+    return dict(
+        feeds=len(FEED_SCHEDULE),
+        backlog=ENGINE_STATS["backlog"],
+        avg_fetch=ENGINE_STATS["fetch_time"] / fetches if fetches else 0.0)
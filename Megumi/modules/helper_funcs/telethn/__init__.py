@@ -1,7 +1,5 @@
-from Megumi import (DEV_USERS, SUDO_USERS, SUPPORT_USERS, TIGER_USERS,
-                          WHITELIST_USERS, telethn)
+from Megumi import telethn
+from Megumi.modules.helper_funcs.privileges import (DEV, SUDO, SUPPORT, TIGER,
+                                                    WHITELIST, RankView)
 
-IMMUNE_USERS = SUDO_USERS + WHITELIST_USERS + SUPPORT_USERS + TIGER_USERS + DEV_USERS
-
-IMMUNE_USERS = list(SUDO_USERS) + list(WHITELIST_USERS) + list(
-    SUPPORT_USERS) + list(TIGER_USERS) + list(DEV_USERS)
+IMMUNE_USERS = RankView(WHITELIST, TIGER, SUPPORT, SUDO, DEV)
@@ -1,52 +1,105 @@
+import asyncio
+import time
+
 from Megumi.modules.helper_funcs.telethn import IMMUNE_USERS, telethn
-from telethon.tl.types import ChannelParticipantsAdmins
+from telethon import events
+from telethon.tl.types import (ChannelParticipantsAdmins, PeerChannel,
+                               UpdateChannelParticipant)
+from telethon.utils import get_peer_id
+
+ADMIN_ROSTER_TTL = 5 * 60
+
+# chat_id -> (expires_at, frozenset of admin ids)
+ADMIN_ROSTERS = {}
+# chat_id -> the roster fetch in flight, awaited by every concurrent caller
+ROSTER_FETCHES = {}
+# chat_id -> bumped by every invalidation, so a roster fetched meanwhile isn't cached
+ROSTER_VERSIONS = {}
+# our own user, looked up once
+BOT_USER = []
+
+
+async def __fetch_admins(chat_id):
+    version = ROSTER_VERSIONS.get(chat_id, 0)
+    admins = frozenset([
+        user.id async for user in telethn.iter_participants(
+            chat_id, filter=ChannelParticipantsAdmins)
+    ])
+    if version == ROSTER_VERSIONS.get(chat_id, 0):
+        ADMIN_ROSTERS[chat_id] = (time.monotonic() + ADMIN_ROSTER_TTL, admins)
+    return admins
+
+
+def __fetch_done(chat_id, fetch):
+    # an invalidation may already have replaced it with a newer fetch
+    if ROSTER_FETCHES.get(chat_id) is fetch:
+        ROSTER_FETCHES.pop(chat_id, None)
+
+
+async def get_admin_ids(chat_id) -> frozenset:
+    entry = ADMIN_ROSTERS.get(chat_id)
+    if entry and entry[0] > time.monotonic():
+        return entry[1]
+
+    fetch = ROSTER_FETCHES.get(chat_id)
+    if fetch is None:
+        fetch = asyncio.ensure_future(__fetch_admins(chat_id))
+        ROSTER_FETCHES[chat_id] = fetch
+        fetch.add_done_callback(lambda done: __fetch_done(chat_id, done))
+    # a cancelled caller must not cancel the fetch the others wait on
+    return await asyncio.shield(fetch)
+
+
+def invalidate_admin_roster(chat_id):
+    ROSTER_VERSIONS[chat_id] = ROSTER_VERSIONS.get(chat_id, 0) + 1
+    ADMIN_ROSTERS.pop(chat_id, None)
+    # later callers start a fresh fetch instead of joining the stale one
+    ROSTER_FETCHES.pop(chat_id, None)
+
+
+async def get_bot_user():
+    if not BOT_USER:
+        BOT_USER.append(await telethn.get_me())
+    return BOT_USER[0]
+
+
+async def admin_changed(update):
+    invalidate_admin_roster(get_peer_id(PeerChannel(update.channel_id)))
+
+
+async def member_left(event):
+    if event.user_left or event.user_kicked:
+        invalidate_admin_roster(event.chat_id)
+
+
+telethn.add_event_handler(admin_changed, events.Raw(UpdateChannelParticipant))
+telethn.add_event_handler(member_left, events.ChatAction())
 
 
 async def user_is_ban_protected(user_id: int, message):
-    status = False
     if message.is_private or user_id in (IMMUNE_USERS):
         return True
 
-    async for user in telethn.iter_participants(
-            message.chat_id, filter=ChannelParticipantsAdmins):
-        if user_id == user.id:
-            status = True
-            break
-    return status
+    return user_id in await get_admin_ids(message.chat_id)
 
 
 async def user_is_admin(user_id: int, message):
-    status = False
-    if message.is_private:
+    if message.is_private or user_id in IMMUNE_USERS:
         return True
 
-    async for user in telethn.iter_participants(
-            message.chat_id, filter=ChannelParticipantsAdmins):
-        if user_id == user.id or user_id in IMMUNE_USERS:
-            status = True
-            break
-    return status
+    return user_id in await get_admin_ids(message.chat_id)
 
 
 async def is_user_admin(user_id: int, chat_id):
-    status = False
-    async for user in telethn.iter_participants(
-            chat_id, filter=ChannelParticipantsAdmins):
-        if user_id == user.id or user_id in IMMUNE_USERS:
-            status = True
-            break
-    return status
+    if user_id in IMMUNE_USERS:
+        return True
+
+    return user_id in await get_admin_ids(chat_id)
 
 
 async def haruka_is_admin(chat_id: int):
-    status = False
-    haruka = await telethn.get_me()
-    async for user in telethn.iter_participants(
-            chat_id, filter=ChannelParticipantsAdmins):
-        if haruka.id == user.id:
-            status = True
-            break
-    return status
+    haruka = await get_bot_user()
+    return haruka.id in await get_admin_ids(chat_id)
 
 
 async def is_user_in_chat(chat_id: int, user_id: int):
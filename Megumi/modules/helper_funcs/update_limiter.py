@@ -0,0 +1,109 @@
+import threading
+import time
+from collections import OrderedDict
+
+from Megumi import (UPDATE_CHAT_BURST, UPDATE_CHAT_RATE, UPDATE_USER_BURST,
+                    UPDATE_USER_RATE)
+from Megumi.modules.helper_funcs.fanout import TokenBucket
+
+# buckets untouched for this many seconds are full again and can go
+LIMITER_IDLE = 5 * 60
+LIMITER_SIZE = 50000
+
+# messages telegram generates itself; they always get through
+SERVICE_FIELDS = ("new_chat_members", "left_chat_member", "new_chat_title",
+                  "new_chat_photo", "delete_chat_photo", "group_chat_created",
+                  "supergroup_chat_created", "migrate_to_chat_id",
+                  "migrate_from_chat_id", "pinned_message")
+
+LIMITER_STATS = {
+    "passed": 0,
+    "priority": 0,
+    "limited_chat": 0,
+    "limited_user": 0,
+    "handled": 0,
+    "latency": 0.0,
+    "max_latency": 0.0
+}
+
+
+class BucketMap:
+    """One token bucket per key, evicting the least recently used ones."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __evict(self, now):
+        while self.buckets:
+            key, bucket = next(iter(self.buckets.items()))
+            if (len(self.buckets) <= LIMITER_SIZE and
+                    now - bucket.updated < LIMITER_IDLE):
+                break
+            del self.buckets[key]
+
+    def try_acquire(self, key) -> bool:
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = TokenBucket(self.rate, self.burst)
+            else:
+                self.buckets.move_to_end(key)
+            self.__evict(time.monotonic())
+        return bucket.try_acquire()
+
+    def __len__(self):
+        return len(self.buckets)
+
+
+CHAT_BUCKETS = BucketMap(UPDATE_CHAT_RATE, UPDATE_CHAT_BURST)
+USER_BUCKETS = BucketMap(UPDATE_USER_RATE, UPDATE_USER_BURST)
+
+
+def is_priority(update, command, is_admin) -> bool:
+    if update.my_chat_member or update.chat_member:
+        return True
+    message = update.effective_message
+    if message and any(getattr(message, field, None) for field in SERVICE_FIELDS):
+        return True
+    # is_admin must answer from memory, it runs for every command
+    return bool(command and update.effective_user and
+                is_admin(update.effective_chat, update.effective_user.id))
+
+
+def allow_update(update, command, is_admin) -> bool:
+    """Whether update is within its chat's and user's rate. Updates over it
+    only reach moderation handlers; service messages and admin commands are
+    never limited."""
+    if not update.effective_chat:
+        return True
+    if is_priority(update, command, is_admin):
+        LIMITER_STATS["priority"] += 1
+        return True
+    if not CHAT_BUCKETS.try_acquire(update.effective_chat.id):
+        LIMITER_STATS["limited_chat"] += 1
+        return False
+    if update.effective_user and not USER_BUCKETS.try_acquire(
+            update.effective_user.id):
+        LIMITER_STATS["limited_user"] += 1
+        return False
+    LIMITER_STATS["passed"] += 1
+    return True
+
+
+def record_latency(seconds):
+    LIMITER_STATS["handled"] += 1
+    LIMITER_STATS["latency"] += seconds
+    if seconds > LIMITER_STATS["max_latency"]:
+        LIMITER_STATS["max_latency"] = seconds
+
+
+def limiter_stats() -> dict:
+    handled = LIMITER_STATS["handled"]
+    return dict(
+        LIMITER_STATS,
+        chats=len(CHAT_BUCKETS),
+        users=len(USER_BUCKETS),
+        avg_latency=LIMITER_STATS["latency"] / handled if handled else 0.0)
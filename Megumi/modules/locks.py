@@ -23,6 +23,7 @@ from Megumi.modules.log_channel import loggable
 from Megumi.modules.connection import connected
 
 from Megumi.modules.helper_funcs.alternate import send_message, typing_action
+from Megumi.modules.helper_funcs.handlers import moderation_handler
 
 ad = AlphabetDetector()
 
@@ -415,37 +416,25 @@ def del_lockables(update, context):
     chat = update.effective_chat  # type: Optional[Chat]
     message = update.effective_message  # type: Optional[Message]
 
+    lock_mask = sql.get_lock_mask(chat.id)
+    if not lock_mask:
+        return
+
+    bot_can_delete = None
     for lockable, filter in LOCK_TYPES.items():
-        if lockable == "rtl":
-            if sql.is_locked(chat.id, lockable) and can_delete(
-                    chat, context.bot.id):
-                if message.caption:
-                    check = ad.detect_alphabet(u"{}".format(message.caption))
-                    if "ARABIC" in check:
-                        try:
-                            message.delete()
-                        except BadRequest as excp:
-                            if excp.message == "Message to delete not found":
-                                pass
-                            else:
-                                LOGGER.exception("ERROR in lockables")
-                        break
-                if message.text:
-                    check = ad.detect_alphabet(u"{}".format(message.text))
-                    if "ARABIC" in check:
-                        try:
-                            message.delete()
-                        except BadRequest as excp:
-                            if excp.message == "Message to delete not found":
-                                pass
-                            else:
-                                LOGGER.exception("ERROR in lockables")
-                        break
+        if not lock_mask & sql.LOCK_BITS[lockable]:
             continue
-        if lockable == "button":
-            if sql.is_locked(chat.id, lockable) and can_delete(
-                    chat, context.bot.id):
-                if message.reply_markup and message.reply_markup.inline_keyboard:
+        if lockable not in ("rtl", "button", "inline") and not filter(update):
+            continue
+        # only ask telegram once per message, and only when something matched
+        if bot_can_delete is None:
+            bot_can_delete = can_delete(chat, context.bot.id)
+        if not bot_can_delete:
+            return
+        if lockable == "rtl":
+            if message.caption:
+                check = ad.detect_alphabet(u"{}".format(message.caption))
+                if "ARABIC" in check:
                     try:
                         message.delete()
                     except BadRequest as excp:
@@ -454,11 +443,9 @@ def del_lockables(update, context):
                         else:
                             LOGGER.exception("ERROR in lockables")
                     break
-            continue
-        if lockable == "inline":
-            if sql.is_locked(chat.id, lockable) and can_delete(
-                    chat, context.bot.id):
-                if message and message.via_bot:
+            if message.text:
+                check = ad.detect_alphabet(u"{}".format(message.text))
+                if "ARABIC" in check:
                     try:
                         message.delete()
                     except BadRequest as excp:
@@ -468,27 +455,19 @@ def del_lockables(update, context):
                             LOGGER.exception("ERROR in lockables")
                     break
             continue
-        if (filter(update) and sql.is_locked(chat.id, lockable) and
-                can_delete(chat, context.bot.id)):
-            if lockable == "bots":
-                new_members = update.effective_message.new_chat_members
-                for new_mem in new_members:
-                    if new_mem.is_bot:
-                        if not is_bot_admin(chat, context.bot.id):
-                            send_message(
-                                update.effective_message,
-                                "I see a bot and I've been told to stop them from joining..."
-                                "but I'm not admin!",
-                            )
-                            return
-
-                        chat.kick_member(new_mem.id)
-                        send_message(
-                            update.effective_message,
-                            "Only admins are allowed to add bots in this chat! Get outta here.",
-                        )
-                        break
-            else:
+        if lockable == "button":
+            if message.reply_markup and message.reply_markup.inline_keyboard:
+                try:
+                    message.delete()
+                except BadRequest as excp:
+                    if excp.message == "Message to delete not found":
+                        pass
+                    else:
+                        LOGGER.exception("ERROR in lockables")
+                break
+            continue
+        if lockable == "inline":
+            if message and message.via_bot:
                 try:
                     message.delete()
                 except BadRequest as excp:
@@ -496,8 +475,36 @@ def del_lockables(update, context):
                         pass
                     else:
                         LOGGER.exception("ERROR in lockables")
-
                 break
+            continue
+        if lockable == "bots":
+            new_members = update.effective_message.new_chat_members
+            for new_mem in new_members:
+                if new_mem.is_bot:
+                    if not is_bot_admin(chat, context.bot.id):
+                        send_message(
+                            update.effective_message,
+                            "I see a bot and I've been told to stop them from joining..."
+                            "but I'm not admin!",
+                        )
+                        return
+
+                    chat.kick_member(new_mem.id)
+                    send_message(
+                        update.effective_message,
+                        "Only admins are allowed to add bots in this chat! Get outta here.",
+                    )
+                    break
+        else:
+            try:
+                message.delete()
+            except BadRequest as excp:
+                if excp.message == "Message to delete not found":
+                    pass
+                else:
+                    LOGGER.exception("ERROR in lockables")
+
+            break
 
 
 def build_lock_message(chat_id):
@@ -653,4 +660,6 @@ dispatcher.add_handler(LOCKTYPES_HANDLER)
 dispatcher.add_handler(LOCKED_HANDLER)
 
 dispatcher.add_handler(
-    MessageHandler(Filters.all & Filters.group, del_lockables), PERM_GROUP)
+    moderation_handler(
+        MessageHandler(Filters.all & Filters.group, del_lockables)),
+    PERM_GROUP)
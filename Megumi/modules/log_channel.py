@@ -8,8 +8,13 @@ from Megumi.modules.helper_funcs.misc import is_module_loaded
 FILENAME = __name__.rsplit(".", 1)[-1]
 
 if is_module_loaded(FILENAME):
+    import queue
+    import threading
+    import time
+
     from telegram import ParseMode, Update
-    from telegram.error import BadRequest, Unauthorized
+    from telegram.constants import MAX_MESSAGE_LENGTH
+    from telegram.error import BadRequest, RetryAfter, TelegramError, Unauthorized
     from telegram.ext import CommandHandler, JobQueue, run_async
     from telegram.utils.helpers import escape_markdown
 
@@ -67,29 +72,108 @@ if is_module_loaded(FILENAME):
 
         return glog_action
 
+    # events for the same log channel arriving within LOG_BATCH_WINDOW seconds
+    # of the first one are sent together as one message
+    LOG_BATCH_WINDOW = 2
+    # events waiting for the sender; anything beyond that is dropped
+    LOG_BACKLOG = 1000
+    LOG_RETRIES = 3
+    FORMATTING_NOTE = "\n\nFormatting has been disabled due to an unexpected error."
+
+    LOG_QUEUE = queue.Queue(maxsize=LOG_BACKLOG)
+    LOG_STATS = {"sent": 0, "dropped": 0}
+    LOG_SENDER = []
+    LOG_SENDER_LOCK = threading.Lock()
+
     def send_log(context: CallbackContext, log_chat_id: str, orig_chat_id: str,result: str):
-        bot = context.bot
+        with LOG_SENDER_LOCK:
+            if not LOG_SENDER:
+                sender = threading.Thread(
+                    target=log_sender, args=(context.bot,), daemon=True)
+                sender.start()
+                LOG_SENDER.append(sender)
         try:
-            bot.send_message(
-                log_chat_id,
-                result,
-                parse_mode=ParseMode.HTML,
-                disable_web_page_preview=True)
-        except BadRequest as excp:
-            if excp.message == "Chat not found":
-                bot.send_message(
-                    orig_chat_id,
-                    "This log channel has been deleted - unsetting.")
-                sql.stop_chat_logging(orig_chat_id)
-            else:
+            LOG_QUEUE.put_nowait((str(log_chat_id), orig_chat_id, result))
+        except queue.Full:
+            LOG_STATS["dropped"] += 1
+            LOGGER.warning("Log backlog full, dropped an event for %s",
+                           log_chat_id)
+
+    def log_sender(bot):
+        while True:
+            batches = {}
+            log_chat_id, orig_chat_id, result = LOG_QUEUE.get()
+            deadline = time.monotonic() + LOG_BATCH_WINDOW
+            while True:
+                batches.setdefault(log_chat_id, []).append(
+                    (orig_chat_id, result))
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    log_chat_id, orig_chat_id, result = LOG_QUEUE.get(
+                        timeout=timeout)
+                except queue.Empty:
+                    break
+
+            for log_chat_id, events in batches.items():
+                try:
+                    flush_logs(bot, log_chat_id, events)
+                except Exception:
+                    LOGGER.exception("Could not send logs to %s", log_chat_id)
+
+    def __send(bot, chat_id, text, **kwargs):
+        for attempt in range(LOG_RETRIES + 1):
+            try:
+                return bot.send_message(chat_id, text, **kwargs)
+            except RetryAfter as excp:
+                if attempt == LOG_RETRIES:
+                    raise
+                time.sleep(excp.retry_after)
+
+    def __chunks(events):
+        # pack events into messages, leaving room for the formatting note
+        limit = MAX_MESSAGE_LENGTH - len(FORMATTING_NOTE)
+        chunk = []
+        size = 0
+        for orig_chat_id, result in events:
+            if chunk and size + 2 + len(result) > limit:
+                yield chunk
+                chunk = []
+                size = 0
+            size += len(result) + (2 if chunk else 0)
+            chunk.append((orig_chat_id, result))
+        if chunk:
+            yield chunk
+
+    def flush_logs(bot, log_chat_id: str, events):
+        for chunk in __chunks(events):
+            text = "\n\n".join(result for _, result in chunk)
+            try:
+                __send(
+                    bot,
+                    log_chat_id,
+                    text,
+                    parse_mode=ParseMode.HTML,
+                    disable_web_page_preview=True)
+            except BadRequest as excp:
+                if excp.message == "Chat not found":
+                    for orig_chat_id in dict.fromkeys(
+                            orig_chat_id for orig_chat_id, _ in events):
+                        sql.stop_chat_logging(orig_chat_id)
+                        try:
+                            bot.send_message(
+                                orig_chat_id,
+                                "This log channel has been deleted - unsetting.")
+                        except TelegramError:
+                            pass
+                    return
                 LOGGER.warning(excp.message)
-                LOGGER.warning(result)
+                LOGGER.warning(text)
                 LOGGER.exception("Could not parse")
 
-                bot.send_message(
-                    log_chat_id, result +
-                    "\n\nFormatting has been disabled due to an unexpected error."
-                )
+                __send(bot, log_chat_id, text + FORMATTING_NOTE)
+            LOG_STATS["sent"] += len(chunk)
 
     @run_async
     @user_admin
@@ -168,7 +252,9 @@ if is_module_loaded(FILENAME):
             message.reply_text("No log channel has been set yet!")
 
     def __stats__():
-        return f"{sql.num_logchannels()} log channels set."
+        return (f"{sql.num_logchannels()} log channels set, "
+                f"{LOG_QUEUE.qsize()} log events queued, "
+                f"{LOG_STATS['dropped']} dropped.")
 
     def __migrate__(old_chat_id, new_chat_id):
         sql.migrate_chat(old_chat_id, new_chat_id)
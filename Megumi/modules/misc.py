@@ -26,6 +26,9 @@ from telegram.error import BadRequest
 from emoji import UNICODE_EMOJI
 from googletrans import LANGUAGES, Translator
 from Megumi.modules.helper_funcs.alternate import typing_action
+from Megumi.modules.helper_funcs.rss_engine import (register_feed, start_rss_engine,
+                                                   unregister_feed)
+from Megumi.modules.helper_funcs.update_limiter import limiter_stats
 from Megumi.modules.sql import rss_sql as sql
 from Megumi.modules.sql import afk_sql as asql
 from Megumi.modules.sql import users_sql as usql
@@ -467,6 +470,7 @@ def add_url(update: Update, context: CallbackContext):
                     "This URL has already been added")
             else:
                 sql.add_url(tg_chat_id, tg_feed_link, tg_old_entry_link)
+                register_feed(tg_feed_link)
 
                 update.effective_message.reply_text("Added URL to subscription")
         else:
@@ -492,6 +496,7 @@ def remove_url(update: Update, context: CallbackContext):
 
             if user_data:
                 sql.remove_url(tg_chat_id, tg_feed_link)
+                unregister_feed(tg_feed_link)
 
                 update.effective_message.reply_text(
                     "Removed URL from subscription")
@@ -505,109 +510,6 @@ def remove_url(update: Update, context: CallbackContext):
         update.effective_message.reply_text("URL missing")
 
 
-def rss_update(context: CallbackContext):
-    user_data = sql.get_all()
-    job = context.job
-    bot = context.bot
-    # this loop checks for every row in the DB
-    for row in user_data:
-        row_id = row.id
-        tg_chat_id = row.chat_id
-        tg_feed_link = row.feed_link
-
-        feed_processed = parse(tg_feed_link)
-
-        tg_old_entry_link = row.old_entry_link
-
-        new_entry_links = []
-        new_entry_titles = []
-
-        # this loop checks for every entry from the RSS Feed link from the DB row
-        for entry in feed_processed.entries:
-            # check if there are any new updates to the RSS Feed from the old entry
-            if entry.link != tg_old_entry_link:
-                new_entry_links.append(entry.link)
-                new_entry_titles.append(entry.title)
-            else:
-                break
-
-        # check if there's any new entries queued from the last check
-        if new_entry_links:
-            sql.update_url(row_id, new_entry_links)
-        else:
-            pass
-
-        if len(new_entry_links) < 5:
-            # this loop sends every new update to each user from each group based on the DB entries
-            for link, title in zip(
-                    reversed(new_entry_links), reversed(new_entry_titles)):
-                final_message = "<b>{}</b>\n\n{}".format(
-                    html.escape(title), html.escape(link))
-
-                if len(final_message) <= constants.MAX_MESSAGE_LENGTH:
-                    bot.send_message(
-                        chat_id=tg_chat_id,
-                        text=final_message,
-                        parse_mode=ParseMode.HTML)
-                else:
-                    bot.send_message(
-                        chat_id=tg_chat_id,
-                        text="<b>Warning:</b> The message is too long to be sent",
-                        parse_mode=ParseMode.HTML)
-        else:
-            for link, title in zip(
-                    reversed(new_entry_links[-5:]),
-                    reversed(new_entry_titles[-5:])):
-                final_message = "<b>{}</b>\n\n{}".format(
-                    html.escape(title), html.escape(link))
-
-                if len(final_message) <= constants.MAX_MESSAGE_LENGTH:
-                    bot.send_message(
-                        chat_id=tg_chat_id,
-                        text=final_message,
-                        parse_mode=ParseMode.HTML)
-                else:
-                    bot.send_message(
-                        chat_id=tg_chat_id,
-                        text="<b>Warning:</b> The message is too long to be sent",
-                        parse_mode=ParseMode.HTML)
-
-            bot.send_message(
-                chat_id=tg_chat_id,
-                parse_mode=ParseMode.HTML,
-                text="<b>Warning: </b>{} occurrences have been left out to prevent spam"
-                .format(len(new_entry_links) - 5))
-
-
-def rss_set(context: CallbackContext):
-    user_data = sql.get_all()
-    bot, job = context.bot, context.job
-    # this loop checks for every row in the DB
-    for row in user_data:
-        row_id = row.id
-        tg_feed_link = row.feed_link
-        tg_old_entry_link = row.old_entry_link
-
-        feed_processed = parse(tg_feed_link)
-
-        new_entry_links = []
-        new_entry_titles = []
-
-        # this loop checks for every entry from the RSS Feed link from the DB row
-        for entry in feed_processed.entries:
-            # check if there are any new updates to the RSS Feed from the old entry
-            if entry.link != tg_old_entry_link:
-                new_entry_links.append(entry.link)
-                new_entry_titles.append(entry.title)
-            else:
-                break
-
-        # check if there's any new entries queued from the last check
-        if new_entry_links:
-            sql.update_url(row_id, new_entry_links)
-        else:
-            pass
-
 @run_async
 def wiki(update: Update, context: CallbackContext):
     msg = update.effective_message.reply_to_message if update.effective_message.reply_to_message else update.effective_message
@@ -898,6 +800,16 @@ def stats(update: Update, context: CallbackContext):
     result = re.sub(r'(\d+)', r'<code>\1</code>', stats)
     update.effective_message.reply_text(result, parse_mode=ParseMode.HTML)
 
+
+def __stats__():
+    stats = limiter_stats()
+    return ("• {} updates limited to moderation by the chat limit and {} by the user limit, {} let through as priority "
+            "({} chats, {} users tracked).\n"
+            "• Updates handled in {:.0f}ms on average, {:.0f}ms at most.").format(
+                stats["limited_chat"], stats["limited_user"], stats["priority"],
+                stats["chats"], stats["users"], stats["avg_latency"] * 1000,
+                stats["max_latency"] * 1000)
+
 __help__ = """
  • `/id`*:* get the current group id. If used by replying to a message, gets that user's id.
  • `/gifid`*:* reply to a gif to me to tell you its file ID.
@@ -926,12 +838,7 @@ __help__ = """
 *NOTE:* In groups, only admins can add/remove RSS links to the group's subscription
 
 """
-job = updater.job_queue
-
-job_rss_set = job.run_once(rss_set, 5)
-job_rss_update = job.run_repeating(rss_update, interval=60, first=60)
-job_rss_set.enabled = True
-job_rss_update.enabled = True
+start_rss_engine(updater.job_queue)
 
 SHOW_URL_HANDLER = CommandHandler("rss", show_url)
 ADD_URL_HANDLER = CommandHandler("addrss", add_url)
@@ -962,7 +869,7 @@ SNIPE_HANDLER = CommandHandler(
 STATS_HANDLER = CommandHandler(
     "stats",
     stats,
-    filters=Filters.user(SUDO_USERS))
+    filters=CustomFilters.sudo_filter)
 
 
 dispatcher.add_handler(SNIPE_HANDLER)
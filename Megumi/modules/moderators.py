@@ -1,6 +1,4 @@
 import html
-import json
-import os
 from typing import Optional
 
 from Megumi import (DEV_USERS, OWNER_ID, SUDO_USERS, SUPPORT_CHAT,
@@ -9,13 +7,14 @@ from Megumi import (DEV_USERS, OWNER_ID, SUDO_USERS, SUPPORT_CHAT,
 from Megumi.modules.helper_funcs.chat_status import (dev_plus, sudo_plus,
                                                            whitelist_plus)
 from Megumi.modules.helper_funcs.extraction import extract_user
+from Megumi.modules.helper_funcs.privileges import (SUDO, SUPPORT, TIGER,
+                                                    WHITELIST, reload_ranks,
+                                                    remove_rank, set_rank)
 from Megumi.modules.log_channel import gloggable
 from telegram import ParseMode, TelegramError, Update
 from telegram.ext import CallbackContext, CommandHandler, run_async
 from telegram.utils.helpers import mention_html
 
-ELEVATED_USERS_FILE = os.path.join(os.getcwd(),
-                                   'Megumi/elevated_users.json')
 
 # do not async, not a handler
 def send_disasters(update):
@@ -40,28 +39,17 @@ def addsudo(update: Update, context: CallbackContext) -> str:
         message.reply_text(reply)
         return ""
 
-    with open(ELEVATED_USERS_FILE, 'r') as infile:
-        data = json.load(infile)
-
     if user_id in SUDO_USERS:
         message.reply_text("This member is already a Dragon Disaster")
         return ""
 
     if user_id in SUPPORT_USERS:
         rt += "Requested HA to promote a Demon Disaster to Dragon."
-        data['supports'].remove(user_id)
-        SUPPORT_USERS.remove(user_id)
 
     if user_id in WHITELIST_USERS:
         rt += "Requested HA to promote a Wolf Disaster to Dragon."
-        data['whitelists'].remove(user_id)
-        WHITELIST_USERS.remove(user_id)
-
-    data['sudos'].append(user_id)
-    SUDO_USERS.append(user_id)
 
-    with open(ELEVATED_USERS_FILE, 'w') as outfile:
-        json.dump(data, outfile, indent=4)
+    set_rank(user_id, SUDO)
 
     update.effective_message.reply_text(
         rt + "\nSuccessfully set Disaster level of {} to Dragon!".format(
@@ -98,13 +86,8 @@ def addsupport(
         message.reply_text(reply)
         return ""
 
-    with open(ELEVATED_USERS_FILE, 'r') as infile:
-        data = json.load(infile)
-
     if user_id in SUDO_USERS:
         rt += "Requested HA to deomote this Dragon to Demon"
-        data['sudos'].remove(user_id)
-        SUDO_USERS.remove(user_id)
 
     if user_id in SUPPORT_USERS:
         message.reply_text("This user is already a Demon Disaster.")
@@ -112,14 +95,8 @@ def addsupport(
 
     if user_id in WHITELIST_USERS:
         rt += "Requested HA to promote this Wolf Disaster to Demon"
-        data['whitelists'].remove(user_id)
-        WHITELIST_USERS.remove(user_id)
 
-    data['supports'].append(user_id)
-    SUPPORT_USERS.append(user_id)
-
-    with open(ELEVATED_USERS_FILE, 'w') as outfile:
-        json.dump(data, outfile, indent=4)
+    set_rank(user_id, SUPPORT)
 
     update.effective_message.reply_text(
         rt + f"\n{user_member.first_name} was added as a Demon Disaster!")
@@ -152,28 +129,17 @@ def addwhitelist(update: Update, context: CallbackContext) -> str:
         message.reply_text(reply)
         return ""
 
-    with open(ELEVATED_USERS_FILE, 'r') as infile:
-        data = json.load(infile)
-
     if user_id in SUDO_USERS:
         rt += "This member is a Dragon Disaster, Demoting to Wolf."
-        data['sudos'].remove(user_id)
-        SUDO_USERS.remove(user_id)
 
     if user_id in SUPPORT_USERS:
         rt += "This user is already a Demon Disaster, Demoting to Wolf."
-        data['supports'].remove(user_id)
-        SUPPORT_USERS.remove(user_id)
 
     if user_id in WHITELIST_USERS:
         message.reply_text("This user is already a Wolf Disaster.")
         return ""
 
-    data['whitelists'].append(user_id)
-    WHITELIST_USERS.append(user_id)
-
-    with open(ELEVATED_USERS_FILE, 'w') as outfile:
-        json.dump(data, outfile, indent=4)
+    set_rank(user_id, WHITELIST)
 
     update.effective_message.reply_text(
         rt +
@@ -207,33 +173,20 @@ def addtiger(update: Update, context: CallbackContext) -> str:
         message.reply_text(reply)
         return ""
 
-    with open(ELEVATED_USERS_FILE, 'r') as infile:
-        data = json.load(infile)
-
     if user_id in SUDO_USERS:
         rt += "This member is a Dragon Disaster, Demoting to Tiger."
-        data['sudos'].remove(user_id)
-        SUDO_USERS.remove(user_id)
 
     if user_id in SUPPORT_USERS:
         rt += "This user is already a Demon Disaster, Demoting to Tiger."
-        data['supports'].remove(user_id)
-        SUPPORT_USERS.remove(user_id)
 
     if user_id in WHITELIST_USERS:
         rt += "This user is already a Wolf Disaster, Demoting to Tiger."
-        data['whitelists'].remove(user_id)
-        WHITELIST_USERS.remove(user_id)
 
     if user_id in TIGER_USERS:
         message.reply_text("This user is already a Tiger.")
         return ""
 
-    data['tigers'].append(user_id)
-    TIGER_USERS.append(user_id)
-
-    with open(ELEVATED_USERS_FILE, 'w') as outfile:
-        json.dump(data, outfile, indent=4)
+    set_rank(user_id, TIGER)
 
     update.effective_message.reply_text(
         rt +
@@ -267,16 +220,13 @@ def removesudo(update: Update, context: CallbackContext) -> str:
         message.reply_text(reply)
         return ""
 
-    with open(ELEVATED_USERS_FILE, 'r') as infile:
-        data = json.load(infile)
-
     if user_id in SUDO_USERS:
+        if not remove_rank(user_id):
+            message.reply_text(
+                "This user's rank is set in the config, it can't be removed here."
+            )
+            return ""
         message.reply_text("Requested HA to demote this user to Civilian")
-        SUDO_USERS.remove(user_id)
-        data['sudos'].remove(user_id)
-
-        with open(ELEVATED_USERS_FILE, 'w') as outfile:
-            json.dump(data, outfile, indent=4)
 
         log_message = (
             f"#UNSUDO\n"
@@ -311,16 +261,13 @@ def removesupport(update: Update, context: CallbackContext) -> str:
         message.reply_text(reply)
         return ""
 
-    with open(ELEVATED_USERS_FILE, 'r') as infile:
-        data = json.load(infile)
-
     if user_id in SUPPORT_USERS:
+        if not remove_rank(user_id):
+            message.reply_text(
+                "This user's rank is set in the config, it can't be removed here."
+            )
+            return ""
         message.reply_text("Requested HA to demote this user to Civilian")
-        SUPPORT_USERS.remove(user_id)
-        data['supports'].remove(user_id)
-
-        with open(ELEVATED_USERS_FILE, 'w') as outfile:
-            json.dump(data, outfile, indent=4)
 
         log_message = (
             f"#UNSUPPORT\n"
@@ -354,16 +301,13 @@ def removewhitelist(update: Update, context: CallbackContext) -> str:
         message.reply_text(reply)
         return ""
 
-    with open(ELEVATED_USERS_FILE, 'r') as infile:
-        data = json.load(infile)
-
     if user_id in WHITELIST_USERS:
+        if not remove_rank(user_id):
+            message.reply_text(
+                "This user's rank is set in the config, it can't be removed here."
+            )
+            return ""
         message.reply_text("Demoting to normal user")
-        WHITELIST_USERS.remove(user_id)
-        data['whitelists'].remove(user_id)
-
-        with open(ELEVATED_USERS_FILE, 'w') as outfile:
-            json.dump(data, outfile, indent=4)
 
         log_message = (
             f"#UNWHITELIST\n"
@@ -396,16 +340,13 @@ def removetiger(update: Update, context: CallbackContext) -> str:
         message.reply_text(reply)
         return ""
 
-    with open(ELEVATED_USERS_FILE, 'r') as infile:
-        data = json.load(infile)
-
     if user_id in TIGER_USERS:
+        if not remove_rank(user_id):
+            message.reply_text(
+                "This user's rank is set in the config, it can't be removed here."
+            )
+            return ""
         message.reply_text("Demoting to normal user")
-        TIGER_USERS.remove(user_id)
-        data['tigers'].remove(user_id)
-
-        with open(ELEVATED_USERS_FILE, 'w') as outfile:
-            json.dump(data, outfile, indent=4)
 
         log_message = (
             f"#UNTIGER\n"
@@ -422,6 +363,14 @@ def removetiger(update: Update, context: CallbackContext) -> str:
         return ""
 
 
+@run_async
+@dev_plus
+def reloaddisasters(update: Update, context: CallbackContext):
+    reload_ranks()
+    update.effective_message.reply_text(
+        "Reloaded the Disaster levels from elevated_users.json.")
+
+
 @run_async
 @whitelist_plus
 def whitelistlist(update: Update, context: CallbackContext):
@@ -516,6 +465,7 @@ TIGERLIST_HANDLER = CommandHandler(["tigers"], tigerlist)
 SUPPORTLIST_HANDLER = CommandHandler(["supportlist", "demons"], supportlist)
 SUDOLIST_HANDLER = CommandHandler(["sudolist", "dragons"], sudolist)
 DEVLIST_HANDLER = CommandHandler(["devlist", "heroes"], devlist)
+RELOAD_HANDLER = CommandHandler("reloaddisasters", reloaddisasters)
 
 dispatcher.add_handler(SUDO_HANDLER)
 dispatcher.add_handler(SUPPORT_HANDLER)
@@ -531,11 +481,12 @@ dispatcher.add_handler(TIGERLIST_HANDLER)
 dispatcher.add_handler(SUPPORTLIST_HANDLER)
 dispatcher.add_handler(SUDOLIST_HANDLER)
 dispatcher.add_handler(DEVLIST_HANDLER)
+dispatcher.add_handler(RELOAD_HANDLER)
 
 __mod_name__ = "Moderators"
 __handlers__ = [
     SUDO_HANDLER, SUPPORT_HANDLER, TIGER_HANDLER, WHITELIST_HANDLER,
     UNSUDO_HANDLER, UNSUPPORT_HANDLER, UNTIGER_HANDLER, UNWHITELIST_HANDLER,
     WHITELISTLIST_HANDLER, TIGERLIST_HANDLER, SUPPORTLIST_HANDLER,
-    SUDOLIST_HANDLER, DEVLIST_HANDLER
+    SUDOLIST_HANDLER, DEVLIST_HANDLER, RELOAD_HANDLER
 ]
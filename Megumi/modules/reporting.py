@@ -1,9 +1,10 @@
 import html
 
-from Megumi import (LOGGER, SUDO_USERS, TIGER_USERS, WHITELIST_USERS,
-                          dispatcher)
+from Megumi import LOGGER, dispatcher
 from Megumi.modules.helper_funcs.chat_status import (user_admin,
                                                            user_not_admin)
+from Megumi.modules.helper_funcs.privileges import (DEV, SUDO, TIGER,
+                                                    WHITELIST, RankView)
 from Megumi.modules.log_channel import loggable
 from Megumi.modules.sql import reporting_sql as sql
 from telegram import (Chat, InlineKeyboardButton, InlineKeyboardMarkup,
@@ -14,7 +15,7 @@ from telegram.ext import (CallbackContext, CallbackQueryHandler, CommandHandler,
 from telegram.utils.helpers import mention_html
 
 REPORT_GROUP = 12
-REPORT_IMMUNE_USERS = SUDO_USERS + TIGER_USERS + WHITELIST_USERS
+REPORT_IMMUNE_USERS = RankView(WHITELIST, TIGER, SUDO, DEV)
 
 
 @run_async
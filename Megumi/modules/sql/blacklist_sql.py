@@ -1,5 +1,6 @@
 import threading
 
+from Megumi.modules.helper_funcs.regex_helper import compile_triggers
 from Megumi.modules.sql import BASE, SESSION
 from sqlalchemy import Column, String, UnicodeText, distinct, func
 
@@ -27,6 +28,8 @@ BlackListFilters.__table__.create(checkfirst=True)
 BLACKLIST_FILTER_INSERTION_LOCK = threading.RLock()
 
 CHAT_BLACKLISTS = {}
+# chat_id -> compiled trigger patterns; dropped whenever CHAT_BLACKLISTS changes
+CHAT_BLACKLIST_PATTERNS = {}
 
 
 def add_to_blacklist(chat_id, trigger):
@@ -36,6 +39,7 @@ def add_to_blacklist(chat_id, trigger):
         SESSION.merge(blacklist_filt)  # merge to avoid duplicate key issues
         SESSION.commit()
         CHAT_BLACKLISTS.setdefault(str(chat_id), set()).add(trigger)
+        CHAT_BLACKLIST_PATTERNS.pop(str(chat_id), None)
 
 
 def rm_from_blacklist(chat_id, trigger):
@@ -46,6 +50,7 @@ def rm_from_blacklist(chat_id, trigger):
             if trigger in CHAT_BLACKLISTS.get(str(chat_id),
                                               set()):  # sanity check
                 CHAT_BLACKLISTS.get(str(chat_id), set()).remove(trigger)
+                CHAT_BLACKLIST_PATTERNS.pop(str(chat_id), None)
 
             SESSION.delete(blacklist_filt)
             SESSION.commit()
@@ -59,6 +64,18 @@ def get_chat_blacklist(chat_id):
     return CHAT_BLACKLISTS.get(str(chat_id), set())
 
 
+def get_chat_blacklist_patterns(chat_id):
+    patterns = CHAT_BLACKLIST_PATTERNS.get(str(chat_id))
+    if patterns is None:
+        with BLACKLIST_FILTER_INSERTION_LOCK:
+            patterns = compile_triggers(
+                sorted(CHAT_BLACKLISTS.get(str(chat_id), set())),
+                prefix=r"( |^|[^\w])",
+                suffix=r"( |$|[^\w])")
+            CHAT_BLACKLIST_PATTERNS[str(chat_id)] = patterns
+    return patterns
+
+
 def num_blacklist_filters():
     try:
         return SESSION.query(BlackListFilters).count()
@@ -106,6 +123,10 @@ def migrate_chat(old_chat_id, new_chat_id):
         for filt in chat_filters:
             filt.chat_id = str(new_chat_id)
         SESSION.commit()
+        CHAT_BLACKLISTS[str(new_chat_id)] = CHAT_BLACKLISTS.pop(
+            str(old_chat_id), set())
+        CHAT_BLACKLIST_PATTERNS.pop(str(old_chat_id), None)
+        CHAT_BLACKLIST_PATTERNS.pop(str(new_chat_id), None)
 
 
 __load_chat_blacklists()
@@ -0,0 +1,82 @@
+import threading
+
+from Megumi.modules.sql import BASE, SESSION
+from sqlalchemy import Boolean, Column, Integer, String, UnicodeText
+
+
+class Broadcast(BASE):
+    __tablename__ = "broadcasts"
+    id = Column(Integer, primary_key=True)
+    text = Column(UnicodeText, nullable=False)
+    to_groups = Column(Boolean, nullable=False)
+    to_users = Column(Boolean, nullable=False)
+    # chat to report to once the broadcast is done
+    origin_chat_id = Column(String(14), nullable=False)
+    # "chats", then "users", then "done"
+    stage = Column(String(5), nullable=False)
+    # last chat / user id of the stage sent to, None before the first batch
+    cursor = Column(UnicodeText)
+    sent = Column(Integer, default=0, nullable=False)
+    failed = Column(Integer, default=0, nullable=False)
+    pruned = Column(Integer, default=0, nullable=False)
+
+    def __init__(self, text, to_groups, to_users, origin_chat_id):
+        self.text = text
+        self.to_groups = to_groups
+        self.to_users = to_users
+        self.origin_chat_id = str(origin_chat_id)
+        self.stage = "chats" if to_groups else "users"
+        self.cursor = None
+        self.sent = 0
+        self.failed = 0
+        self.pruned = 0
+
+    def __repr__(self):
+        return "<Broadcast {} at {} {} ({} sent)>".format(
+            self.id, self.stage, self.cursor, self.sent)
+
+
+Broadcast.__table__.create(checkfirst=True)
+
+BROADCAST_LOCK = threading.RLock()
+
+
+def new_broadcast(text, to_groups, to_users, origin_chat_id):
+    with BROADCAST_LOCK:
+        broadcast = Broadcast(text, to_groups, to_users, origin_chat_id)
+        SESSION.add(broadcast)
+        SESSION.commit()
+        broadcast_id = broadcast.id
+        SESSION.close()
+        return broadcast_id
+
+
+def get_broadcast(broadcast_id):
+    try:
+        return SESSION.query(Broadcast).get(broadcast_id)
+    finally:
+        SESSION.close()
+
+
+def get_unfinished_broadcasts():
+    try:
+        return [
+            x.id for x in SESSION.query(Broadcast.id).filter(
+                Broadcast.stage != "done").order_by(Broadcast.id).all()
+        ]
+    finally:
+        SESSION.close()
+
+
+def save_progress(broadcast_id, stage, cursor, sent, failed, pruned):
+    with BROADCAST_LOCK:
+        broadcast = SESSION.query(Broadcast).get(broadcast_id)
+        if broadcast:
+            broadcast.stage = stage
+            broadcast.cursor = cursor
+            broadcast.sent += sent
+            broadcast.failed += failed
+            broadcast.pruned += pruned
+            SESSION.commit()
+        else:
+            SESSION.close()
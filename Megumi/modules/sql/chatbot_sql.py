@@ -20,16 +20,12 @@ ChatbotChats.__table__.create(checkfirst=True)
 
 INSERTION_LOCK = threading.RLock()
 
+# chat_id -> (ses_id, expires) for every AI-enabled chat
+CHATBOT_SESSIONS = {}
+
 
 def is_chat(chat_id):
-    try:
-        chat = SESSION.query(ChatbotChats).get(str(chat_id))
-        if chat:
-            return True
-        else:
-            return False
-    finally:
-        SESSION.close()
+    return str(chat_id) in CHATBOT_SESSIONS
 
 
 def set_ses(chat_id, ses_id, expires):
@@ -43,18 +39,11 @@ def set_ses(chat_id, ses_id, expires):
 
         SESSION.add(autochat)
         SESSION.commit()
+        CHATBOT_SESSIONS[str(chat_id)] = (str(ses_id), str(expires))
 
 
 def get_ses(chat_id):
-    autochat = SESSION.query(ChatbotChats).get(str(chat_id))
-    sesh = ""
-    exp = ""
-    if autochat:
-        sesh = str(autochat.ses_id)
-        exp = str(autochat.expires)
-
-    SESSION.close()
-    return sesh, exp
+    return CHATBOT_SESSIONS.get(str(chat_id), ("", ""))
 
 
 def rem_chat(chat_id):
@@ -64,6 +53,7 @@ def rem_chat(chat_id):
             SESSION.delete(autochat)
 
         SESSION.commit()
+        CHATBOT_SESSIONS.pop(str(chat_id), None)
 
 
 def get_all_chats():
@@ -71,3 +61,17 @@ def get_all_chats():
         return SESSION.query(ChatbotChats.chat_id).all()
     finally:
         SESSION.close()
+
+
+def __load_chatbot_sessions():
+    global CHATBOT_SESSIONS
+    try:
+        CHATBOT_SESSIONS = {
+            chat.chat_id: (str(chat.ses_id), str(chat.expires))
+            for chat in SESSION.query(ChatbotChats).all()
+        }
+    finally:
+        SESSION.close()
+
+
+__load_chatbot_sessions()
@@ -3,6 +3,7 @@ import threading
 from sqlalchemy import Column, String, UnicodeText, Boolean, Integer, distinct, func
 
 from Megumi.modules.helper_funcs.msg_types import Types
+from Megumi.modules.helper_funcs.regex_helper import compile_keywords
 from Megumi.modules.sql import BASE, SESSION
 
 
@@ -122,6 +123,8 @@ Buttons.__table__.create(checkfirst=True)
 CUST_FILT_LOCK = threading.RLock()
 BUTTON_LOCK = threading.RLock()
 CHAT_FILTERS = {}
+# chat_id -> (keywords, compiled matcher); dropped whenever CHAT_FILTERS changes
+CHAT_FILTER_MATCHERS = {}
 
 
 def get_all_filters():
@@ -179,6 +182,7 @@ def add_filter(
                 CHAT_FILTERS.get(str(chat_id), []) + [keyword],
                 key=lambda x: (-len(x), x),
             )
+            CHAT_FILTER_MATCHERS.pop(str(chat_id), None)
 
         SESSION.add(filt)
         SESSION.commit()
@@ -227,6 +231,7 @@ def new_add_filter(chat_id, keyword, reply_text, file_type, file_id, buttons):
                 CHAT_FILTERS.get(str(chat_id), []) + [keyword],
                 key=lambda x: (-len(x), x),
             )
+            CHAT_FILTER_MATCHERS.pop(str(chat_id), None)
 
         SESSION.add(filt)
         SESSION.commit()
@@ -242,6 +247,7 @@ def remove_filter(chat_id, keyword):
         if filt:
             if keyword in CHAT_FILTERS.get(str(chat_id), []):  # Sanity check
                 CHAT_FILTERS.get(str(chat_id), []).remove(keyword)
+                CHAT_FILTER_MATCHERS.pop(str(chat_id), None)
 
             with BUTTON_LOCK:
                 prev_buttons = (
@@ -264,6 +270,16 @@ def get_chat_triggers(chat_id):
     return CHAT_FILTERS.get(str(chat_id), set())
 
 
+def get_chat_filter_matcher(chat_id):
+    matcher = CHAT_FILTER_MATCHERS.get(str(chat_id))
+    if matcher is None:
+        with CUST_FILT_LOCK:
+            keywords = list(CHAT_FILTERS.get(str(chat_id), []))
+            matcher = (keywords, compile_keywords(keywords))
+            CHAT_FILTER_MATCHERS[str(chat_id)] = matcher
+    return matcher
+
+
 def get_chat_filters(chat_id):
     try:
         return (
@@ -386,6 +402,8 @@ def migrate_chat(old_chat_id, new_chat_id):
         SESSION.commit()
         CHAT_FILTERS[str(new_chat_id)] = CHAT_FILTERS[str(old_chat_id)]
         del CHAT_FILTERS[str(old_chat_id)]
+        CHAT_FILTER_MATCHERS.pop(str(old_chat_id), None)
+        CHAT_FILTER_MATCHERS.pop(str(new_chat_id), None)
 
         with BUTTON_LOCK:
             chat_buttons = (
@@ -3,6 +3,7 @@ import threading
 from Megumi import dispatcher
 from Megumi.modules.sql import BASE, SESSION
 from sqlalchemy import Boolean, Column, Integer, String, UnicodeText
+from sqlalchemy.dialects.postgresql import insert
 from telegram.error import BadRequest, Unauthorized
 
 
@@ -107,6 +108,8 @@ FEDERATION_BYFEDID = {}
 FEDERATION_CHATS = {}
 FEDERATION_CHATS_BYID = {}
 
+# fed_id -> {str(user_id): ban info} and fed_id -> set of int user ids, kept
+# in step with bans_feds by every write below instead of being reloaded
 FEDERATION_BANNED_FULL = {}
 FEDERATION_BANNED_USERID = {}
 
@@ -141,7 +144,7 @@ def get_fed_name(chat_id):
 def get_user_fban(fed_id, user_id):
     if not FEDERATION_BANNED_FULL.get(fed_id):
         return False, False, False
-    user_info = FEDERATION_BANNED_FULL[fed_id].get(user_id)
+    user_info = FEDERATION_BANNED_FULL[fed_id].get(str(user_id))
     if not user_info:
         return None, None, None
     return user_info['first_name'], user_info['reason'], user_info['time']
@@ -183,13 +186,15 @@ def get_user_owner_fed_full(user_id):
 
 def get_user_fbanlist(user_id):
     banlist = FEDERATION_BANNED_FULL
+    user_id = str(user_id)
     user_name = ""
     fedname = []
-    for x in banlist:
-        if banlist[x].get(user_id):
+    for x in list(banlist):
+        user_info = banlist[x].get(user_id)
+        if user_info:
             if user_name == "":
-                user_name = banlist[x][user_id].get('first_name')
-            fedname.append([x, banlist[x][user_id].get('reason')])
+                user_name = user_info.get('first_name')
+            fedname.append([x, user_info.get('reason')])
     return user_name, fedname
 
 
@@ -261,13 +266,10 @@ def del_fed(fed_id):
                 FEDERATION_CHATS.pop(x)
             FEDERATION_CHATS_BYID.pop(fed_id)
         # Delete fedban users
-        getall = FEDERATION_BANNED_USERID.get(fed_id)
-        if getall:
-            for x in getall:
-                banlist = SESSION.query(BansF).get((fed_id, str(x)))
-                if banlist:
-                    SESSION.delete(banlist)
-                    SESSION.commit()
+        if FEDERATION_BANNED_USERID.get(fed_id):
+            SESSION.query(BansF).filter(BansF.fed_id == fed_id).delete(
+                synchronize_session=False)
+            SESSION.commit()
         if FEDERATION_BANNED_USERID.get(fed_id):
             FEDERATION_BANNED_USERID.pop(fed_id)
         if FEDERATION_BANNED_FULL.get(fed_id):
@@ -490,128 +492,111 @@ def get_frules(fed_id):
         return rules
 
 
+def __cache_fban(ban):
+    FEDERATION_BANNED_USERID.setdefault(ban.fed_id, set()).add(int(ban.user_id))
+    FEDERATION_BANNED_FULL.setdefault(ban.fed_id, {})[str(ban.user_id)] = {
+        'first_name': ban.first_name,
+        'last_name': ban.last_name,
+        'user_name': ban.user_name,
+        'reason': ban.reason,
+        'time': ban.time
+    }
+
+
+def __uncache_fban(fed_id, user_id):
+    FEDERATION_BANNED_USERID.get(fed_id, set()).discard(int(user_id))
+    FEDERATION_BANNED_FULL.get(fed_id, {}).pop(str(user_id), None)
+
+
 def fban_user(fed_id, user_id, first_name, last_name, user_name, reason, time):
     with FEDS_LOCK:
-        r = SESSION.query(BansF).all()
-        for I in r:
-            if I.fed_id == fed_id:
-                if int(I.user_id) == int(user_id):
-                    SESSION.delete(I)
-
         r = BansF(
             str(fed_id), str(user_id), first_name, last_name, user_name, reason,
             time)
 
-        SESSION.add(r)
+        SESSION.merge(r)  # merge to replace an existing ban on the same user
         try:
             SESSION.commit()
         except:
             SESSION.rollback()
             return False
-        finally:
-            SESSION.commit()
-        __load_all_feds_banned()
+        __cache_fban(r)
         return r
 
 
-def multi_fban_user(multi_fed_id, multi_user_id, multi_first_name,
-                    multi_last_name, multi_user_name, multi_reason):
-    if True:  # with FEDS_LOCK:
-        counter = 0
-        time = 0
-        for x in range(len(multi_fed_id)):
-            fed_id = multi_fed_id[x]
-            user_id = multi_user_id[x]
-            first_name = multi_first_name[x]
-            last_name = multi_last_name[x]
-            user_name = multi_user_name[x]
-            reason = multi_reason[x]
-            r = SESSION.query(BansF).all()
-            for I in r:
-                if I.fed_id == fed_id:
-                    if int(I.user_id) == int(user_id):
-                        SESSION.delete(I)
-
-            r = BansF(
-                str(fed_id), str(user_id), first_name, last_name, user_name,
-                reason, time)
-
-            SESSION.add(r)
-            counter += 1
-            if str(str(counter)[-2:]) == "00":
-                print(user_id)
-                print(first_name)
-                print(reason)
-                print(counter)
+def bulk_fban_users(fed_id, bans):
+    """Upsert (user_id, first_name, last_name, user_name, reason) rows for one
+    federation in a single statement and transaction."""
+    rows = {}
+    for user_id, first_name, last_name, user_name, reason in bans:
+        rows[str(user_id)] = BansF(
+            str(fed_id), str(user_id), first_name, last_name, user_name,
+            reason, 0)
+    if not rows:
+        return 0
+
+    columns = ("fed_id", "user_id", "first_name", "last_name", "user_name",
+               "reason", "time")
+    with FEDS_LOCK:
+        stmt = insert(BansF.__table__).values([
+            {column: getattr(r, column) for column in columns}
+            for r in rows.values()
+        ])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["fed_id", "user_id"],
+            set_={column: stmt.excluded[column] for column in columns[2:]})
         try:
+            SESSION.execute(stmt)
             SESSION.commit()
         except:
             SESSION.rollback()
             return False
-        finally:
-            SESSION.commit()
-        __load_all_feds_banned()
-        print("Done")
-        return counter
+        for r in rows.values():
+            __cache_fban(r)
+        return len(rows)
 
 
 def un_fban_user(fed_id, user_id):
     with FEDS_LOCK:
-        r = SESSION.query(BansF).all()
-        for I in r:
-            if I.fed_id == fed_id:
-                if int(I.user_id) == int(user_id):
-                    SESSION.delete(I)
+        r = SESSION.query(BansF).get((str(fed_id), str(user_id)))
+        if r:
+            SESSION.delete(r)
         try:
             SESSION.commit()
         except:
             SESSION.rollback()
             return False
-        finally:
-            SESSION.commit()
-        __load_all_feds_banned()
-        return I
+        __uncache_fban(fed_id, user_id)
+        return r
 
 
 def get_fban_user(fed_id, user_id):
-    list_fbanned = FEDERATION_BANNED_USERID.get(fed_id)
-    if list_fbanned is None:
-        FEDERATION_BANNED_USERID[fed_id] = []
-    if user_id in FEDERATION_BANNED_USERID[fed_id]:
-        r = SESSION.query(BansF).all()
-        reason = None
-        for I in r:
-            if I.fed_id == fed_id:
-                if int(I.user_id) == int(user_id):
-                    reason = I.reason
-                    time = I.time
-        return True, reason, time
-    else:
+    user_info = FEDERATION_BANNED_FULL.get(fed_id, {}).get(str(user_id))
+    if user_info is None:
         return False, None, None
+    return True, user_info['reason'], user_info['time']
+
+
+def get_fban_info(fed_id, user_id):
+    return FEDERATION_BANNED_FULL.get(fed_id, {}).get(str(user_id))
 
 
 def get_all_fban_users(fed_id):
-    list_fbanned = FEDERATION_BANNED_USERID.get(fed_id)
-    if list_fbanned is None:
-        FEDERATION_BANNED_USERID[fed_id] = []
-    return FEDERATION_BANNED_USERID[fed_id]
+    return list(FEDERATION_BANNED_USERID.get(fed_id, set()))
 
 
 def get_all_fban_users_target(fed_id, user_id):
     list_fbanned = FEDERATION_BANNED_FULL.get(fed_id)
     if list_fbanned is None:
-        FEDERATION_BANNED_FULL[fed_id] = []
         return False
     getuser = list_fbanned[str(user_id)]
     return getuser
 
 
 def get_all_fban_users_global():
-    list_fbanned = FEDERATION_BANNED_USERID
     total = []
     for x in list(FEDERATION_BANNED_USERID):
-        for y in FEDERATION_BANNED_USERID[x]:
-            total.append(y)
+        total.extend(FEDERATION_BANNED_USERID[x])
     return total
 
 
@@ -820,27 +805,9 @@ def __load_all_feds_chats():
 
 
 def __load_all_feds_banned():
-    global FEDERATION_BANNED_USERID, FEDERATION_BANNED_FULL
     try:
-        FEDERATION_BANNED_USERID = {}
-        FEDERATION_BANNED_FULL = {}
-        qall = SESSION.query(BansF).all()
-        for x in qall:
-            check = FEDERATION_BANNED_USERID.get(x.fed_id)
-            if check is None:
-                FEDERATION_BANNED_USERID[x.fed_id] = []
-            if int(x.user_id) not in FEDERATION_BANNED_USERID[x.fed_id]:
-                FEDERATION_BANNED_USERID[x.fed_id].append(int(x.user_id))
-            check = FEDERATION_BANNED_FULL.get(x.fed_id)
-            if check is None:
-                FEDERATION_BANNED_FULL[x.fed_id] = {}
-            FEDERATION_BANNED_FULL[x.fed_id][x.user_id] = {
-                'first_name': x.first_name,
-                'last_name': x.last_name,
-                'user_name': x.user_name,
-                'reason': x.reason,
-                'time': x.time
-            }
+        for x in SESSION.query(BansF).yield_per(1000):
+            __cache_fban(x)
     finally:
         SESSION.close()
 
@@ -45,6 +45,9 @@ GbanSettings.__table__.create(checkfirst=True)
 GBANNED_USERS_LOCK = threading.RLock()
 GBAN_SETTING_LOCK = threading.RLock()
 GBANNED_LIST = set()
+# user_id -> reason, only read once someone needs a reason
+GBAN_REASONS = None
+# chats which turned gbans off; every other chat enforces them
 GBANSTAT_LIST = set()
 
 
@@ -59,7 +62,9 @@ def gban_user(user_id, name, reason=None):
 
         SESSION.merge(user)
         SESSION.commit()
-        __load_gbanned_userid_list()
+        GBANNED_LIST.add(user_id)
+        if GBAN_REASONS is not None:
+            GBAN_REASONS[user_id] = reason
 
 
 def update_gban_reason(user_id, name, reason=None):
@@ -73,6 +78,8 @@ def update_gban_reason(user_id, name, reason=None):
 
         SESSION.merge(user)
         SESSION.commit()
+        if GBAN_REASONS is not None:
+            GBAN_REASONS[user_id] = reason
         return old_reason
 
 
@@ -83,13 +90,22 @@ def ungban_user(user_id):
             SESSION.delete(user)
 
         SESSION.commit()
-        __load_gbanned_userid_list()
+        GBANNED_LIST.discard(user_id)
+        if GBAN_REASONS is not None:
+            GBAN_REASONS.pop(user_id, None)
 
 
 def is_user_gbanned(user_id):
     return user_id in GBANNED_LIST
 
 
+def get_gban_reason(user_id):
+    with GBANNED_USERS_LOCK:
+        if GBAN_REASONS is None:
+            __load_gban_reasons()
+        return GBAN_REASONS.get(user_id)
+
+
 def get_gbanned_user(user_id):
     try:
         return SESSION.query(GloballyBannedUsers).get(user_id)
@@ -147,6 +163,18 @@ def __load_gbanned_userid_list():
         SESSION.close()
 
 
+def __load_gban_reasons():
+    global GBAN_REASONS
+    try:
+        GBAN_REASONS = {
+            x.user_id: x.reason
+            for x in SESSION.query(GloballyBannedUsers.user_id,
+                                   GloballyBannedUsers.reason).all()
+        }
+    finally:
+        SESSION.close()
+
+
 def __load_gban_stat_list():
     global GBANSTAT_LIST
     try:
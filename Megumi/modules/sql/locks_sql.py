@@ -78,6 +78,38 @@ Restrictions.__table__.create(checkfirst=True)
 PERM_LOCK = threading.RLock()
 RESTR_LOCK = threading.RLock()
 
+# Bit positions for the per-chat lock masks; order must never change at runtime
+LOCK_BITS = {
+    lock_type: 1 << index for index, lock_type in enumerate((
+        "audio", "voice", "contact", "video", "document", "photo", "sticker",
+        "gif", "url", "bots", "forward", "game", "location", "rtl", "button",
+        "egame", "inline"))
+}
+RESTR_BITS = {
+    restr_type: 1 << index for index, restr_type in enumerate(
+        ("messages", "media", "other", "preview"))
+}
+
+# chat_id -> int bitmask of locked types; chats without a row are absent (0)
+CHAT_LOCKS = {}
+CHAT_RESTRICTIONS = {}
+
+
+def __perm_mask(perm):
+    mask = 0
+    for lock_type, bit in LOCK_BITS.items():
+        if getattr(perm, lock_type):
+            mask |= bit
+    return mask
+
+
+def __restr_mask(restr):
+    mask = 0
+    for restr_type, bit in RESTR_BITS.items():
+        if getattr(restr, restr_type):
+            mask |= bit
+    return mask
+
 
 def init_permissions(chat_id, reset=False):
     curr_perm = SESSION.query(Permissions).get(str(chat_id))
@@ -87,6 +119,7 @@ def init_permissions(chat_id, reset=False):
     perm = Permissions(str(chat_id))
     SESSION.add(perm)
     SESSION.commit()
+    CHAT_LOCKS.pop(str(chat_id), None)
     return perm
 
 
@@ -98,6 +131,7 @@ def init_restrictions(chat_id, reset=False):
     restr = Restrictions(str(chat_id))
     SESSION.add(restr)
     SESSION.commit()
+    CHAT_RESTRICTIONS.pop(str(chat_id), None)
     return restr
 
 
@@ -144,6 +178,7 @@ def update_lock(chat_id, lock_type, locked):
 
         SESSION.add(curr_perm)
         SESSION.commit()
+        __cache_mask(CHAT_LOCKS, chat_id, __perm_mask(curr_perm))
 
 
 def update_restriction(chat_id, restr_type, locked):
@@ -167,69 +202,36 @@ def update_restriction(chat_id, restr_type, locked):
             curr_restr.preview = locked
         SESSION.add(curr_restr)
         SESSION.commit()
+        __cache_mask(CHAT_RESTRICTIONS, chat_id, __restr_mask(curr_restr))
 
 
-def is_locked(chat_id, lock_type):
-    curr_perm = SESSION.query(Permissions).get(str(chat_id))
-    SESSION.close()
-
-    if not curr_perm:
-        return False
-
-    elif lock_type == "sticker":
-        return curr_perm.sticker
-    elif lock_type == "photo":
-        return curr_perm.photo
-    elif lock_type == "audio":
-        return curr_perm.audio
-    elif lock_type == "voice":
-        return curr_perm.voice
-    elif lock_type == "contact":
-        return curr_perm.contact
-    elif lock_type == "video":
-        return curr_perm.video
-    elif lock_type == "document":
-        return curr_perm.document
-    elif lock_type == "gif":
-        return curr_perm.gif
-    elif lock_type == "url":
-        return curr_perm.url
-    elif lock_type == "bots":
-        return curr_perm.bots
-    elif lock_type == "forward":
-        return curr_perm.forward
-    elif lock_type == "game":
-        return curr_perm.game
-    elif lock_type == "location":
-        return curr_perm.location
-    elif lock_type == "rtl":
-        return curr_perm.rtl
-    elif lock_type == "button":
-        return curr_perm.button
-    elif lock_type == "egame":
-        return curr_perm.egame
-    elif lock_type == "inline":
-        return curr_perm.inline
+def __cache_mask(cache, chat_id, mask):
+    if mask:
+        cache[str(chat_id)] = mask
+    else:
+        cache.pop(str(chat_id), None)
 
 
-def is_restr_locked(chat_id, lock_type):
-    curr_restr = SESSION.query(Restrictions).get(str(chat_id))
-    SESSION.close()
+def get_lock_mask(chat_id):
+    return CHAT_LOCKS.get(str(chat_id), 0)
+
+
+def get_restr_mask(chat_id):
+    return CHAT_RESTRICTIONS.get(str(chat_id), 0)
+
+
+def is_locked(chat_id, lock_type):
+    return bool(get_lock_mask(chat_id) & LOCK_BITS.get(lock_type, 0))
 
-    if not curr_restr:
-        return False
 
-    if lock_type == "messages":
-        return curr_restr.messages
-    elif lock_type == "media":
-        return curr_restr.media
-    elif lock_type == "other":
-        return curr_restr.other
-    elif lock_type == "previews":
-        return curr_restr.preview
-    elif lock_type == "all":
-        return (curr_restr.messages and curr_restr.media and
-                curr_restr.other and curr_restr.preview)
+def is_restr_locked(chat_id, lock_type):
+    mask = get_restr_mask(chat_id)
+    if lock_type == "all":
+        all_bits = sum(RESTR_BITS.values())
+        return mask & all_bits == all_bits
+    if lock_type == "previews":
+        lock_type = "preview"
+    return bool(mask & RESTR_BITS.get(lock_type, 0))
 
 
 def get_locks(chat_id):
@@ -253,8 +255,28 @@ def migrate_chat(old_chat_id, new_chat_id):
             perms.chat_id = str(new_chat_id)
         SESSION.commit()
 
+        mask = CHAT_LOCKS.pop(str(old_chat_id), 0)
+        __cache_mask(CHAT_LOCKS, new_chat_id, mask)
+
     with RESTR_LOCK:
         rest = SESSION.query(Restrictions).get(str(old_chat_id))
         if rest:
             rest.chat_id = str(new_chat_id)
         SESSION.commit()
+        mask = CHAT_RESTRICTIONS.pop(str(old_chat_id), 0)
+        __cache_mask(CHAT_RESTRICTIONS, new_chat_id, mask)
+
+
+def __load_chat_locks():
+    try:
+        for perm in SESSION.query(Permissions).all():
+            __cache_mask(CHAT_LOCKS, perm.chat_id, __perm_mask(perm))
+
+        for restr in SESSION.query(Restrictions).all():
+            __cache_mask(CHAT_RESTRICTIONS, restr.chat_id,
+                         __restr_mask(restr))
+    finally:
+        SESSION.close()
+
+
+__load_chat_locks()
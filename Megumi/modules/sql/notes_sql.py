@@ -1,10 +1,11 @@
 # Note: chat_id's are stored as strings because the int is too large to be stored in a PSQL database.
 import threading
+from collections import OrderedDict
 
 from Megumi.modules.helper_funcs.msg_types import Types
 from Megumi.modules.sql import BASE, SESSION
-from sqlalchemy import (Boolean, Column, Integer, String, UnicodeText, distinct,
-                        func)
+from sqlalchemy import (Boolean, Column, Index, Integer, String, UnicodeText,
+                        distinct, func)
 
 
 class Notes(BASE):
@@ -45,12 +46,60 @@ class Buttons(BASE):
         self.same_line = same_line
 
 
+# lets get_note/rm_note look names up case-insensitively without a full scan
+NOTES_LOWER_NAME_INDEX = Index("ix_notes_chat_id_lower_name", Notes.chat_id,
+                               func.lower(Notes.name))
+
 Notes.__table__.create(checkfirst=True)
 Buttons.__table__.create(checkfirst=True)
+NOTES_LOWER_NAME_INDEX.create(checkfirst=True)
 
 NOTES_INSERTION_LOCK = threading.RLock()
 BUTTONS_INSERTION_LOCK = threading.RLock()
 
+NOTE_CACHE_SIZE = 1000
+# chat_id -> ({lowercased note name: note}, {note name: [buttons]}), for the
+# NOTE_CACHE_SIZE chats that used notes most recently
+CHAT_NOTES = OrderedDict()
+# bumped on every invalidation so a load racing with a write isn't cached
+NOTE_CACHE_VERSION = [0]
+NOTE_CACHE_LOCK = threading.RLock()
+
+
+def __chat_notes(chat_id):
+    chat_id = str(chat_id)
+    with NOTE_CACHE_LOCK:
+        cached = CHAT_NOTES.get(chat_id)
+        if cached:
+            CHAT_NOTES.move_to_end(chat_id)
+            return cached
+        version = NOTE_CACHE_VERSION[0]
+
+    try:
+        notes = {}
+        for note in SESSION.query(Notes).filter(Notes.chat_id == chat_id):
+            notes.setdefault(note.name.lower(), note)
+        buttons = {}
+        for btn in SESSION.query(Buttons).filter(
+                Buttons.chat_id == chat_id).order_by(Buttons.id):
+            buttons.setdefault(btn.note_name, []).append(btn)
+    finally:
+        SESSION.close()
+
+    with NOTE_CACHE_LOCK:
+        if version != NOTE_CACHE_VERSION[0]:
+            return notes, buttons
+        CHAT_NOTES[chat_id] = (notes, buttons)
+        while len(CHAT_NOTES) > NOTE_CACHE_SIZE:
+            CHAT_NOTES.popitem(last=False)
+    return notes, buttons
+
+
+def __uncache_chat(chat_id):
+    with NOTE_CACHE_LOCK:
+        NOTE_CACHE_VERSION[0] += 1
+        CHAT_NOTES.pop(str(chat_id), None)
+
 
 def add_note_to_db(chat_id,
                    note_name,
@@ -82,15 +131,12 @@ def add_note_to_db(chat_id,
 
     for b_name, url, same_line in buttons:
         add_note_button_to_db(chat_id, note_name, b_name, url, same_line)
+    __uncache_chat(chat_id)
 
 
 def get_note(chat_id, note_name):
-    try:
-        return SESSION.query(Notes).filter(
-            func.lower(Notes.name) == note_name,
-            Notes.chat_id == str(chat_id)).first()
-    finally:
-        SESSION.close()
+    notes, _ = __chat_notes(chat_id)
+    return notes.get(note_name)
 
 
 def rm_note(chat_id, note_name):
@@ -108,6 +154,7 @@ def rm_note(chat_id, note_name):
 
             SESSION.delete(note)
             SESSION.commit()
+            __uncache_chat(chat_id)
             return True
 
         else:
@@ -128,15 +175,12 @@ def add_note_button_to_db(chat_id, note_name, b_name, url, same_line):
         button = Buttons(chat_id, note_name, b_name, url, same_line)
         SESSION.add(button)
         SESSION.commit()
+    __uncache_chat(chat_id)
 
 
 def get_buttons(chat_id, note_name):
-    try:
-        return SESSION.query(Buttons).filter(
-            Buttons.chat_id == str(chat_id),
-            Buttons.note_name == note_name).order_by(Buttons.id).all()
-    finally:
-        SESSION.close()
+    _, buttons = __chat_notes(chat_id)
+    return buttons.get(note_name, [])
 
 
 def num_notes():
@@ -167,3 +211,5 @@ def migrate_chat(old_chat_id, new_chat_id):
                 btn.chat_id = str(new_chat_id)
 
         SESSION.commit()
+        __uncache_chat(old_chat_id)
+        __uncache_chat(new_chat_id)
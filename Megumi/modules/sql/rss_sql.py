@@ -21,9 +21,29 @@ class RSS(BASE):
             self.chat_id, self.feed_link, self.old_entry_link)
 
 
+class RSSFeedState(BASE):
+    __tablename__ = "rss_feed_state"
+    feed_link = Column(UnicodeText, primary_key=True)
+    etag = Column(UnicodeText)
+    modified = Column(UnicodeText)
+
+    def __init__(self, feed_link, etag=None, modified=None):
+        self.feed_link = feed_link
+        self.etag = etag
+        self.modified = modified
+
+    def __repr__(self):
+        return "<RSS state for {} (etag {}, modified {})>".format(
+            self.feed_link, self.etag, self.modified)
+
+
 RSS.__table__.create(checkfirst=True)
+RSSFeedState.__table__.create(checkfirst=True)
 INSERTION_LOCK = threading.RLock()
 
+# feed_link -> (etag, modified) of the last successful fetch
+FEED_HEADERS = {}
+
 
 def check_url_availability(tg_chat_id, tg_feed_link):
     try:
@@ -48,6 +68,14 @@ def remove_url(tg_chat_id, tg_feed_link):
             # add the action to the DB query
             SESSION.delete(row)
 
+        # forget the fetch state once nobody follows the feed anymore
+        if not SESSION.query(RSS).filter(
+                RSS.feed_link == tg_feed_link).first():
+            state = SESSION.query(RSSFeedState).get(tg_feed_link)
+            if state:
+                SESSION.delete(state)
+            FEED_HEADERS.pop(tg_feed_link, None)
+
         SESSION.commit()
 
 
@@ -65,6 +93,20 @@ def get_all():
         SESSION.close()
 
 
+def get_feed_links():
+    try:
+        return [x.feed_link for x in SESSION.query(RSS.feed_link).distinct()]
+    finally:
+        SESSION.close()
+
+
+def get_feed_subscribers(tg_feed_link):
+    try:
+        return SESSION.query(RSS).filter(RSS.feed_link == tg_feed_link).all()
+    finally:
+        SESSION.close()
+
+
 def update_url(row_id, new_entry_links):
     with INSERTION_LOCK:
         row = SESSION.query(RSS).get(row_id)
@@ -74,3 +116,39 @@ def update_url(row_id, new_entry_links):
 
         # commit the changes to the DB
         SESSION.commit()
+
+
+def update_urls(row_ids, new_entry_link):
+    with INSERTION_LOCK:
+        SESSION.query(RSS).filter(RSS.id.in_(row_ids)).update(
+            {RSS.old_entry_link: new_entry_link}, synchronize_session=False)
+        SESSION.commit()
+
+
+def get_feed_headers(tg_feed_link):
+    return FEED_HEADERS.get(tg_feed_link, (None, None))
+
+
+def set_feed_headers(tg_feed_link, etag, modified):
+    with INSERTION_LOCK:
+        if FEED_HEADERS.get(tg_feed_link) == (etag, modified):
+            return
+        state = SESSION.query(RSSFeedState).get(tg_feed_link)
+        if not state:
+            state = RSSFeedState(tg_feed_link)
+            SESSION.add(state)
+        state.etag = etag
+        state.modified = modified
+        SESSION.commit()
+        FEED_HEADERS[tg_feed_link] = (etag, modified)
+
+
+def __load_feed_headers():
+    try:
+        for state in SESSION.query(RSSFeedState).all():
+            FEED_HEADERS[state.feed_link] = (state.etag, state.modified)
+    finally:
+        SESSION.close()
+
+
+__load_feed_headers()
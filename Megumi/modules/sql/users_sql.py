@@ -1,6 +1,8 @@
 import threading
+from collections import OrderedDict
 
-from sqlalchemy import Column, Integer, UnicodeText, String, ForeignKey, UniqueConstraint, func
+from sqlalchemy import Column, Index, Integer, UnicodeText, String, ForeignKey, UniqueConstraint, func
+from sqlalchemy.dialects.postgresql import insert
 
 from Megumi import dispatcher
 from Megumi.modules.sql import BASE, SESSION
@@ -57,12 +59,35 @@ class ChatMembers(BASE):
                                                             self.chat.chat_name, self.chat.chat_id)
 
 
+# get_userid_by_name matches usernames case-insensitively
+USERS_LOWER_USERNAME_INDEX = Index("ix_users_lower_username", func.lower(Users.username))
+
 Users.__table__.create(checkfirst=True)
 Chats.__table__.create(checkfirst=True)
 ChatMembers.__table__.create(checkfirst=True)
+USERS_LOWER_USERNAME_INDEX.create(checkfirst=True)
 
 INSERTION_LOCK = threading.RLock()
 
+# write-behind buffer for log_user: entries already in the db are skipped,
+# everything else waits in PENDING_USERS until the next flush_users()
+PENDING_LOCK = threading.Lock()
+PENDING_USERS = {}
+SEEN_USERS = set()
+# user_id -> username of their latest queued message, what a flush writes
+LATEST_NAMES = {}
+SEEN_USERS_LIMIT = 200000
+FLUSH_THRESHOLD = 500
+# while the db is failing, entries past this many are dropped, not buffered
+PENDING_LIMIT = 20000
+# set while the last flush failed; retries are left to the periodic job
+FLUSH_STATE = {"failed": False}
+
+# lowercased username -> id of the user last seen with it, most recent last
+USERNAMES = OrderedDict()
+USERNAMES_LOCK = threading.Lock()
+USERNAMES_LIMIT = 100000
+
 
 def ensure_bot_in_db():
     with INSERTION_LOCK:
@@ -103,6 +128,125 @@ def update_user(user_id, username, chat_id=None, chat_name=None):
         SESSION.commit()
 
 
+def remember_username(user_id, username):
+    if not username:
+        return
+    with USERNAMES_LOCK:
+        USERNAMES[username.lower()] = user_id
+        USERNAMES.move_to_end(username.lower())
+        while len(USERNAMES) > USERNAMES_LIMIT:
+            USERNAMES.popitem(last=False)
+
+
+def get_cached_userid(username):
+    return USERNAMES.get(username.lower())
+
+
+def queue_user(user_id, username, chat_id=None, chat_name=None) -> bool:
+    """Buffer an update_user call; returns True once a flush is due."""
+    remember_username(user_id, username)
+    if not chat_id or not chat_name:
+        chat_id = chat_name = None
+    entry = (user_id, username, chat_id and str(chat_id), chat_name)
+
+    with PENDING_LOCK:
+        renamed = LATEST_NAMES.get(user_id, username) != username
+        LATEST_NAMES[user_id] = username
+        if entry in SEEN_USERS and not renamed:
+            return False
+        key = (user_id, entry[2])
+        if key not in PENDING_USERS and len(PENDING_USERS) >= PENDING_LIMIT:
+            return False
+        PENDING_USERS[key] = entry
+        return (len(PENDING_USERS) >= FLUSH_THRESHOLD and
+                not FLUSH_STATE["failed"])
+
+
+def __forget(chat_ids=(), user_ids=()):
+    # rows that were deleted or moved must be written again when next seen
+    chat_ids = {str(chat_id) for chat_id in chat_ids}
+    user_ids = {int(user_id) for user_id in user_ids}
+    with PENDING_LOCK:
+        for entry in [
+                entry for entry in SEEN_USERS
+                if entry[2] in chat_ids or entry[0] in user_ids
+        ]:
+            SEEN_USERS.discard(entry)
+        for key in [
+                key for key in PENDING_USERS
+                if key[1] in chat_ids or key[0] in user_ids
+        ]:
+            del PENDING_USERS[key]
+        for user_id in user_ids:
+            LATEST_NAMES.pop(user_id, None)
+
+
+def flush_users() -> int:
+    with PENDING_LOCK:
+        pending = list(PENDING_USERS.values())
+        PENDING_USERS.clear()
+        # pending is ordered by each key's first message, not its latest one
+        users = {
+            user_id: LATEST_NAMES.get(user_id, username)
+            for user_id, username, _, _ in pending
+        }
+
+    if not pending:
+        return 0
+
+    chats = {
+        chat_id: chat_name
+        for _, _, chat_id, chat_name in pending
+        if chat_id
+    }
+    members = {(chat_id, user_id) for user_id, _, chat_id, _ in pending if chat_id}
+
+    with INSERTION_LOCK:
+        try:
+            stmt = insert(Users.__table__).values(
+                [{"user_id": user_id, "username": username}
+                 for user_id, username in users.items()])
+            SESSION.execute(
+                stmt.on_conflict_do_update(
+                    index_elements=["user_id"],
+                    set_={"username": stmt.excluded.username}))
+
+            if chats:
+                stmt = insert(Chats.__table__).values(
+                    [{"chat_id": chat_id, "chat_name": chat_name}
+                     for chat_id, chat_name in chats.items()])
+                SESSION.execute(
+                    stmt.on_conflict_do_update(
+                        index_elements=["chat_id"],
+                        set_={"chat_name": stmt.excluded.chat_name}))
+
+            if members:
+                SESSION.execute(
+                    insert(ChatMembers.__table__).values(
+                        [{"chat": chat_id, "user": user_id}
+                         for chat_id, user_id in members]).on_conflict_do_nothing(
+                             constraint="_chat_members_uc"))
+
+            SESSION.commit()
+        except Exception:
+            SESSION.rollback()
+            with PENDING_LOCK:
+                FLUSH_STATE["failed"] = True
+                for entry in pending:
+                    if len(PENDING_USERS) >= PENDING_LIMIT:
+                        break
+                    PENDING_USERS.setdefault((entry[0], entry[2]), entry)
+            raise
+
+    with PENDING_LOCK:
+        FLUSH_STATE["failed"] = False
+        if len(SEEN_USERS) + len(pending) > SEEN_USERS_LIMIT:
+            SEEN_USERS.clear()
+            LATEST_NAMES.clear()
+        SEEN_USERS.update(pending)
+    return len(pending)
+
+
 def get_userid_by_name(username):
     try:
         return SESSION.query(Users).filter(func.lower(Users.username) == username.lower()).all()
@@ -137,6 +281,27 @@ def get_all_chats():
         SESSION.close()
 
 
+def get_chat_ids_after(chat_id, limit):
+    """Up to limit chat ids ordered after chat_id (None for the first page)."""
+    try:
+        query = SESSION.query(Chats.chat_id)
+        if chat_id is not None:
+            query = query.filter(Chats.chat_id > str(chat_id))
+        return [x.chat_id for x in query.order_by(Chats.chat_id).limit(limit)]
+    finally:
+        SESSION.close()
+
+
+def get_user_ids_after(user_id, limit):
+    try:
+        query = SESSION.query(Users.user_id)
+        if user_id is not None:
+            query = query.filter(Users.user_id > int(user_id))
+        return [x.user_id for x in query.order_by(Users.user_id).limit(limit)]
+    finally:
+        SESSION.close()
+
+
 def get_user_num_chats(user_id):
     try:
         return SESSION.query(ChatMembers).filter(ChatMembers.user == int(user_id)).count()
@@ -181,12 +346,14 @@ def migrate_chat(old_chat_id, new_chat_id):
             SESSION.add(member)
 
         SESSION.commit()
+    __forget(chat_ids=[old_chat_id])
 
 
 ensure_bot_in_db()
 
 
 def del_user(user_id):
+    __forget(user_ids=[user_id])
     with INSERTION_LOCK:
         curr = SESSION.query(Users).get(user_id)
         if curr:
@@ -207,4 +374,27 @@ def rem_chat(chat_id):
             SESSION.delete(chat)
             SESSION.commit()
         else:
-            SESSION.close()
\ No newline at end of file
+            SESSION.close()
+    __forget(chat_ids=[chat_id])
+
+
+def rem_chats(chat_ids):
+    with INSERTION_LOCK:
+        chat_ids = [str(chat_id) for chat_id in chat_ids]
+        SESSION.query(ChatMembers).filter(ChatMembers.chat.in_(chat_ids)).delete(
+            synchronize_session=False)
+        SESSION.query(Chats).filter(Chats.chat_id.in_(chat_ids)).delete(
+            synchronize_session=False)
+        SESSION.commit()
+    __forget(chat_ids=chat_ids)
+
+
+def del_users(user_ids):
+    with INSERTION_LOCK:
+        user_ids = [int(user_id) for user_id in user_ids]
+        SESSION.query(ChatMembers).filter(ChatMembers.user.in_(user_ids)).delete(
+            synchronize_session=False)
+        SESSION.query(Users).filter(Users.user_id.in_(user_ids)).delete(
+            synchronize_session=False)
+        SESSION.commit()
+    __forget(user_ids=user_ids)
@@ -1,5 +1,6 @@
 import threading
 
+from Megumi.modules.helper_funcs.regex_helper import compile_keywords
 from Megumi.modules.sql import BASE, SESSION
 from sqlalchemy import (Boolean, Column, Integer, String, UnicodeText, distinct,
                         func)
@@ -70,6 +71,8 @@ WARN_FILTER_INSERTION_LOCK = threading.RLock()
 WARN_SETTINGS_LOCK = threading.RLock()
 
 WARN_FILTERS = {}
+# chat_id -> (keywords, compiled matcher); dropped whenever WARN_FILTERS changes
+WARN_FILTER_MATCHERS = {}
 
 
 def warn_user(user_id, chat_id, reason=None):
@@ -141,6 +144,7 @@ def add_warn_filter(chat_id, keyword, reply):
             WARN_FILTERS[str(chat_id)] = sorted(
                 WARN_FILTERS.get(str(chat_id), []) + [keyword],
                 key=lambda x: (-len(x), x))
+            WARN_FILTER_MATCHERS.pop(str(chat_id), None)
 
         SESSION.merge(warn_filt)  # merge to avoid duplicate key issues
         SESSION.commit()
@@ -152,6 +156,7 @@ def remove_warn_filter(chat_id, keyword):
         if warn_filt:
             if keyword in WARN_FILTERS.get(str(chat_id), []):  # sanity check
                 WARN_FILTERS.get(str(chat_id), []).remove(keyword)
+                WARN_FILTER_MATCHERS.pop(str(chat_id), None)
 
             SESSION.delete(warn_filt)
             SESSION.commit()
@@ -164,6 +169,16 @@ def get_chat_warn_triggers(chat_id):
     return WARN_FILTERS.get(str(chat_id), set())
 
 
+def get_chat_warn_matcher(chat_id):
+    matcher = WARN_FILTER_MATCHERS.get(str(chat_id))
+    if matcher is None:
+        with WARN_FILTER_INSERTION_LOCK:
+            keywords = list(WARN_FILTERS.get(str(chat_id), []))
+            matcher = (keywords, compile_keywords(keywords))
+            WARN_FILTER_MATCHERS[str(chat_id)] = matcher
+    return matcher
+
+
 def get_chat_warn_filters(chat_id):
     try:
         return SESSION.query(WarnFilters).filter(
@@ -287,6 +302,8 @@ def migrate_chat(old_chat_id, new_chat_id):
         SESSION.commit()
         WARN_FILTERS[str(new_chat_id)] = WARN_FILTERS[str(old_chat_id)]
         del WARN_FILTERS[str(old_chat_id)]
+        WARN_FILTER_MATCHERS.pop(str(old_chat_id), None)
+        WARN_FILTER_MATCHERS.pop(str(new_chat_id), None)
 
     with WARN_SETTINGS_LOCK:
         chat_settings = SESSION.query(WarnSettings).filter(
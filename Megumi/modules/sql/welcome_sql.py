@@ -1,4 +1,5 @@
 import threading
+from collections import OrderedDict, namedtuple
 from typing import Union
 from sqlalchemy import Column, String, Boolean, UnicodeText, Integer, BigInteger
 
@@ -121,16 +122,102 @@ WM_LOCK = threading.RLock()
 CS_LOCK = threading.RLock()
 AUTOKICK_LOCK = threading.RLock()
 
-def welcome_mutes(chat_id):
+# every welcome/goodbye setting of a chat, as the getters below return them
+WelcomeConfig = namedtuple(
+    "WelcomeConfig",
+    "welc_pref gdbye_pref custom_welcome custom_goodbye clean_welcome "
+    "welcome_mutes clean_service kick_time welc_buttons gdbye_buttons")
+WelcomeButton = namedtuple("WelcomeButton", "id name url same_line")
+
+WELCOME_CONFIG_SIZE = 5000
+# chat_id -> WelcomeConfig for the WELCOME_CONFIG_SIZE chats used most recently
+WELCOME_CONFIGS = OrderedDict()
+# bumped by every setter, so a snapshot loaded meanwhile isn't cached
+WELCOME_CONFIG_VERSION = [0]
+WELCOME_CONFIG_LOCK = threading.RLock()
+
+
+def __load_config(chat_id):
     try:
-        welcomemutes = SESSION.query(WelcomeMute).get(str(chat_id))
-        if welcomemutes:
-            return welcomemutes.welcomemutes
-        return False
+        welc = SESSION.query(Welcome).get(chat_id)
+        mutes = SESSION.query(WelcomeMute).get(chat_id)
+        clean = SESSION.query(CleanServiceSetting).get(chat_id)
+        kick = SESSION.query(AutoKickSafeMode).get(chat_id)
+        welc_buttons = tuple(
+            WelcomeButton(btn.id, btn.name, btn.url, btn.same_line)
+            for btn in SESSION.query(WelcomeButtons).filter(
+                WelcomeButtons.chat_id == chat_id).order_by(WelcomeButtons.id))
+        gdbye_buttons = tuple(
+            WelcomeButton(btn.id, btn.name, btn.url, btn.same_line)
+            for btn in SESSION.query(GoodbyeButtons).filter(
+                GoodbyeButtons.chat_id == chat_id).order_by(GoodbyeButtons.id))
+
+        if welc:
+            welc_pref = (welc.should_welcome, welc.custom_welcome, welc.welcome_type)
+            gdbye_pref = (welc.should_goodbye, welc.custom_leave, welc.leave_type)
+        else:
+            # Welcome by default.
+            welc_pref = (True, DEFAULT_WELCOME, Types.TEXT)
+            gdbye_pref = (True, DEFAULT_GOODBYE, Types.TEXT)
+
+        return WelcomeConfig(
+            welc_pref=welc_pref,
+            gdbye_pref=gdbye_pref,
+            custom_welcome=welc.custom_welcome if welc and welc.custom_welcome else DEFAULT_WELCOME,
+            custom_goodbye=welc.custom_leave if welc and welc.custom_leave else DEFAULT_GOODBYE,
+            clean_welcome=welc.clean_welcome if welc else False,
+            welcome_mutes=mutes.welcomemutes if mutes else False,
+            clean_service=clean.clean_service if clean else False,
+            kick_time=kick.timeK if kick else 90,  # 90 seconds
+            welc_buttons=welc_buttons,
+            gdbye_buttons=gdbye_buttons)
     finally:
         SESSION.close()
 
 
+def get_welcome_config(chat_id) -> WelcomeConfig:
+    """Snapshot of the chat's settings; never changed, setters replace it."""
+    chat_id = str(chat_id)
+    with WELCOME_CONFIG_LOCK:
+        config = WELCOME_CONFIGS.get(chat_id)
+        if config:
+            WELCOME_CONFIGS.move_to_end(chat_id)
+            return config
+        version = WELCOME_CONFIG_VERSION[0]
+
+    config = __load_config(chat_id)
+    with WELCOME_CONFIG_LOCK:
+        if version == WELCOME_CONFIG_VERSION[0]:
+            __cache_config(chat_id, config)
+    return config
+
+
+def __cache_config(chat_id, config):
+    WELCOME_CONFIGS[chat_id] = config
+    WELCOME_CONFIGS.move_to_end(chat_id)
+    while len(WELCOME_CONFIGS) > WELCOME_CONFIG_SIZE:
+        WELCOME_CONFIGS.popitem(last=False)
+
+
+def __replace_config(chat_id):
+    # called after a setter committed; the new snapshot is built before it
+    # takes the old one's place
+    chat_id = str(chat_id)
+    with WELCOME_CONFIG_LOCK:
+        WELCOME_CONFIG_VERSION[0] += 1
+        __cache_config(chat_id, __load_config(chat_id))
+
+
+def __uncache_config(chat_id):
+    with WELCOME_CONFIG_LOCK:
+        WELCOME_CONFIG_VERSION[0] += 1
+        WELCOME_CONFIGS.pop(str(chat_id), None)
+
+
+def welcome_mutes(chat_id):
+    return get_welcome_config(chat_id).welcome_mutes
+
+
 def set_welcome_mutes(chat_id, welcomemutes):
     with WM_LOCK:
         prev = SESSION.query(WelcomeMute).get((str(chat_id)))
@@ -139,6 +226,7 @@ def set_welcome_mutes(chat_id, welcomemutes):
         welcome_m = WelcomeMute(str(chat_id), welcomemutes)
         SESSION.add(welcome_m)
         SESSION.commit()
+        __replace_config(chat_id)
 
 
 def set_human_checks(user_id, chat_id):
@@ -167,24 +255,25 @@ def get_human_checks(user_id, chat_id):
         SESSION.close()
 
 
+def get_human_checked(user_ids, chat_id):
+    """The users among user_ids who passed the human check in chat_id."""
+    try:
+        return {
+            x.user_id for x in SESSION.query(WelcomeMuteUsers.user_id).filter(
+                WelcomeMuteUsers.chat_id == str(chat_id),
+                WelcomeMuteUsers.user_id.in_(list(user_ids)),
+                WelcomeMuteUsers.human_check == True)
+        }
+    finally:
+        SESSION.close()
+
+
 def get_welc_pref(chat_id):
-    welc = SESSION.query(Welcome).get(str(chat_id))
-    SESSION.close()
-    if welc:
-        return welc.should_welcome, welc.custom_welcome, welc.welcome_type
-    else:
-        # Welcome by default.
-        return True, DEFAULT_WELCOME, Types.TEXT
+    return get_welcome_config(chat_id).welc_pref
 
 
 def get_gdbye_pref(chat_id):
-    welc = SESSION.query(Welcome).get(str(chat_id))
-    SESSION.close()
-    if welc:
-        return welc.should_goodbye, welc.custom_leave, welc.leave_type
-    else:
-        # Welcome by default.
-        return True, DEFAULT_GOODBYE, Types.TEXT
+    return get_welcome_config(chat_id).gdbye_pref
 
 
 def set_clean_welcome(chat_id, clean_welcome):
@@ -197,26 +286,15 @@ def set_clean_welcome(chat_id, clean_welcome):
 
         SESSION.add(curr)
         SESSION.commit()
+        __replace_config(chat_id)
 
 
 def get_clean_pref(chat_id):
-    welc = SESSION.query(Welcome).get(str(chat_id))
-    SESSION.close()
-
-    if welc:
-        return welc.clean_welcome
-
-    return False
+    return get_welcome_config(chat_id).clean_welcome
 
 
 def get_welc_mutes_pref(chat_id):
-    welcomemutes = SESSION.query(WelcomeMute).get(str(chat_id))
-    SESSION.close()
-
-    if welcomemutes:
-        return welcomemutes.welcomemutes
-
-    return False
+    return get_welcome_config(chat_id).welcome_mutes
 
 
 def set_welc_preference(chat_id, should_welcome):
@@ -229,6 +307,7 @@ def set_welc_preference(chat_id, should_welcome):
 
         SESSION.add(curr)
         SESSION.commit()
+        __replace_config(chat_id)
 
 
 def set_gdbye_preference(chat_id, should_goodbye):
@@ -241,6 +320,7 @@ def set_gdbye_preference(chat_id, should_goodbye):
 
         SESSION.add(curr)
         SESSION.commit()
+        __replace_config(chat_id)
 
 
 def set_custom_welcome(chat_id, custom_welcome, welcome_type, buttons=None):
@@ -276,16 +356,11 @@ def set_custom_welcome(chat_id, custom_welcome, welcome_type, buttons=None):
                 SESSION.add(button)
 
         SESSION.commit()
+        __replace_config(chat_id)
 
 
 def get_custom_welcome(chat_id):
-    welcome_settings = SESSION.query(Welcome).get(str(chat_id))
-    ret = DEFAULT_WELCOME
-    if welcome_settings and welcome_settings.custom_welcome:
-        ret = welcome_settings.custom_welcome
-
-    SESSION.close()
-    return ret
+    return get_welcome_config(chat_id).custom_welcome
 
 
 def set_custom_gdbye(chat_id, custom_goodbye, goodbye_type, buttons=None):
@@ -321,50 +396,23 @@ def set_custom_gdbye(chat_id, custom_goodbye, goodbye_type, buttons=None):
                 SESSION.add(button)
 
         SESSION.commit()
+        __replace_config(chat_id)
 
 
 def get_custom_gdbye(chat_id):
-    welcome_settings = SESSION.query(Welcome).get(str(chat_id))
-    ret = DEFAULT_GOODBYE
-    if welcome_settings and welcome_settings.custom_leave:
-        ret = welcome_settings.custom_leave
-
-    SESSION.close()
-    return ret
+    return get_welcome_config(chat_id).custom_goodbye
 
 
 def get_welc_buttons(chat_id):
-    try:
-        return (
-            SESSION.query(WelcomeButtons)
-            .filter(WelcomeButtons.chat_id == str(chat_id))
-            .order_by(WelcomeButtons.id)
-            .all()
-        )
-    finally:
-        SESSION.close()
+    return list(get_welcome_config(chat_id).welc_buttons)
 
 
 def get_gdbye_buttons(chat_id):
-    try:
-        return (
-            SESSION.query(GoodbyeButtons)
-            .filter(GoodbyeButtons.chat_id == str(chat_id))
-            .order_by(GoodbyeButtons.id)
-            .all()
-        )
-    finally:
-        SESSION.close()
+    return list(get_welcome_config(chat_id).gdbye_buttons)
 
 
 def clean_service(chat_id: Union[str, int]) -> bool:
-    try:
-        chat_setting = SESSION.query(CleanServiceSetting).get(str(chat_id))
-        if chat_setting:
-            return chat_setting.clean_service
-        return False
-    finally:
-        SESSION.close()
+    return get_welcome_config(chat_id).clean_service
 
 
 def set_clean_service(chat_id: Union[int, str], setting: bool):
@@ -376,15 +424,10 @@ def set_clean_service(chat_id: Union[int, str], setting: bool):
         chat_setting.clean_service = setting
         SESSION.add(chat_setting)
         SESSION.commit()
+        __replace_config(chat_id)
 
 def getKickTime(chat_id):
-    try:
-        resultObj = SESSION.query(AutoKickSafeMode).get(str(chat_id))
-        if resultObj:
-            return resultObj.timeK
-        return 90 #90 seconds
-    finally:
-        SESSION.close()
+    return get_welcome_config(chat_id).kick_time
 
 def setKickTime(chat_id, value):
     with AUTOKICK_LOCK:
@@ -394,6 +437,7 @@ def setKickTime(chat_id, value):
         newObj = AutoKickSafeMode(str(chat_id), int(value))
         SESSION.add(newObj)
         SESSION.commit()
+        __replace_config(chat_id)
         
 def migrate_chat(old_chat_id, new_chat_id):
     with INSERTION_LOCK:
@@ -419,4 +463,6 @@ def migrate_chat(old_chat_id, new_chat_id):
             for btn in chat_buttons:
                 btn.chat_id = str(new_chat_id)
 
-        SESSION.commit()
\ No newline at end of file
+        SESSION.commit()
+        __uncache_config(old_chat_id)
+        __uncache_config(new_chat_id)
\ No newline at end of file
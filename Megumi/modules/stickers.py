@@ -1,6 +1,9 @@
-import os
 import math
+import re
+import threading
 import urllib.request as urllib
+from collections import OrderedDict
+from io import BytesIO
 from PIL import Image
 from html import escape
 
@@ -9,9 +12,18 @@ from telegram import TelegramError, Update
 from telegram.ext import run_async, CallbackContext
 from telegram.utils.helpers import mention_html
 from Megumi.modules.helper_funcs.alternate import typing_action
-from Megumi import dispatcher
+from Megumi import LOGGER, dispatcher
 from Megumi.modules.disable import DisableAbleCommandHandler
 
+MAX_STICKERS = 120
+MAX_ANIMATED_STICKERS = 50
+KANG_PACKS_SIZE = 10000
+# (user_id, animated) -> (packnum, sticker count) of the pack kangs go to
+KANG_PACKS = OrderedDict()
+KANG_PACKS_LOCK = threading.Lock()
+# owner of a pack named by pack_name
+PACK_OWNER = re.compile(r"^(?:b|animated)(?:\d+_)?(\d+)_by_")
+
 @run_async
 def stickerid(update: Update, context: CallbackContext):
     msg = update.effective_message
@@ -40,38 +52,154 @@ def getsticker(update: Update, context: CallbackContext):
     chat_id = update.effective_chat.id
     if msg.reply_to_message and msg.reply_to_message.sticker:
         file_id = msg.reply_to_message.sticker.file_id
-        new_file = bot.get_file(file_id)
-        new_file.download("sticker.png")
-        bot.send_document(chat_id, document=open("sticker.png", "rb"))
-        os.remove("sticker.png")
+        sticker = BytesIO()
+        sticker.name = "sticker.png"
+        bot.get_file(file_id).download(out=sticker)
+        sticker.seek(0)
+        bot.send_document(chat_id, document=sticker)
     else:
         update.effective_message.reply_text(
             "Please reply to a sticker for me to upload its PNG.")
 
 
+def pack_name(bot, user_id, packnum, animated):
+    prefix = "animated" if animated else "b"
+    if packnum > 0:
+        return f"{prefix}{packnum}_{user_id}_by_{bot.username}"
+    return f"{prefix}{user_id}_by_{bot.username}"
+
+
+def current_pack(bot, user_id, animated):
+    """(packnum, sticker count) of the pack the user's kangs go to. Looked up
+    on telegram once, then kept up to date by every successful kang."""
+    with KANG_PACKS_LOCK:
+        cached = KANG_PACKS.get((user_id, animated))
+    if cached:
+        return cached
+
+    max_stickers = MAX_ANIMATED_STICKERS if animated else MAX_STICKERS
+    packnum = 0
+    while True:
+        try:
+            stickerset = bot.get_sticker_set(pack_name(bot, user_id, packnum, animated))
+        except TelegramError as e:
+            if e.message == "Stickerset_invalid":
+                return packnum, 0
+            raise
+        if len(stickerset.stickers) < max_stickers:
+            break
+        packnum += 1
+
+    return __remember_pack(user_id, animated, packnum, len(stickerset.stickers))
+
+
+def __remember_pack(user_id, animated, packnum, count):
+    max_stickers = MAX_ANIMATED_STICKERS if animated else MAX_STICKERS
+    if count >= max_stickers:
+        packnum, count = packnum + 1, 0
+    with KANG_PACKS_LOCK:
+        KANG_PACKS[(user_id, animated)] = (packnum, count)
+        KANG_PACKS.move_to_end((user_id, animated))
+        while len(KANG_PACKS) > KANG_PACKS_SIZE:
+            KANG_PACKS.popitem(last=False)
+    return packnum, count
+
+
+def __forget_pack(user_id, animated):
+    with KANG_PACKS_LOCK:
+        KANG_PACKS.pop((user_id, animated), None)
+
+
+def resize_sticker(data) -> BytesIO:
+    """Scale an image to fit 512x512, returned as an in-memory PNG."""
+    im = Image.open(data)
+    maxsize = (512, 512)
+    if (im.width and im.height) < 512:
+        size1 = im.width
+        size2 = im.height
+        if im.width > im.height:
+            scale = 512 / size1
+            size1new = 512
+            size2new = size2 * scale
+        else:
+            scale = 512 / size2
+            size1new = size1 * scale
+            size2new = 512
+        size1new = math.floor(size1new)
+        size2new = math.floor(size2new)
+        sizenew = (size1new, size2new)
+        im = im.resize(sizenew)
+    else:
+        im.thumbnail(maxsize)
+
+    sticker = BytesIO()
+    sticker.name = "kangsticker.png"
+    im.save(sticker, "PNG")
+    sticker.seek(0)
+    return sticker
+
+
+def kang_reply(msg, packname, sticker_emoji):
+    msg.reply_text(
+        f"I've added this sticker to your pack."
+        + f"\nEmoji is: {sticker_emoji}",
+        parse_mode=ParseMode.MARKDOWN,
+        reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton(
+        text="View Pack", url=f"t.me/addstickers/{packname}")]])
+    )
+
+
+def add_to_pack(update, context, sticker, sticker_emoji, animated, retry=True):
+    msg = update.effective_message
+    user = update.effective_user
+    packnum, count = current_pack(context.bot, user.id, animated)
+    packname = pack_name(context.bot, user.id, packnum, animated)
+    sticker.seek(0)
+    if animated:
+        kwargs = dict(tgs_sticker=sticker)
+    else:
+        kwargs = dict(png_sticker=sticker)
+
+    try:
+        context.bot.add_sticker_to_set(
+            user_id=user.id,
+            name=packname,
+            emojis=sticker_emoji,
+            **kwargs,
+        )
+    except TelegramError as e:
+        if e.message == "Stickerset_invalid":
+            makepack_internal(update, context, msg, user, sticker_emoji,
+                              packname, packnum, **kwargs)
+        elif e.message == "Invalid sticker emojis":
+            msg.reply_text("Invalid emoji(s).")
+        elif e.message == "Stickers_too_much":
+            # the pack filled up behind our back, move on to the next one
+            __remember_pack(user.id, animated, packnum,
+                            MAX_ANIMATED_STICKERS if animated else MAX_STICKERS)
+            if retry:
+                add_to_pack(update, context, sticker, sticker_emoji, animated, retry=False)
+            else:
+                msg.reply_text(
+                    "Max packsize reached. Press F to pay respecc.")
+        elif e.message == "Internal Server Error: sticker set not found (500)":
+            __remember_pack(user.id, animated, packnum, count + 1)
+            kang_reply(msg, packname, sticker_emoji)
+        else:
+            LOGGER.exception("Could not add sticker to %s", packname)
+            msg.reply_text("Failed to add the sticker, try again later.")
+        return
+
+    __remember_pack(user.id, animated, packnum, count + 1)
+    kang_reply(msg, packname, sticker_emoji)
+
+
 @run_async
 @typing_action
 def kang(update: Update, context: CallbackContext):
     msg = update.effective_message
     user = update.effective_user
     args = context.args
-    packnum = 0
-    packname = "b" + str(user.id) + "_by_" + context.bot.username
-    packname_found = 0
-    max_stickers = 120
-    while packname_found == 0:
-        try:
-            stickerset = context.bot.get_sticker_set(packname)
-            if len(stickerset.stickers) >= max_stickers:
-                packnum += 1
-                packname = ("b" + str(packnum) + "_" + str(user.id) + "_by_" +
-                            context.bot.username)
-            else:
-                packname_found = 1
-        except TelegramError as e:
-            if e.message == "Stickerset_invalid":
-                packname_found = 1
-    kangsticker = "kangsticker.png"
     is_animated = False
     file_id = ""
 
@@ -87,12 +215,12 @@ def kang(update: Update, context: CallbackContext):
             file_id = msg.reply_to_message.document.file_id
         else:
             msg.reply_text("Yea, I can't kang that.")
+            return
 
-        kang_file = context.bot.get_file(file_id)
-        if not is_animated:
-            kang_file.download("kangsticker.png")
-        else:
-            kang_file.download("kangsticker.tgs")
+        # kept in memory, concurrent kangs never share a file
+        kang_file = BytesIO()
+        context.bot.get_file(file_id).download(out=kang_file)
+        kang_file.seek(0)
 
         if args:
             sticker_emoji = str(args[0])
@@ -101,248 +229,52 @@ def kang(update: Update, context: CallbackContext):
         else:
             sticker_emoji = "🤔"
 
-        if not is_animated:
-            try:
-                im = Image.open(kangsticker)
-                maxsize = (512, 512)
-                if (im.width and im.height) < 512:
-                    size1 = im.width
-                    size2 = im.height
-                    if im.width > im.height:
-                        scale = 512 / size1
-                        size1new = 512
-                        size2new = size2 * scale
-                    else:
-                        scale = 512 / size2
-                        size1new = size1 * scale
-                        size2new = 512
-                    size1new = math.floor(size1new)
-                    size2new = math.floor(size2new)
-                    sizenew = (size1new, size2new)
-                    im = im.resize(sizenew)
-                else:
-                    im.thumbnail(maxsize)
-                if not msg.reply_to_message.sticker:
-                    im.save(kangsticker, "PNG")
-                context.bot.add_sticker_to_set(
-                    user_id=user.id,
-                    name=packname,
-                    png_sticker=open("kangsticker.png", "rb"),
-                    emojis=sticker_emoji,
-                )
-                msg.reply_text(
-                    f"I've added this sticker to your pack."
-                    + f"\nEmoji is: {sticker_emoji}",
-                    parse_mode=ParseMode.MARKDOWN,
-                    reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton(
-                    text="View Pack", url=f"t.me/addstickers/{packname}")]])
-                )
-
-            except OSError as e:
-                msg.reply_text("I can only kang images m8.")
-                print(e)
-                return
-
-            except TelegramError as e:
-                if e.message == "Stickerset_invalid":
-                    makepack_internal(
-                        update,
-                        context,
-                        msg,
-                        user,
-                        sticker_emoji,
-                        packname,
-                        packnum,
-                        png_sticker=open("kangsticker.png", "rb"),
-                    )
-                elif e.message == "Sticker_png_dimensions":
-                    im.save(kangsticker, "PNG")
-                    context.bot.add_sticker_to_set(
-                        user_id=user.id,
-                        name=packname,
-                        png_sticker=open("kangsticker.png", "rb"),
-                        emojis=sticker_emoji,
-                    )
-                    msg.reply_text(
-                        f"I've added this sticker to your pack."
-                    + f"\nEmoji is: {sticker_emoji}",
-                    parse_mode=ParseMode.MARKDOWN,
-                    reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton(
-                    text="View Pack", url=f"t.me/addstickers/{packname}")]])
-                    )
-                elif e.message == "Invalid sticker emojis":
-                    msg.reply_text("Invalid emoji(s).")
-                elif e.message == "Stickers_too_much":
-                    msg.reply_text(
-                        "Max packsize reached. Press F to pay respecc.")
-                elif e.message == "Internal Server Error: sticker set not found (500)":
-                    msg.reply_text(
-                        f"I've added this sticker to your pack."
-                    + f"\nEmoji is: {sticker_emoji}",
-                    parse_mode=ParseMode.MARKDOWN,
-                    reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton(
-                    text="View Pack", url=f"t.me/addstickers/{packname}")]])
-                    )
-                print(e)
+        if is_animated:
+            kang_file.name = "kangsticker.tgs"
+            add_to_pack(update, context, kang_file, sticker_emoji, True)
+            return
 
-        else:
-            packname = "animated" + str(user.id) + "_by_" + context.bot.username
-            packname_found = 0
-            max_stickers = 50
-            while packname_found == 0:
-                try:
-                    stickerset = context.bot.get_sticker_set(packname)
-                    if len(stickerset.stickers) >= max_stickers:
-                        packnum += 1
-                        packname = ("animated" + str(packnum) + "_" +
-                                    str(user.id) + "_by_" +
-                                    context.bot.username)
-                    else:
-                        packname_found = 1
-                except TelegramError as e:
-                    if e.message == "Stickerset_invalid":
-                        packname_found = 1
-            try:
-                context.bot.add_sticker_to_set(
-                    user_id=user.id,
-                    name=packname,
-                    tgs_sticker=open("kangsticker.tgs", "rb"),
-                    emojis=sticker_emoji,
-                )
-                msg.reply_text(
-                    f"I've added this sticker to your pack."
-                    + f"\nEmoji is: {sticker_emoji}",
-                    parse_mode=ParseMode.MARKDOWN,
-                    reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton(
-                    text="View Pack", url=f"t.me/addstickers/{packname}")]])
-                )
-            except TelegramError as e:
-                if e.message == "Stickerset_invalid":
-                    makepack_internal(
-                        update,
-                        context,
-                        msg,
-                        user,
-                        sticker_emoji,
-                        packname,
-                        packnum,
-                        tgs_sticker=open("kangsticker.tgs", "rb"),
-                    )
-                elif e.message == "Invalid sticker emojis":
-                    msg.reply_text("Invalid emoji(s).")
-                elif e.message == "Internal Server Error: sticker set not found (500)":
-                    msg.reply_text(
-                        f"I've added this sticker to your pack."
-                    + f"\nEmoji is: {sticker_emoji}",
-                    parse_mode=ParseMode.MARKDOWN,
-                    reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton(
-                    text="View Pack", url=f"t.me/addstickers/{packname}")]])
-                    )
-                print(e)
+        try:
+            sticker = resize_sticker(kang_file)
+        except OSError as e:
+            msg.reply_text("I can only kang images m8.")
+            LOGGER.warning("Could not kang image: %s", e)
+            return
+        add_to_pack(update, context, sticker, sticker_emoji, False)
 
     elif args:
         try:
-            try:
-                urlemoji = msg.text.split(" ")
-                png_sticker = urlemoji[1]
-                sticker_emoji = urlemoji[2]
-            except IndexError:
-                sticker_emoji = "🤔"
-            urllib.urlretrieve(png_sticker, kangsticker)
-            im = Image.open(kangsticker)
-            maxsize = (512, 512)
-            if (im.width and im.height) < 512:
-                size1 = im.width
-                size2 = im.height
-                if im.width > im.height:
-                    scale = 512 / size1
-                    size1new = 512
-                    size2new = size2 * scale
-                else:
-                    scale = 512 / size2
-                    size1new = size1 * scale
-                    size2new = 512
-                size1new = math.floor(size1new)
-                size2new = math.floor(size2new)
-                sizenew = (size1new, size2new)
-                im = im.resize(sizenew)
-            else:
-                im.thumbnail(maxsize)
-            im.save(kangsticker, "PNG")
-            msg.reply_photo(photo=open("kangsticker.png", "rb"))
-            context.bot.add_sticker_to_set(
-                user_id=user.id,
-                name=packname,
-                png_sticker=open("kangsticker.png", "rb"),
-                emojis=sticker_emoji,
-            )
-            msg.reply_text(
-                f"I've added this sticker to your pack."
-                    + f"\nEmoji is: {sticker_emoji}",
-                    parse_mode=ParseMode.MARKDOWN,
-                    reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton(
-                    text="View Pack", url=f"t.me/addstickers/{packname}")]])
-            )
+            urlemoji = msg.text.split(" ")
+            png_sticker = urlemoji[1]
+            sticker_emoji = urlemoji[2]
+        except IndexError:
+            sticker_emoji = "🤔"
+        try:
+            with urllib.urlopen(png_sticker) as response:
+                sticker = resize_sticker(BytesIO(response.read()))
         except OSError as e:
             msg.reply_text("I can only kang images m8.")
-            print(e)
+            LOGGER.warning("Could not kang image: %s", e)
             return
-        except TelegramError as e:
-            if e.message == "Stickerset_invalid":
-                makepack_internal(
-                    update,
-                    context,
-                    msg,
-                    user,
-                    sticker_emoji,
-                    packname,
-                    packnum,
-                    png_sticker=open("kangsticker.png", "rb"),
-                )
-            elif e.message == "Sticker_png_dimensions":
-                im.save(kangsticker, "PNG")
-                context.bot.add_sticker_to_set(
-                    user_id=user.id,
-                    name=packname,
-                    png_sticker=open("kangsticker.png", "rb"),
-                    emojis=sticker_emoji,
-                )
-                msg.reply_text(
-                    f"I've added this sticker to your pack."
-                    + f"\nEmoji is: {sticker_emoji}",
-                    parse_mode=ParseMode.MARKDOWN,
-                    reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton(
-                    text="View Pack", url=f"t.me/addstickers/{packname}")]])
-                )
-            elif e.message == "Invalid sticker emojis":
-                msg.reply_text("Invalid emoji(s).")
-            elif e.message == "Stickers_too_much":
-                msg.reply_text("Max packsize reached. Press F to pay respecc.")
-            elif e.message == "Internal Server Error: sticker set not found (500)":
-                msg.reply_text(
-                    f"I've added this sticker to your pack."
-                    + f"\nEmoji is: {sticker_emoji}",
-                    parse_mode=ParseMode.MARKDOWN,
-                    reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton(
-                    text="View Pack", url=f"t.me/addstickers/{packname}")]])
-                )
-            print(e)
+        msg.reply_photo(photo=sticker)
+        add_to_pack(update, context, sticker, sticker_emoji, False)
+
     else:
+        packnum, count = current_pack(context.bot, user.id, False)
+        # an empty current pack hasn't been created yet
+        if not count:
+            packnum -= 1
+        if packnum < 0:
+            msg.reply_text("Please reply to a sticker, or image to kang it!")
+            return
         packs = "Please reply to a sticker, or image to kang it!\nOh, by the way. here are your packs:\n"
-        if packnum > 0:
-            firstpackname = "a" + str(user.id) + "_by_" + context.bot.username
-            for i in range(0, packnum + 1):
-                if i == 0:
-                    packs += f"[pack](t.me/addstickers/{firstpackname})\n"
-                else:
-                    packs += f"[pack{i}](t.me/addstickers/{packname})\n"
-        else:
-            packs += f"[pack](t.me/addstickers/{packname})"
+        for i in range(0, packnum + 1):
+            packname = pack_name(context.bot, user.id, i, False)
+            if i == 0:
+                packs += f"[pack](t.me/addstickers/{packname})\n"
+            else:
+                packs += f"[pack{i}](t.me/addstickers/{packname})\n"
         msg.reply_text(packs, parse_mode=ParseMode.MARKDOWN)
-    if os.path.isfile("kangsticker.png"):
-        os.remove("kangsticker.png")
-    elif os.path.isfile("kangsticker.tgs"):
-        os.remove("kangsticker.tgs")
 
 
 def makepack_internal(
@@ -380,7 +312,6 @@ def makepack_internal(
             )
 
     except TelegramError as e:
-        print(e)
         if e.message == "Sticker set name is already occupied":
             msg.reply_text(
                 "Your pack can be found [here](t.me/addstickers/%s)" % packname,
@@ -395,23 +326,16 @@ def makepack_internal(
                 ]]),
             )
         elif e.message == "Internal Server Error: created sticker set not found (500)":
-            msg.reply_text(
-                f"I've added this sticker to your pack."
-                    + f"\nEmoji is: {sticker_emoji}",
-                    parse_mode=ParseMode.MARKDOWN,
-                    reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton(
-                    text="View Pack", url=f"t.me/addstickers/{packname}")]])
-            )
+            __remember_pack(user.id, bool(tgs_sticker), packnum, 1)
+            kang_reply(msg, packname, emoji)
+        else:
+            LOGGER.exception("Could not create sticker pack %s", packname)
+            msg.reply_text("Failed to create the sticker pack, try again later.")
         return
 
     if success:
-        msg.reply_text(
-            f"I've added this sticker to your pack."
-                    + f"\nEmoji is: {sticker_emoji}",
-                    parse_mode=ParseMode.MARKDOWN,
-                    reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton(
-                    text="View Pack", url=f"t.me/addstickers/{packname}")]])
-        )
+        __remember_pack(user.id, bool(tgs_sticker), packnum, 1)
+        kang_reply(msg, packname, emoji)
     else:
         msg.reply_text(
             "Failed to create sticker pack. Possibly due to blek mejik.")
@@ -421,11 +345,16 @@ def delsticker(update: Update, context: CallbackContext):
     if not msg.reply_to_message.sticker:
         update.effective_message.reply_text("This only works on sticker baka.")
         return
+    sticker = msg.reply_to_message.sticker
     try: 
-        context.bot.delete_sticker_from_set(msg.reply_to_message.sticker.file_id)
+        context.bot.delete_sticker_from_set(sticker.file_id)
     except: 
         update.effective_message.reply_text("This only works on stickers that I have kanged.")
     else: 
+        # the owner's pack has room again, look it up afresh on the next kang
+        owner = PACK_OWNER.match(sticker.set_name or "")
+        if owner:
+            __forget_pack(int(owner.group(1)), sticker.is_animated)
         update.effective_message.reply_text("I have deleted that sticker for you, now say thanks.")
 
 
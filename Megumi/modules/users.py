@@ -1,18 +1,54 @@
+import threading
+import time
+from collections import OrderedDict
 from io import BytesIO
-from time import sleep
 
 import Megumi.modules.sql.users_sql as sql
-from Megumi import DEV_USERS, LOGGER, OWNER_ID, dispatcher
-from Megumi.modules.helper_funcs.chat_status import dev_plus, sudo_plus
-from Megumi.modules.sql.users_sql import get_all_users
-from telegram import TelegramError, Update
+from Megumi import LOGGER, dispatcher, updater
+from Megumi.modules.helper_funcs.broadcast_engine import (queue_broadcast,
+                                                          resume_broadcasts)
+from Megumi.modules.helper_funcs.chat_status import (dev_plus, get_bot_member,
+                                                     sudo_plus)
+from telegram import Update
 from telegram.error import BadRequest
 from telegram.ext import (CallbackContext, CommandHandler, Filters,
                           MessageHandler, run_async)
 
 USERS_GROUP = 4
 CHAT_GROUP = 5
-DEV_AND_MORE = DEV_USERS.append(int(OWNER_ID))
+USERS_FLUSH_INTERVAL = 10
+
+USER_CHAT_TTL = 60 * 60
+USER_CACHE_SIZE = 50000
+# user_id -> (expires_at, Chat) from bot.get_chat
+USER_CHATS = OrderedDict()
+# user_id -> first name, as last seen on a message
+FIRST_NAMES = OrderedDict()
+USER_CACHE_LOCK = threading.Lock()
+
+
+def __remember(cache, key, value):
+    with USER_CACHE_LOCK:
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > USER_CACHE_SIZE:
+            cache.popitem(last=False)
+
+
+def get_user_chat(user_id):
+    entry = USER_CHATS.get(user_id)
+    if entry and entry[0] > time.monotonic():
+        return entry[1]
+    user_chat = dispatcher.bot.get_chat(user_id)
+    __remember(USER_CHATS, user_id, (time.monotonic() + USER_CHAT_TTL, user_chat))
+    return user_chat
+
+
+def get_first_name(user_id):
+    first_name = FIRST_NAMES.get(user_id)
+    if first_name is None:
+        first_name = get_user_chat(user_id).first_name
+    return first_name
 
 
 def get_user_id(username):
@@ -23,19 +59,25 @@ def get_user_id(username):
     if username.startswith('@'):
         username = username[1:]
 
+    user_id = sql.get_cached_userid(username)
+    if user_id:
+        return user_id
+
     users = sql.get_userid_by_name(username)
 
     if not users:
         return None
 
     elif len(users) == 1:
+        sql.remember_username(users[0].user_id, username)
         return users[0].user_id
 
     else:
         for user_obj in users:
             try:
-                userdat = dispatcher.bot.get_chat(user_obj.user_id)
+                userdat = get_user_chat(user_obj.user_id)
                 if userdat.username == username:
+                    sql.remember_username(userdat.id, username)
                     return userdat.id
 
             except BadRequest as excp:
@@ -53,42 +95,19 @@ def broadcast(update: Update, context: CallbackContext):
     to_send = update.effective_message.text.split(None, 1)
 
     if len(to_send) >= 2:
-        to_group = to_user = False
-        if to_send[0] == '/broadcastgroups':
-            to_group = True
-        if to_send[0] == '/broadcastusers':
-            to_user = True
-        else:
-            to_group = to_user = True
-        chats = sql.get_all_chats() or []
-        users = get_all_users()
-        failed = 0
-        failed_user = 0
-        if to_group:
-            for chat in chats:
-                try:
-                    context.bot.sendMessage(
-                        int(chat.chat_id),
-                        to_send[1],
-                        parse_mode="MARKDOWN",
-                        disable_web_page_preview=True)
-                    sleep(0.1)
-                except TelegramError:
-                    failed += 1
-        if to_user:
-            for user in users:
-                try:
-                    context.bot.sendMessage(
-                        int(user.user_id),
-                        to_send[1],
-                        parse_mode="MARKDOWN",
-                        disable_web_page_preview=True)
-                    sleep(0.1)
-                except TelegramError:
-                    failed_user += 1
+        command = to_send[0].split('@')[0]
+        to_group = command in ('/broadcastall', '/broadcastgroups')
+        to_user = command in ('/broadcastall', '/broadcastusers')
+        broadcast_id = queue_broadcast(context.bot, to_send[1], to_group,
+                                       to_user, update.effective_chat.id)
         update.effective_message.reply_text(
-            f"Broadcast complete.\nGroups failed: {failed}.\nUsers failed: {failed_user}."
-        )
+            f"Broadcast {broadcast_id} queued, I'll report here once it's done.")
+
+
+def resume_broadcast_jobs(context: CallbackContext):
+    resumed = resume_broadcasts(context.bot)
+    if resumed:
+        LOGGER.info("Resuming broadcasts %s", resumed)
 
 
 @run_async
@@ -96,16 +115,28 @@ def log_user(update: Update, context: CallbackContext):
     chat = update.effective_chat
     msg = update.effective_message
 
-    sql.update_user(msg.from_user.id, msg.from_user.username, chat.id,
-                    chat.title)
+    flush = sql.queue_user(msg.from_user.id, msg.from_user.username, chat.id,
+                           chat.title)
+    __remember(FIRST_NAMES, msg.from_user.id, msg.from_user.first_name)
 
     if msg.reply_to_message:
-        sql.update_user(msg.reply_to_message.from_user.id,
-                        msg.reply_to_message.from_user.username, chat.id,
-                        chat.title)
+        flush |= sql.queue_user(msg.reply_to_message.from_user.id,
+                                msg.reply_to_message.from_user.username,
+                                chat.id, chat.title)
 
     if msg.forward_from:
-        sql.update_user(msg.forward_from.id, msg.forward_from.username)
+        flush |= sql.queue_user(msg.forward_from.id, msg.forward_from.username)
+
+    if flush:
+        flush_users(context)
+
+
+def flush_users(context: CallbackContext):
+    try:
+        sql.flush_users()
+    except Exception:
+        LOGGER.exception(
+            "Failed to write buffered users, the next job run retries")
 
 
 @run_async
@@ -136,8 +167,7 @@ def chats(update: Update, context: CallbackContext):
 @run_async
 def chat_checker(update: Update, context: CallbackContext):
     bot = context.bot
-    if update.effective_message.chat.get_member(
-            bot.id).can_send_messages is False:
+    if get_bot_member(update.effective_message.chat).can_send_messages is False:
         bot.leaveChat(update.effective_message.chat.id)
         
 def __stats__():
@@ -161,6 +191,10 @@ dispatcher.add_handler(BROADCAST_HANDLER)
 dispatcher.add_handler(CHATLIST_HANDLER)
 dispatcher.add_handler(CHAT_CHECKER_HANDLER, CHAT_GROUP)
 
+job_flush_users = updater.job_queue.run_repeating(
+    flush_users, interval=USERS_FLUSH_INTERVAL, first=USERS_FLUSH_INTERVAL)
+job_resume_broadcasts = updater.job_queue.run_once(resume_broadcast_jobs, 10)
+
 __mod_name__ = "Users"
 __handlers__ = [(USER_HANDLER, USERS_GROUP), BROADCAST_HANDLER,
                 CHATLIST_HANDLER]
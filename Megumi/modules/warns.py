@@ -14,7 +14,9 @@ from Megumi.modules.helper_funcs.extraction import (extract_text,
                                                           extract_user,
                                                           extract_user_and_text)
 from Megumi.modules.helper_funcs.filters import CustomFilters
+from Megumi.modules.helper_funcs.handlers import moderation_handler
 from Megumi.modules.helper_funcs.misc import split_message
+from Megumi.modules.helper_funcs.regex_helper import match_keyword
 from Megumi.modules.helper_funcs.string_handling import split_quotes
 from Megumi.modules.log_channel import loggable
 from Megumi.modules.sql import warns_sql as sql
@@ -311,17 +313,16 @@ def reply_filter(update: Update, context: CallbackContext) -> str:
     chat: Optional[Chat] = update.effective_chat
     message: Optional[Message] = update.effective_message
 
-    chat_warn_filters = sql.get_chat_warn_triggers(chat.id)
     to_match = extract_text(message)
     if not to_match:
         return ""
 
-    for keyword in chat_warn_filters:
-        pattern = r"( |^|[^\w])" + re.escape(keyword) + r"( |$|[^\w])"
-        if re.search(pattern, to_match, flags=re.IGNORECASE):
-            user: Optional[User] = update.effective_user
-            warn_filter = sql.get_warn_filter(chat.id, keyword)
-            return warn(user, chat, warn_filter.reply, message)
+    keywords, matcher = sql.get_chat_warn_matcher(chat.id)
+    keyword = match_keyword(matcher, keywords, to_match)
+    if keyword:
+        user: Optional[User] = update.effective_user
+        warn_filter = sql.get_warn_filter(chat.id, keyword)
+        return warn(user, chat, warn_filter.reply, message)
     return ""
 
 
@@ -472,4 +473,4 @@ dispatcher.add_handler(RM_WARN_HANDLER)
 dispatcher.add_handler(LIST_WARN_HANDLER)
 dispatcher.add_handler(WARN_LIMIT_HANDLER)
 dispatcher.add_handler(WARN_STRENGTH_HANDLER)
-dispatcher.add_handler(WARN_FILTER_HANDLER, WARN_HANDLER_GROUP)
+dispatcher.add_handler(moderation_handler(WARN_FILTER_HANDLER), WARN_HANDLER_GROUP)
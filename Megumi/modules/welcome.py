@@ -1,21 +1,73 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from html import escape
+import threading
 import time
 import re
 
 from telegram import (ParseMode,InlineKeyboardMarkup,InlineKeyboardButton,ChatPermissions,CallbackQuery)
-from telegram.error import BadRequest
+from telegram.error import BadRequest, RetryAfter, TelegramError
 from telegram.ext import (MessageHandler,Filters,CommandHandler,run_async,CallbackQueryHandler)
 from telegram.utils.helpers import mention_html
 import Megumi.modules.sql.welcome_sql as sql
 from Megumi.modules.sql. global_bans_sql import is_user_gbanned
-from Megumi import dispatcher, OWNER_ID, LOGGER, MESSAGE_DUMP,SUDO_USERS, SUPPORT_USERS, sw
+from Megumi import dispatcher, OWNER_ID, LOGGER, MESSAGE_DUMP,SUDO_USERS, SUPPORT_USERS, RAID_JOIN_RATE
 from Megumi.modules.helper_funcs.chat_status import user_admin, is_user_ban_protected
+from Megumi.modules.helper_funcs.fanout import LimitedBot
 from Megumi.modules.helper_funcs.misc import build_keyboard, revert_buttons
 from Megumi.modules.helper_funcs.msg_types import get_welcome_type
+from Megumi.modules.helper_funcs.reputation import BANNED, check_users, is_flagged
 from Megumi.modules.helper_funcs.alternate import typing_action
 from Megumi.modules.helper_funcs.string_handling import (markdown_parser,escape_invalid_curly_brackets,markdown_to_html,)
 from Megumi.modules.log_channel import loggable
 
+# joins within JOIN_WINDOW seconds of the first one share one welcome message
+JOIN_WINDOW = 3
+# more than RAID_JOIN_RATE joins in RAID_WINDOW seconds put a chat in raid
+# mode - no welcomes, only the join mutes - until RAID_COOLDOWN seconds after
+# the last time the rate was exceeded
+RAID_WINDOW = 60
+RAID_COOLDOWN = 5 * 60
+# user ids per verification button, callback data is limited to 64 bytes
+PROMPT_USERS = 4
+# strong-muted joiners held for a prompt once a raid ends; the rest stay muted
+RAID_HELD_PROMPTS = 200
+MUTE_RETRIES = 3
+
+# chat_id -> monotonic timestamps of the joins within RAID_WINDOW
+JOIN_TIMES = {}
+# chat_id -> end of raid mode, as a monotonic timestamp
+RAID_UNTIL = {}
+# chat_id -> (first update, members to welcome, members to prompt)
+PENDING_WELCOMES = {}
+# chat_id -> (first update, members to prompt once raid mode is over)
+RAID_PROMPTS = {}
+# monotonic time JOIN_TIMES was last swept for idle chats
+LAST_JOIN_SWEEP = [0]
+JOIN_LOCK = threading.Lock()
+MUTE_EXECUTOR = ThreadPoolExecutor(max_workers=4)
+
+SOFT_MUTE = ChatPermissions(
+    can_send_messages=True,
+    can_send_media_messages=False,
+    can_send_other_messages=False,
+    can_invite_users=False,
+    can_pin_messages=False,
+    can_send_polls=False,
+    can_change_info=False,
+    can_add_web_page_previews=False,
+)
+STRONG_MUTE = ChatPermissions(
+    can_send_messages=False,
+    can_invite_users=False,
+    can_pin_messages=False,
+    can_send_polls=False,
+    can_change_info=False,
+    can_send_media_messages=False,
+    can_send_other_messages=False,
+    can_add_web_page_previews=False,
+)
+
 VALID_WELCOME_FORMATTERS = ["first","last","fullname","username","id","count","chatname","mention"]
 
 ENUM_FUNC_MAP = {
@@ -116,199 +168,305 @@ def send(update, message, keyboard, backup_message):
     return msg
 
 
+def __sweep_joins(now):
+    # chats without recent joins and out of raid mode need no state
+    LAST_JOIN_SWEEP[0] = now
+    for chat_id in list(JOIN_TIMES):
+        times = JOIN_TIMES[chat_id]
+        while times and times[0] < now - RAID_WINDOW:
+            times.popleft()
+        if not times and RAID_UNTIL.get(chat_id, 0) <= now:
+            del JOIN_TIMES[chat_id]
+            RAID_UNTIL.pop(chat_id, None)
+
+
+def in_raid_mode(chat_id, joins) -> bool:
+    """Count joins towards the chat's join rate; True while it is raided."""
+    now = time.monotonic()
+    with JOIN_LOCK:
+        if now - LAST_JOIN_SWEEP[0] > RAID_WINDOW:
+            __sweep_joins(now)
+        times = JOIN_TIMES.setdefault(chat_id, deque())
+        times.extend([now] * joins)
+        while times and times[0] < now - RAID_WINDOW:
+            times.popleft()
+        raided = RAID_UNTIL.get(chat_id, 0) > now
+        if len(times) <= RAID_JOIN_RATE:
+            return raided
+        RAID_UNTIL[chat_id] = now + RAID_COOLDOWN
+
+    if not raided:
+        LOGGER.info("Raid mode on in %s", chat_id)
+        try:
+            dispatcher.bot.send_message(
+                chat_id,
+                "Too many people are joining, welcome messages are paused until it calms down.")
+        except TelegramError as excp:
+            LOGGER.warning("Could not announce raid mode in %s: %s", chat_id, excp.message)
+    return True
+
+
+def __restrict(chat_id, user_id, permissions, until_date=None):
+    for attempt in range(MUTE_RETRIES + 1):
+        try:
+            LimitedBot(dispatcher.bot).restrict_chat_member(
+                chat_id, user_id, permissions=permissions, until_date=until_date)
+            return
+        except RetryAfter as excp:
+            if attempt == MUTE_RETRIES:
+                raise
+            time.sleep(excp.retry_after)
+
+
+def __restrict_logged(chat_id, user_id, permissions, until_date=None):
+    try:
+        __restrict(chat_id, user_id, permissions, until_date)
+    except TelegramError as excp:
+        LOGGER.warning("Could not mute %s in %s: %s", user_id, chat_id, excp.message)
+
+
+def mute_members(chat_id, user_ids, welc_mutes):
+    # mutes go out concurrently, but within the bot's global rate
+    if welc_mutes == "soft":
+        permissions, until_date = SOFT_MUTE, int(time.time() + 24 * 60 * 60)
+    else:
+        permissions, until_date = STRONG_MUTE, None
+    for user_id in user_ids:
+        MUTE_EXECUTOR.submit(__restrict_logged, chat_id, user_id, permissions, until_date)
+
+
+def queue_welcome(context, update, members, muted):
+    """Hold members for JOIN_WINDOW seconds, so that everyone joining in the
+    meantime is greeted by the same message."""
+    chat_id = update.effective_chat.id
+    with JOIN_LOCK:
+        pending = PENDING_WELCOMES.get(chat_id)
+        if pending:
+            pending[1].extend(members)
+            pending[2].extend(muted)
+            return
+        PENDING_WELCOMES[chat_id] = (update, list(members), list(muted))
+    context.job_queue.run_once(flush_welcome, JOIN_WINDOW, context=chat_id)
+
+
+def flush_welcome(context):
+    with JOIN_LOCK:
+        update, members, muted = PENDING_WELCOMES.pop(context.job.context)
+    try:
+        send_welcome(context.bot, update, members, muted)
+    except Exception:
+        LOGGER.exception("Could not welcome new members")
+
+
+def hold_prompts(context, update, members):
+    """Keep the human check prompts of members joining during a raid until
+    raid mode is over, then send them all."""
+    chat_id = update.effective_chat.id
+    with JOIN_LOCK:
+        held = RAID_PROMPTS.get(chat_id)
+        if held:
+            held[1].extend(members[:RAID_HELD_PROMPTS - len(held[1])])
+            return
+        RAID_PROMPTS[chat_id] = (update, list(members[:RAID_HELD_PROMPTS]))
+        delay = max(RAID_UNTIL.get(chat_id, 0) - time.monotonic(), 0)
+    context.job_queue.run_once(release_prompts, delay, context=chat_id)
+
+
+def release_prompts(context):
+    chat_id = context.job.context
+    with JOIN_LOCK:
+        delay = RAID_UNTIL.get(chat_id, 0) - time.monotonic()
+        if delay <= 0:
+            update, members = RAID_PROMPTS.pop(chat_id)
+    if delay > 0:
+        # the raid went on, look again once the new cooldown is over
+        context.job_queue.run_once(release_prompts, delay, context=chat_id)
+        return
+    try:
+        send_welcome(context.bot, update, [], members)
+    except Exception:
+        LOGGER.exception("Could not prompt members held during a raid")
+
+
+def send_welcome(bot, update, members, muted):
+    chat = update.effective_chat
+    config = sql.get_welcome_config(chat.id)
+    should_welc, cust_welcome, welc_type = config.welc_pref
+    cust_welcome = markdown_to_html(cust_welcome)
+    sent = None
+
+    if members:
+        # If welcome message is media, send with appropriate function
+        if welc_type != sql.Types.TEXT and welc_type != sql.Types.BUTTON_TEXT:
+            sent = ENUM_FUNC_MAP[welc_type](chat.id, cust_welcome)
+        else:
+            # edge case of empty name - occurs for some bugs.
+            first_names = [new_mem.first_name or "PersonWithNoName" for new_mem in members]
+            first_name = ", ".join(first_names)
+            if cust_welcome:
+                fullnames = []
+                mentions = []
+                usernames = []
+                for new_mem, first in zip(members, first_names):
+                    fullnames.append(
+                        "{} {}".format(first, new_mem.last_name) if new_mem.last_name else first)
+                    mentions.append(mention_html(new_mem.id, first))
+                    usernames.append(
+                        "@" + escape(new_mem.username) if new_mem.username else mentions[-1])
+
+                valid_format = escape_invalid_curly_brackets(
+                    cust_welcome, VALID_WELCOME_FORMATTERS
+                )
+                res = valid_format.format(
+                    first=escape(first_name),
+                    last=escape(", ".join(
+                        new_mem.last_name or first for new_mem, first in zip(members, first_names))),
+                    fullname=escape(", ".join(fullnames)),
+                    username=", ".join(usernames),
+                    mention=", ".join(mentions),
+                    count=chat.get_members_count(),
+                    chatname=escape(chat.title),
+                    id=", ".join(str(new_mem.id) for new_mem in members),
+                )
+                keyb = build_keyboard(config.welc_buttons)
+            else:
+                res = sql.DEFAULT_WELCOME.format(first=escape(first_name))
+                keyb = []
+
+            keyboard = InlineKeyboardMarkup(keyb)
+
+            sent = send(
+                update, res, keyboard, sql.DEFAULT_WELCOME.format(first=first_name, chatname=escape(chat.title))
+            )  # type: Optional[Message]
+
+    # Join welcome: strong mute, one prompt for every few muted users
+    for i in range(0, len(muted), PROMPT_USERS):
+        prompt_members = muted[i:i + PROMPT_USERS]
+        bot.send_message(
+            chat.id,
+            "Hey {}!\nClick the button below to start talking.".format(
+                ", ".join(mention_html(new_mem.id, new_mem.first_name) for new_mem in prompt_members)
+            ),
+            reply_markup=InlineKeyboardMarkup(
+                [
+                    [
+                        InlineKeyboardButton(
+                            text="Yes, I'm a human",
+                            callback_data="user_join_({})".format(
+                                ",".join(str(new_mem.id) for new_mem in prompt_members)
+                            ),
+                        )
+                    ]
+                ]
+            ),
+            parse_mode=ParseMode.HTML,
+        )
+
+    # a prompt-only call (e.g. after a raid) has no welcome to replace the old one
+    prev_welc = config.clean_welcome
+    if prev_welc and members:
+        try:
+            bot.delete_message(chat.id, prev_welc)
+        except BadRequest:
+            pass
+
+        if sent:
+            sql.set_clean_welcome(chat.id, sent.message_id)
+
+
 @run_async
 def new_member(update, context):
-    bot = context.args
     chat = update.effective_chat
     user = update.effective_user
-    msg = update.effective_message
     chat_name = chat.title or chat.first or chat.username
-    should_welc, cust_welcome, welc_type = sql.get_welc_pref(chat.id)
-    cust_welcome = markdown_to_html(cust_welcome)
-    welc_mutes = sql.welcome_mutes(chat.id)
-    user_id = user.id
-    human_checks = sql.get_human_checks(user_id, chat.id)
-    time_value = sql.getKickTime(str(chat.id))
-    if should_welc:
-        sent = None
-        new_members = update.effective_message.new_chat_members
-        for new_mem in new_members:
-
-            reply = update.message.message_id
-            cleanserv = sql.clean_service(chat.id)
-            # Clean service welcome
-            if cleanserv:
-                try:
-                    dispatcher.bot.delete_message(chat.id, update.message.message_id)
-                except BadRequest:
-                    pass
-                reply = False
-
-            # Ignore spamwatch banned users
-            try:
-                sw = sw.get_ban(int(new_mem.id))
-                if sw:
-                    return
-            except Exception:
-                pass
+    config = sql.get_welcome_config(chat.id)
+    should_welc, _, _ = config.welc_pref
+    if not should_welc:
+        return
 
-            # Ignore gbanned users
-            if is_user_gbanned(new_mem.id):
-                return
+    new_members = update.effective_message.new_chat_members
+    raided = in_raid_mode(chat.id, len(new_members))
+    welc_mutes = config.welcome_mutes
+    human_checked = sql.get_human_checked([new_mem.id for new_mem in new_members], chat.id)
 
-            # Give the owner a special welcome
-            if new_mem.id == OWNER_ID:
-                update.effective_message.reply_text(
-                    "Master is in the houseeee, let's get this party started!",
-                    reply_to_message_id=reply,
-                )
-                continue
+    reply = update.message.message_id
+    # Clean service welcome
+    if config.clean_service:
+        try:
+            dispatcher.bot.delete_message(chat.id, update.message.message_id)
+        except BadRequest:
+            pass
+        reply = False
 
-            elif new_mem.id in SUDO_USERS or new_mem.id in SUPPORT_USERS:
-                update.effective_message.reply_text("*Oh no!* A Degenerate Weeb just joined your chat.", 
-                	parse_mode=ParseMode.MARKDOWN
-                )
-                continue
-
-            # Make bot greet admins
-            elif new_mem.id == context.bot.id:
-                update.effective_message.reply_text("Hey {}, I'm {}! Thank you for adding me to {}" 
-                " and be sure to check /help in PM for more commands and tricks!".format(user.first_name, context.bot.first_name, chat_name))
-                context.bot.send_message(
-                    MESSAGE_DUMP,
-                    "Megumi have been added to <pre>{}</pre> with ID: \n<pre>{}</pre>".format(
-                        chat.title, chat.id
-                    ),
-                    parse_mode=ParseMode.HTML,
-                )
-            else:
-                # If welcome message is media, send with appropriate function
-                if welc_type != sql.Types.TEXT and welc_type != sql.Types.BUTTON_TEXT:
-                    sent = ENUM_FUNC_MAP[welc_type](chat.id, cust_welcome)
-                    # print(bool(sent))
-                    continue
-                # else, move on
-                first_name = (
-                    new_mem.first_name or "PersonWithNoName"
-                )  # edge case of empty name - occurs for some bugs.
-
-                if cust_welcome:
-                    if new_mem.last_name:
-                        fullname = "{} {}".format(first_name, new_mem.last_name)
-                    else:
-                        fullname = first_name
-                    count = chat.get_members_count()
-                    mention = mention_html(new_mem.id, first_name)
-                    if new_mem.username:
-                        username = "@" + escape(new_mem.username)
-                    else:
-                        username = mention
-
-                    valid_format = escape_invalid_curly_brackets(
-                        cust_welcome, VALID_WELCOME_FORMATTERS
-                    )
-                    res = valid_format.format(
-                        first=escape(first_name),
-                        last=escape(new_mem.last_name or first_name),
-                        fullname=escape(fullname),
-                        username=username,
-                        mention=mention,
-                        count=count,
-                        chatname=escape(chat.title),
-                        id=new_mem.id,
-                    )
-                    buttons = sql.get_welc_buttons(chat.id)
-                    keyb = build_keyboard(buttons)
-                else:
-                    res = sql.DEFAULT_WELCOME.format(first=first_name)
-                    keyb = []
+    # one concurrent lookup for the whole join; slow services answer "unknown"
+    verdicts = check_users([new_mem.id for new_mem in new_members])
+    to_welcome = []
+    to_mute = []
+    for new_mem in new_members:
+        # Ignore spamwatch/CAS banned and gbanned users
+        if verdicts[new_mem.id] == BANNED or is_user_gbanned(new_mem.id):
+            continue
+
+        # Give the owner a special welcome
+        if new_mem.id == OWNER_ID:
+            update.effective_message.reply_text(
+                "Master is in the houseeee, let's get this party started!",
+                reply_to_message_id=reply,
+            )
+            continue
 
-                keyboard = InlineKeyboardMarkup(keyb)
+        elif new_mem.id in SUDO_USERS or new_mem.id in SUPPORT_USERS:
+            update.effective_message.reply_text("*Oh no!* A Degenerate Weeb just joined your chat.", 
+            	parse_mode=ParseMode.MARKDOWN
+            )
+            continue
+
+        # Make bot greet admins
+        elif new_mem.id == context.bot.id:
+            update.effective_message.reply_text("Hey {}, I'm {}! Thank you for adding me to {}" 
+            " and be sure to check /help in PM for more commands and tricks!".format(user.first_name, context.bot.first_name, chat_name))
+            context.bot.send_message(
+                MESSAGE_DUMP,
+                "Megumi have been added to <pre>{}</pre> with ID: \n<pre>{}</pre>".format(
+                    chat.title, chat.id
+                ),
+                parse_mode=ParseMode.HTML,
+            )
+            continue
 
-                sent = send(
-                    update, res, keyboard, sql.DEFAULT_WELCOME.format(first=first_name, chatname=escape(chat.title))
-                )  # type: Optional[Message]
-
-                # User exception from mutes:
-                if (
-                    is_user_ban_protected(chat, new_mem.id, chat.get_member(new_mem.id))
-                    or human_checks
-                ):
-                    continue
-                # Join welcome: soft mute
-                if welc_mutes == "soft":
-                    context.bot.restrict_chat_member(
-                        chat.id,
-                        new_mem.id,
-                        permissions=ChatPermissions(
-                            can_send_messages=True,
-                            can_send_media_messages=False,
-                            can_send_other_messages=False,
-                            can_invite_users=False,
-                            can_pin_messages=False,
-                            can_send_polls=False,
-                            can_change_info=False,
-                            can_add_web_page_previews=False,
-                            until_date=(int(time.time() + 24 * 60 * 60)),
-                        ),
-                    )
-                # Join welcome: strong mute
-                if welc_mutes == "strong":
-                    new_join_mem = "Hey {}!".format(
-                        mention_html(user.id, new_mem.first_name)
-                    )
-                    msg.reply_text(
-                        "{}\nClick the button below to start talking.".format(
-                            new_join_mem
-                        ),
-                        reply_markup=InlineKeyboardMarkup(
-                            [
-                                [
-                                    InlineKeyboardButton(
-                                        text="Yes, I'm a human",
-                                        callback_data="user_join_({})".format(
-                                            new_mem.id
-                                        ),
-                                    )
-                                ]
-                            ]
-                        ),
-                        parse_mode=ParseMode.HTML,
-                        reply_to_message_id=reply,
-                    )
-                    context.bot.restrict_chat_member(
-                        chat.id,
-                        new_mem.id,
-                        permissions=ChatPermissions(
-                            can_send_messages=False,
-                            can_invite_users=False,
-                            can_pin_messages=False,
-                            can_send_polls=False,
-                            can_change_info=False,
-                            can_send_media_messages=False,
-                            can_send_other_messages=False,
-                            can_add_web_page_previews=False,
-                        ),
-                    )
-        prev_welc = sql.get_clean_pref(chat.id)
-        if prev_welc:
-            try:
-                context.bot.delete_message(chat.id, prev_welc)
-            except BadRequest:
-                pass
+        if not raided:
+            to_welcome.append(new_mem)
+
+        # User exception from mutes:
+        if (
+            welc_mutes in ("soft", "strong")
+            and not is_user_ban_protected(chat, new_mem.id)
+            and new_mem.id not in human_checked
+        ):
+            to_mute.append(new_mem)
 
-            if sent:
-                sql.set_clean_welcome(chat.id, sent.message_id)
+    if to_mute:
+        mute_members(chat.id, [new_mem.id for new_mem in to_mute], welc_mutes)
+
+    # while raided only the mutes are applied, nobody gets greeted; strong
+    # mutes get their prompt once the raid is over
+    prompts = to_mute if welc_mutes == "strong" else []
+    if raided:
+        if prompts:
+            hold_prompts(context, update, prompts)
+    elif to_welcome or prompts:
+        queue_welcome(context, update, to_welcome, prompts)
 
 
 @run_async
 def left_member(update, context):
     chat = update.effective_chat  # type: Optional[Chat]
-    should_goodbye, cust_goodbye, goodbye_type = sql.get_gdbye_pref(chat.id)
+    config = sql.get_welcome_config(chat.id)
+    should_goodbye, cust_goodbye, goodbye_type = config.gdbye_pref
     cust_goodbye = markdown_to_html(cust_goodbye)
     if should_goodbye:
         reply = update.message.message_id
-        cleanserv = sql.clean_service(chat.id)
+        cleanserv = config.clean_service
         # Clean service welcome
         if cleanserv:
             try:
@@ -324,13 +482,9 @@ def left_member(update, context):
             if is_user_gbanned(left_mem.id):
                 return
 
-            # Ignore spamwatch banned users
-            try:
-                sw = spamwtc.get_ban(int(left_mem.id))
-                if sw:
-                    return
-            except:
-                pass
+            # Ignore spamwatch/CAS banned users
+            if is_flagged(left_mem.id):
+                return
 
             # Ignore bot being kicked
             if left_mem.id == context.bot.id:
@@ -376,7 +530,7 @@ def left_member(update, context):
                     chatname=escape(chat.title),
                     id=left_mem.id,
                 )
-                buttons = sql.get_gdbye_buttons(chat.id)
+                buttons = config.gdbye_buttons
                 keyb = build_keyboard(buttons)
 
             else:
@@ -773,10 +927,10 @@ def user_button(update, context):
     query = update.callback_query  # type: Optional[CallbackQuery]
     match = re.match(r"user_join_\((.+?)\)", query.data)
     message = update.effective_message  # type: Optional[Message]
-    db_checks = sql.set_human_checks(user.id, chat.id)
-    join_user = int(match.group(1))
+    join_users = [int(user_id) for user_id in match.group(1).split(",")]
 
-    if join_user == user.id:
+    if user.id in join_users:
+        sql.set_human_checks(user.id, chat.id)
         query.answer(text="Yus! You're a human, Unmuted!")
         context.bot.restrict_chat_member(
             chat.id,
@@ -792,8 +946,25 @@ def user_button(update, context):
                 can_add_web_page_previews=True,
             ),
         )
-        context.bot.deleteMessage(chat.id, message.message_id)
-        db_checks
+        join_users.remove(user.id)
+        if join_users:
+            # the others on the prompt still need the button
+            message.edit_reply_markup(
+                reply_markup=InlineKeyboardMarkup(
+                    [
+                        [
+                            InlineKeyboardButton(
+                                text="Yes, I'm a human",
+                                callback_data="user_join_({})".format(
+                                    ",".join(str(user_id) for user_id in join_users)
+                                ),
+                            )
+                        ]
+                    ]
+                )
+            )
+        else:
+            context.bot.deleteMessage(chat.id, message.message_id)
     else:
         query.answer(text="You're not allowed to do this!")
 
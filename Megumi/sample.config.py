@@ -46,6 +46,11 @@ class Config(object):
     DEL_CMDS = True  #Delete commands that users dont have access to, like delete /ban if a non admin uses it.
     STRICT_GBAN = True
     WORKERS = 8  # Number of subthreads to use. Set as number of threads your processor uses
+    UPDATE_CHAT_RATE = 10  # Updates per second handled for one chat, extra ones are dropped
+    UPDATE_CHAT_BURST = 20
+    UPDATE_USER_RATE = 5  # Same, for one user
+    UPDATE_USER_BURST = 10
+    RAID_JOIN_RATE = 30  # Joins per minute above which welcomes are paused and only join mutes applied
     BAN_STICKER = ''  # banhammer marie sticker
     ALLOW_EXCL = True  # Allow ! commands as well as / (Leave this to true so that blacklist can work)
     CASH_API_KEY = 'awoo'
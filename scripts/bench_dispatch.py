@@ -0,0 +1,137 @@
+"""Micro-benchmark for command routing in the dispatcher.
+
+Drives the real extract_command / route from
+Megumi.modules.helper_funcs.handlers over a dispatcher filled with real
+CustomCommandHandler / CustomMessageHandler instances, and compares them with
+the stock dispatch, which asks every handler of every group in turn.
+
+Needs python-telegram-bot; the bot config and the blacklisted users table are
+replaced by stand-ins so that neither a config file nor a database is needed.
+
+    python scripts/bench_dispatch.py [--commands 300] [--groups 14]
+"""
+import argparse
+import os
+import sys
+import timeit
+import types
+from queue import Queue
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BOT_USERNAME = "MegumiBot"
+
+
+def __stub_package(name, path=None, **attrs):
+    module = types.ModuleType(name)
+    if path is not None:
+        module.__path__ = [path]
+    module.__dict__.update(attrs)
+    sys.modules[name] = module
+    return module
+
+
+# handlers.py only needs ALLOW_EXCL from the config and one blacklist lookup
+# from the database; everything else is imported for real
+__stub_package("Megumi", os.path.join(ROOT, "Megumi"), ALLOW_EXCL=True)
+__stub_package("Megumi.modules", os.path.join(ROOT, "Megumi", "modules"))
+__stub_package("Megumi.modules.sql",
+               os.path.join(ROOT, "Megumi", "modules", "sql"))
+__stub_package("Megumi.modules.sql.blacklistusers_sql",
+               is_user_blacklisted=lambda user_id: False)
+
+from Megumi.modules.helper_funcs import handlers  # noqa: E402
+from telegram import Bot, Update, User  # noqa: E402
+from telegram.ext import Dispatcher, Filters  # noqa: E402
+
+
+def build_dispatcher(commands, groups):
+    bot = Bot("123456:benchmark")
+    # username is normally fetched with get_me
+    bot._bot = User(123456, "Megumi", True, username=BOT_USERNAME)
+    dispatcher = Dispatcher(bot, Queue(), use_context=True)
+
+    def callback(update, context):
+        pass
+
+    for i in range(commands):
+        handlers.add_handler(
+            dispatcher, handlers.CustomCommandHandler(f"cmd{i}", callback))
+    for _ in range(20):
+        handlers.add_handler(
+            dispatcher, handlers.CustomMessageHandler(Filters.photo, callback))
+    for group in range(1, groups):
+        handlers.add_handler(
+            dispatcher,
+            handlers.CustomMessageHandler(Filters.photo, callback), group)
+    return dispatcher
+
+
+def make_update(bot, text, command_length=0):
+    message = {
+        "message_id": 1,
+        "date": 0,
+        "chat": {"id": -100123, "type": "supergroup", "title": "bench"},
+        "from": {"id": 42, "is_bot": False, "first_name": "user"},
+        "text": text,
+    }
+    if command_length:
+        message["entities"] = [{
+            "type": "bot_command",
+            "offset": 0,
+            "length": command_length
+        }]
+    return Update.de_json({"update_id": 1, "message": message}, bot)
+
+
+def linear(dispatcher, update):
+    # what Dispatcher.process_update did before routing
+    matched = []
+    for group in dispatcher.groups:
+        for handler in dispatcher.handlers[group]:
+            check = handler.check_update(update)
+            if check is not None and check is not False:
+                matched.append(handler)
+                break
+    return matched
+
+
+def routed(dispatcher, update):
+    command = handlers.extract_command(update, dispatcher.bot.username)
+    matched = []
+    for group in dispatcher.groups:
+        for handler in handlers.route(dispatcher, group, command):
+            check = handler.check_update(update)
+            if check is not None and check is not False:
+                matched.append(handler)
+                break
+    return matched
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--commands", type=int, default=300)
+    parser.add_argument("--groups", type=int, default=14)
+    parser.add_argument("--number", type=int, default=5000)
+    options = parser.parse_args()
+
+    dispatcher = build_dispatcher(options.commands, options.groups)
+    command = f"/cmd{options.commands - 50}"
+    updates = [
+        ("command",
+         make_update(dispatcher.bot, command + " some args here",
+                     len(command))),
+        ("plain text",
+         make_update(dispatcher.bot, "hello there how are you")),
+    ]
+    for name, update in updates:
+        # routing must pick exactly the handlers the full scan picks
+        assert linear(dispatcher, update) == routed(dispatcher, update), name
+        for dispatch in (linear, routed):
+            seconds = timeit.timeit(lambda: dispatch(dispatcher, update),
+                                    number=options.number)
+            print(f"{name:10} {dispatch.__name__:6}: "
+                  f"{seconds / options.number * 1e6:.1f} us per update")
+
+
+if __name__ == "__main__":
+    main()